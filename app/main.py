@@ -31,6 +31,9 @@ from src.routes import (
     events,
     rates,
 )
+from src.services.ai_models import ai_models_client
+from src.services.coordination import job_coordinator
+from src.services.notifications import limit_warning_notifier
 from src.services.scheduler import scheduler
 
 
@@ -69,10 +72,15 @@ async def startup():
     except Exception:
         return False
     await pool_redis_db.disconnect()
-    await redis_db0.flushall()
+    # only the rate limiter database, the other ones keep the state shared by
+    # the replicas: the scheduler lease and the sent limit warnings
+    await redis_db0.flushdb()
     await FastAPILimiter.init(redis_db0)
     os.system("alembic upgrade head")
+    await job_coordinator.startup()
+    await limit_warning_notifier.startup()
     scheduler.start()
+    await ai_models_client.startup()
     print("aaa")
     return True
 
@@ -82,8 +90,11 @@ async def shutdown():
     Handles shutdown events.
 
     """
+    await ai_models_client.shutdown()
+    await limit_warning_notifier.shutdown()
+    await job_coordinator.shutdown()
     await pool_redis_db.disconnect()
-    await redis_db0.flushall()
+    await redis_db0.flushdb()
     await engine.dispose()
 
 
@@ -255,6 +266,51 @@ async def healthchecker(session: AsyncSession = Depends(get_session)):
     return {"message": "OK"}
 
 
+@app.get(
+    BASE_API_ROUTE + "/healthchecker/ai_models",
+    dependencies=[
+        Depends(
+            RateLimiter(
+                times=settings.rate_limiter_times,
+                seconds=settings.rate_limiter_seconds,
+            )
+        )
+    ],
+)
+async def ai_models_healthchecker():
+    """
+    Handles a GET-operation to '/api/healthchecker/ai_models' route and reports the saturation of the client of the recognition container.
+
+    :return: The counters of the calls and the connections.
+    :rtype: dict
+    """
+    return ai_models_client.stats()
+
+
+@app.get(
+    BASE_API_ROUTE + "/healthchecker/scheduler",
+    dependencies=[
+        Depends(
+            RateLimiter(
+                times=settings.rate_limiter_times,
+                seconds=settings.rate_limiter_seconds,
+            )
+        )
+    ],
+)
+async def scheduler_healthchecker():
+    """
+    Handles a GET-operation to '/api/healthchecker/scheduler' route and reports the coordination of the scheduler jobs of the replica.
+
+    :return: The role of the replica, the counters of the lease renewals and the slice assignments, and of the limit warnings.
+    :rtype: dict
+    """
+    return {
+        **job_coordinator.stats(),
+        "limit_warnings": limit_warning_notifier.stats(),
+    }
+
+
 class StaticFilesCache(StaticFiles):
     def __init__(
         self,
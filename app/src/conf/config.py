@@ -1,9 +1,9 @@
 import pathlib
+from typing import Literal
 
 from pydantic import ConfigDict
 from pydantic_settings import BaseSettings
 
-
 BASE_DIR = pathlib.Path(__file__).resolve().parent.parent.parent
 STATIC_DIR = BASE_DIR / "static"
 REPORTS_DIR = BASE_DIR / "reports"
@@ -45,6 +45,39 @@ class Settings(BaseSettings):
     cloudinary_api_secret: str
     tensorflow_container_name: str
     tensorflow_port: int
+    tensorflow_connect_timeout: float = 5.0
+    tensorflow_read_timeout: float = 8.0
+    tensorflow_write_timeout: float = 30.0
+    tensorflow_pool_timeout: float = 5.0
+    tensorflow_max_connections: int = 20
+    tensorflow_max_keepalive_connections: int = 10
+    tensorflow_keepalive_expiry: float = 30.0
+    tensorflow_http2: bool = False
+    tensorflow_max_concurrency: int = 10
+    tensorflow_replicas: list[str] = []
+    tensorflow_deadline: float = 10.0
+    tensorflow_retries: int = 2
+    tensorflow_retry_budget: float = 0.2
+    tensorflow_retry_backoff: float = 0.1
+    tensorflow_hedge_delay: float = 1.0
+    tensorflow_breaker_failures: int = 5
+    tensorflow_breaker_slow_call: float = 5.0
+    tensorflow_breaker_reset: float = 30.0
+    tensorflow_degraded_mode: bool = False
+    tensorflow_provisional_queue_size: int = 100
+    tensorflow_backend: Literal["local", "remote", "auto"] = "remote"
+    tensorflow_model_path: pathlib.Path = pathlib.Path("models")
+    tensorflow_local_workers: int = 1
+    tensorflow_memo_ttl: float = 5.0
+    tensorflow_memo_size: int = 1000
+    scheduler_mode: Literal["all", "leader", "partitioned"] = "leader"
+    scheduler_lease_ttl: float = 15.0
+    scheduler_charge_catch_up: int = 5
+    rates_index_max_age: float = 300.0
+    rates_timezone: str = "UTC"
+    limit_warning_ttl: int = 86400
+    notifications_queue_size: int = 1000
+    notifications_workers: int = 2
     test: bool
 
 
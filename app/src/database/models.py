@@ -20,6 +20,7 @@ from sqlalchemy import (
     CheckConstraint,
     Table,
     Column,
+    Index,
     func,
     text,
 )
@@ -244,6 +245,11 @@ class Reservation(IdAbstract, CreatedAtUpdatedAtAbstract):
     )
     debit: Mapped[float] = mapped_column(Numeric(precision=10, scale=2))
     credit: Mapped[float] = mapped_column(Numeric(precision=10, scale=2))
+    # The minute the reservation was charged for last, so the charging of one
+    # minute by several replicas is applied once
+    charged_until: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True), nullable=True
+    )
     user_id: Mapped[UUID | int] = (
         mapped_column(
             Integer,
@@ -301,12 +307,25 @@ class TrxType(enum.Enum):
 class FinancialTransaction(IdAbstract):
     __tablename__ = "financial_transactions"
     __mapper_args__ = {"eager_defaults": True}
+    __table_args__ = (
+        Index(
+            "ix_financial_transactions_open_charges",
+            "reservation_id",
+            postgresql_where=text("is_open"),
+        ),
+    )
     trx_date: Mapped[datetime] = mapped_column(
         DateTime(timezone=True), server_default=func.now()
     )
     trx_type: Mapped[Enum] = mapped_column(ENUM(TrxType))
     debit: Mapped[float] = mapped_column(Numeric(precision=10, scale=2))
     credit: Mapped[float] = mapped_column(Numeric(precision=10, scale=2))
+    # A charge accrues per minute in one row from trx_date to period_end until
+    # the row is closed on the payment, the check-out or the day boundary
+    period_end: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=True)
+    is_open: Mapped[bool] = mapped_column(
+        Boolean, default=False, server_default=text("false")
+    )
     user_id: Mapped[UUID | int] = (
         mapped_column(
             Integer,
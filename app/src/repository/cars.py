@@ -4,12 +4,18 @@ Module of cars' CRUD
 
 from typing import List
 
-from sqlalchemy import select, UUID
+from sqlalchemy import select, update, UUID
 from sqlalchemy.engine.result import ScalarResult
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from src.conf.config import settings
-from src.database.models import User, Car
+from src.database.models import (
+    User,
+    Car,
+    FinancialTransaction,
+    Reservation,
+    Status,
+)
 from src.schemas.cars import CarRecognizedPlateModel, CarUpdateModel
 from src.services.cloudinary import cloudinary_service
 
@@ -183,6 +189,65 @@ async def is_car_blocked(plate: str, session: AsyncSession) -> bool | None:
         return car.is_blocked
 
 
+async def resolve_provisional_car(
+    provisional_plate: str, plate: str, session: AsyncSession
+) -> Car | None:
+    """
+    Gives the car checked in with a provisional plate its recognized plate.
+
+    If another car already has the plate, the provisional car is merged into
+    it: its reservations and their charges in the ledger are moved to the car
+    and its owner, and the provisional car is deleted. A car with the plate
+    that is parked already is not merged, since one of the recognitions is
+    wrong, and the provisional car is left to the staff.
+
+    :param provisional_plate: The provisional plate of the car.
+    :type provisional_plate: str
+    :param plate: The recognized plate of the car.
+    :type plate: str
+    :param session: The database session.
+    :type session: AsyncSession
+    :return: The car with the recognized plate, or None if the provisional car does not exist or can't be merged.
+    :rtype: Car | None
+    """
+    provisional_car = await read_car_by_plate(provisional_plate, session)
+    if provisional_car is None:
+        return None
+    car = await read_car_by_plate(plate, session)
+    if car is None:
+        provisional_car.plate = plate
+        await session.commit()
+        return provisional_car
+    stmt = select(Reservation.id).filter(
+        Reservation.car_id == car.id, Reservation.resv_status == Status.CHECKED_IN
+    )
+    in_house = await session.execute(stmt)
+    if in_house.scalar() is not None:
+        return None
+    reservation_ids = select(Reservation.id).filter(
+        Reservation.car_id == provisional_car.id
+    )
+    if car.user_id is not None:
+        stmt = (
+            update(FinancialTransaction)
+            .filter(
+                FinancialTransaction.reservation_id.in_(reservation_ids),
+                FinancialTransaction.user_id.is_(None),
+            )
+            .values(user_id=car.user_id)
+        )
+        await session.execute(stmt)
+    stmt = (
+        update(Reservation)
+        .filter(Reservation.car_id == provisional_car.id)
+        .values(car_id=car.id, user_id=car.user_id)
+    )
+    await session.execute(stmt)
+    await session.delete(provisional_car)
+    await session.commit()
+    return car
+
+
 async def read_cars_by_username(
     username: str,
     session: AsyncSession,
@@ -8,6 +8,7 @@ from sqlalchemy.ext.asyncio import AsyncSession
 
 from src.conf.config import settings
 from src.database.models import User, FinancialTransaction
+from src.repository import reservations as repository_reservations
 from src.schemas.financial_transactions import FinancialTransactionModel
 from src.services.cloudinary import cloudinary_service
 
@@ -16,7 +17,10 @@ async def create_financial_transaction(
     body: FinancialTransactionModel, session: AsyncSession
 ) -> FinancialTransaction:
     """
-    Creates a new financial transaction.
+    Creates a new financial transaction and adds its amounts to the balance of
+    its reservation in the same database transaction. The open charge period
+    of the reservation is closed, so the charges after the payment go to a
+    new one.
 
     :param body: The body for the financial transaction to create.
     :type body: FinancialTransactionModel
@@ -27,6 +31,16 @@ async def create_financial_transaction(
     """
     financial_transaction = FinancialTransaction(**body.model_dump())
     session.add(financial_transaction)
+    if financial_transaction.reservation_id:
+        await repository_reservations.close_charge_periods(
+            session, reservation_id=financial_transaction.reservation_id
+        )
+        await repository_reservations.apply_to_balance(
+            financial_transaction.reservation_id,
+            financial_transaction.debit,
+            financial_transaction.credit,
+            session,
+        )
     await session.commit()
     await session.refresh(financial_transaction)
     return financial_transaction
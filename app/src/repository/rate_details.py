@@ -6,6 +6,7 @@ from src.schemas.rate_details import (
     RateDetailUpdate,
     RateDetailResponse,
 )
+from src.services.rate_index import rate_index
 from typing import List
 
 
@@ -25,6 +26,7 @@ async def create_rate_detail(
     session.add(rate_detail)
     await session.commit()
     await session.refresh(rate_detail)
+    await rate_index.refresh_rate(rate_detail.rate_id, session)
     return rate_detail
 
 
@@ -84,6 +86,7 @@ async def update_rate_detail(
             if hasattr(rate_detail, key) and value is not None:
                 setattr(rate_detail, key, value)
         await session.commit()
+        await rate_index.refresh_rate(rate_detail.rate_id, session)
     return rate_detail
 
 
@@ -103,4 +106,5 @@ async def delete_rate_detail(
     if rate_detail:
         session.delete(rate_detail)
         await session.commit()
+        await rate_index.refresh_rate(rate_detail.rate_id, session)
     return rate_detail
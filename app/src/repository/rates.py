@@ -1,9 +1,13 @@
+from datetime import datetime, timezone
+from decimal import Decimal
+
 from pydantic import UUID4
 
 from sqlalchemy import select
 from sqlalchemy.ext.asyncio import AsyncSession
-from src.database.models import User, Rate, RateDetail
+from src.database.models import User, Rate
 from src.schemas.rates import RateModel, RateUpdate
+from src.services.rate_index import rate_index
 from typing import List
 
 
@@ -79,6 +83,7 @@ async def update_rate(
             if hasattr(rate, key) and value is not None:
                 setattr(rate, key, value)
         await session.commit()
+        await rate_index.refresh_rate(rate.id, session)
     return rate
 
 
@@ -96,6 +101,7 @@ async def delete_rate(rate_id: UUID4 | int, session: AsyncSession) -> Rate | Non
     if rate:
         session.delete(rate)
         await session.commit()
+        await rate_index.refresh_rate(rate.id, session)
     return rate
 
 
@@ -105,9 +111,19 @@ async def get_default_rate(session: AsyncSession) -> Rate | None:
     return rate.scalar()
 
 
-async def get_rate_amount(rate_id: UUID4 | int, session: AsyncSession):
-    rate = await read_rate_by_id(rate_id, session)
-    stmt = select(RateDetail).filter(RateDetail.rate_id == rate.id)
-    rate_details = await session.execute(stmt)
-    rate_detail = rate_details.scalar()
-    return rate_detail.amount
+async def get_rate_amount(
+    rate_id: UUID4 | int, session: AsyncSession, at: datetime | None = None
+) -> Decimal | None:
+    """
+    Gets the amount of a rate at a moment by its date range and hour window.
+    :param rate_id: The ID of the rate.
+    :type rate_id: UUID4 | int
+    :param session: The database session.
+    :type session: AsyncSession
+    :param at: The moment, now by default.
+    :type at: datetime | None
+    :return: The amount of the rate, or None if it has no details.
+    :rtype: Decimal | None
+    """
+    await rate_index.ensure_fresh(session)
+    return rate_index.resolve(rate_id, at or datetime.now(timezone.utc))
@@ -2,14 +2,38 @@
 Module for performing CRUD operations on reservations.
 """
 
+from datetime import datetime, timedelta, timezone
 from typing import Union
 from pydantic import UUID4
 
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, func, and_
+from sqlalchemy import (
+    select,
+    func,
+    and_,
+    or_,
+    bindparam,
+    case,
+    insert,
+    update,
+    Integer,
+    true,
+)
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.functions import FunctionElement
 
-from src.database.models import Reservation, FinancialTransaction, Status
+from src.conf.config import settings
+from src.database.models import (
+    Car,
+    FinancialTransaction,
+    ParkingSpot,
+    Reservation,
+    Status,
+    TrxType,
+    User,
+)
 from src.repository import parking_spots as repository_parking_spots
+from src.services.rate_index import rate_index
 from src.schemas.reservations import ReservationModel, ReservationUpdateModel
 
 
@@ -113,32 +137,127 @@ async def update_reservation(
     return None
 
 
-async def get_debit_credit_of_reservation(reservation_id, session):
+async def apply_to_balance(
+    reservation_id: UUID4 | int, debit: float, credit: float, session: AsyncSession
+):
     """
-    Retrieve the total debit and credit amounts associated with a reservation.
+    Add the amounts of a financial transaction to the running balance of its
+    reservation in one atomic statement, without committing it.
 
     Args:
-        reservation_id: The ID of the reservation to retrieve totals for.
-        session: An asynchronous database session.
+        reservation_id (Union[UUID4, int]): The ID of the reservation.
+        debit (float): The debit of the transaction.
+        credit (float): The credit of the transaction.
+        session (AsyncSession): An asynchronous database session.
 
     Returns:
-        Tuple[float, float]: A tuple containing the total debit and credit amounts.
-            If no transactions are found for the reservation, (0.0, 0.0) is returned.
+        Tuple[float, float]: The new debit and credit of the reservation, if found, otherwise None.
     """
     stmt = (
+        update(Reservation)
+        .filter(Reservation.id == reservation_id)
+        .values(
+            debit=Reservation.debit + debit,
+            credit=Reservation.credit + credit,
+        )
+        .returning(Reservation.debit, Reservation.credit)
+        .execution_options(synchronize_session=False)
+    )
+    result = await session.execute(stmt)
+    return result.first()
+
+
+async def get_balance_drift(session: AsyncSession, part: int = 0, parts: int = 1):
+    """
+    Find the reservations whose running balances differ from the sums of
+    their financial transactions.
+
+    Args:
+        session (AsyncSession): An asynchronous database session.
+        part (int): The index of the slice of the reservations to check.
+        parts (int): The number of the slices.
+
+    Returns:
+        List[Row]: The ID, the debit and the credit of every drifted reservation
+            and the ones of its ledger.
+    """
+    ledger = (
         select(
-            func.sum(FinancialTransaction.debit), func.sum(FinancialTransaction.credit)
+            FinancialTransaction.reservation_id,
+            func.sum(FinancialTransaction.debit).label("debit"),
+            func.sum(FinancialTransaction.credit).label("credit"),
         )
-        .select_from(FinancialTransaction)
-        .filter(FinancialTransaction.reservation_id == reservation_id)
         .group_by(FinancialTransaction.reservation_id)
+        .subquery()
+    )
+    ledger_debit = func.coalesce(ledger.c.debit, 0)
+    ledger_credit = func.coalesce(ledger.c.credit, 0)
+    stmt = (
+        select(
+            Reservation.id,
+            Reservation.debit,
+            Reservation.credit,
+            ledger_debit.label("ledger_debit"),
+            ledger_credit.label("ledger_credit"),
+        )
+        .outerjoin(ledger, ledger.c.reservation_id == Reservation.id)
+        .filter(
+            and_(
+                in_part(part, parts),
+                or_(
+                    Reservation.debit != ledger_debit,
+                    Reservation.credit != ledger_credit,
+                ),
+            )
+        )
     )
     result = await session.execute(stmt)
-    totals = result.all()
-    return totals[0] if totals else (0.0, 0.0)
+    return result.all()
+
+
+class partition_key(FunctionElement):
+    """
+    The key of a row to split the rows into the slices of the work by.
+
+    The UUIDs of PostgreSQL are hashed into integers, and the integer IDs of
+    the other databases are spread evenly by themselves.
+    """
 
+    type = Integer()
+    name = "partition_key"
+    inherit_cache = True
 
-async def get_all_in_house_reservations(session: AsyncSession):
+
+@compiles(partition_key)
+def compile_partition_key(element, compiler, **kwargs):
+    return compiler.process(element.clauses, **kwargs)
+
+
+@compiles(partition_key, "postgresql")
+def compile_partition_key_postgresql(element, compiler, **kwargs):
+    return f"hashtext(CAST({compiler.process(element.clauses, **kwargs)} AS TEXT))"
+
+
+def in_part(part: int, parts: int):
+    """
+    Filter the reservations of a slice of the work by the hash of their IDs.
+
+    Args:
+        part (int): The index of the slice.
+        parts (int): The number of the slices.
+
+    Returns:
+        ColumnElement: The filter of the reservations of the slice.
+    """
+    if parts == 1:
+        return true()
+    # the hash may be negative, and so may be its remainder
+    return func.abs(partition_key(Reservation.id) % parts) == part
+
+
+async def get_all_in_house_reservations(
+    session: AsyncSession, part: int = 0, parts: int = 1
+):
     parking_spots = await repository_parking_spots.get_all_occupied_parking_spots(
         session
     )
@@ -148,12 +267,51 @@ async def get_all_in_house_reservations(session: AsyncSession):
             Reservation.parking_spot_id.in_(
                 [parking_spot.id for parking_spot in parking_spots.all()]
             ),
+            in_part(part, parts),
         )
     )
     result = await session.execute(stmt)
     return result.scalars()
 
 
+async def get_over_limit_reservations(
+    limit: float, session: AsyncSession, part: int = 0, parts: int = 1
+):
+    """
+    Get the in-house reservations with a balance over the limit, with the
+    users to warn, in one query: the user of the reservation, or the owner of
+    its car if it was checked in without one.
+
+    Args:
+        limit (float): The limit of the balance.
+        session (AsyncSession): An asynchronous database session.
+        part (int): The index of the slice of the reservations to check.
+        parts (int): The number of the slices.
+
+    Returns:
+        list[Row]: The rows of the reservation ID, the balance, the user ID,
+            the email and the username.
+    """
+    balance = (Reservation.debit - Reservation.credit).label("balance")
+    stmt = (
+        select(Reservation.id, balance, User.id, User.email, User.username)
+        .outerjoin(Car, Car.id == Reservation.car_id)
+        .join(User, User.id == func.coalesce(Reservation.user_id, Car.user_id))
+        .join(ParkingSpot, ParkingSpot.id == Reservation.parking_spot_id)
+        .filter(
+            and_(
+                Reservation.resv_status == Status.CHECKED_IN,
+                ParkingSpot.is_available == False,
+                ParkingSpot.is_out_of_service == False,
+                Reservation.debit - Reservation.credit > limit,
+                in_part(part, parts),
+            )
+        )
+    )
+    result = await session.execute(stmt)
+    return result.all()
+
+
 async def get_in_house_reservation_by_car_id(
     car_id: UUID4 | int, session: AsyncSession
 ):
@@ -165,3 +323,185 @@ async def get_in_house_reservation_by_car_id(
     )
     result = await session.execute(stmt)
     return result.scalar()
+
+
+async def charge_in_house_reservations(
+    session: AsyncSession, part: int = 0, parts: int = 1
+) -> int:
+    """
+    Charge all the in-house reservations by the amounts of their rates at the
+    moment, resolved by the rate index, in one transaction: the statements add
+    the charges to their balances and return them, and the charges are added
+    to the open charge periods of the reservations in the ledger, or open new
+    ones.
+
+    Every reservation remembers the minute it was charged for last, and it is
+    charged only for the minutes after it, so a minute charged by another
+    replica, when the slices shift between them, is never charged again, and
+    the minutes missed by the replicas are caught up, up to the limit.
+
+    The periods opened before the current day, local to the rates, are closed
+    first, so the ledger gets one charge row per reservation a day, plus one
+    per payment.
+
+    Args:
+        session (AsyncSession): An asynchronous database session.
+        part (int): The index of the slice of the reservations to charge.
+        parts (int): The number of the slices.
+
+    Returns:
+        int: The number of the charged reservations.
+    """
+    in_house = and_(
+        Reservation.resv_status == Status.CHECKED_IN,
+        Reservation.parking_spot_id.in_(
+            select(ParkingSpot.id).filter(
+                and_(
+                    ParkingSpot.is_available == False,
+                    ParkingSpot.is_out_of_service == False,
+                )
+            )
+        ),
+        in_part(part, parts),
+    )
+    now = datetime.now(timezone.utc)
+    tick = now.replace(second=0, microsecond=0)
+    await close_charge_periods(session, before=rate_index.day_start(now))
+    # the amounts depend on the rates only, so they are resolved once a rate
+    await rate_index.ensure_fresh(session)
+    result = await session.execute(
+        select(Reservation.rate_id).filter(in_house).distinct()
+    )
+    rate_ids = [rate_id for rate_id in result.scalars() if rate_id is not None]
+    amounts = {
+        rate_id: amount
+        for rate_id, amount in zip(
+            rate_ids, rate_index.resolve_many((rate_id, now) for rate_id in rate_ids)
+        )
+        if amount is not None
+    }
+    if not amounts:
+        await session.commit()
+        return 0
+    amount = case(amounts, value=Reservation.rate_id)
+    # the reservations of the cars that got their owners after the check-in
+    # get them as well
+    car_user_id = (
+        select(Car.user_id).filter(Car.id == Reservation.car_id).scalar_subquery()
+    )
+    charges = {}
+    catch_up = max(settings.scheduler_charge_catch_up, 1)
+    for minutes in range(1, catch_up + 1):
+        # the reservations charged for the minute this many minutes ago, the
+        # new ones with the first group and the older ones with the last,
+        # while the ones charged for this minute match none of them
+        charged_until = Reservation.charged_until <= tick - timedelta(
+            minutes=minutes
+        )
+        if minutes < catch_up:
+            charged_until = and_(
+                charged_until,
+                Reservation.charged_until > tick - timedelta(minutes=minutes + 1),
+            )
+        if minutes == 1:
+            charged_until = or_(charged_until, Reservation.charged_until.is_(None))
+        result = await session.execute(
+            update(Reservation)
+            .filter(
+                and_(in_house, Reservation.rate_id.in_(list(amounts)), charged_until)
+            )
+            .values(
+                debit=Reservation.debit + amount * minutes,
+                charged_until=tick,
+                user_id=func.coalesce(Reservation.user_id, car_user_id),
+            )
+            .returning(Reservation.id, Reservation.user_id, Reservation.rate_id)
+            .execution_options(synchronize_session=False)
+        )
+        charges.update(
+            {
+                reservation_id: (user_id, amounts[rate_id] * minutes)
+                for reservation_id, user_id, rate_id in result.all()
+            }
+        )
+    if charges:
+        await extend_charge_periods(charges, now, session)
+    await session.commit()
+    return len(charges)
+
+
+async def extend_charge_periods(charges: dict, now: datetime, session: AsyncSession):
+    """
+    Add the charges to the open charge periods of the reservations, and open
+    the periods of the reservations that have none, without committing them.
+
+    Args:
+        charges (dict): The user ID and the amount by the reservation ID.
+        now (datetime): The end of the charged periods.
+        session (AsyncSession): An asynchronous database session.
+    """
+    result = await session.execute(
+        select(FinancialTransaction.reservation_id, FinancialTransaction.id).filter(
+            and_(
+                FinancialTransaction.is_open == True,
+                FinancialTransaction.reservation_id.in_(list(charges)),
+            )
+        )
+    )
+    open_charges = dict(result.all())
+    if open_charges:
+        # by the table, the ORM would take a list of parameters for a bulk
+        # update by the primary key, which can't increment the debit
+        table = FinancialTransaction.__table__
+        await session.execute(
+            update(table)
+            .where(table.c.id == bindparam("charge_id"))
+            .values(debit=table.c.debit + bindparam("amount"), period_end=now),
+            [
+                {"charge_id": charge_id, "amount": charges[reservation_id][1]}
+                for reservation_id, charge_id in open_charges.items()
+            ],
+        )
+    new_charges = [
+        {
+            "trx_type": TrxType.CHARGE,
+            "debit": amount,
+            "credit": 0.0,
+            "user_id": user_id,
+            "reservation_id": reservation_id,
+            "period_end": now,
+            "is_open": True,
+        }
+        for reservation_id, (user_id, amount) in charges.items()
+        if reservation_id not in open_charges
+    ]
+    if new_charges:
+        await session.execute(insert(FinancialTransaction), new_charges)
+
+
+async def close_charge_periods(
+    session: AsyncSession,
+    reservation_id: UUID4 | int | None = None,
+    before: datetime | None = None,
+) -> int:
+    """
+    Close the open charge periods of a reservation, or the ones opened before
+    the time, without committing them.
+
+    Args:
+        session (AsyncSession): An asynchronous database session.
+        reservation_id (Union[UUID4, int, None]): The ID of the reservation.
+        before (Union[datetime, None]): The time the periods were opened before.
+
+    Returns:
+        int: The number of the closed periods.
+    """
+    stmt = update(FinancialTransaction).filter(FinancialTransaction.is_open == True)
+    if reservation_id is not None:
+        stmt = stmt.filter(FinancialTransaction.reservation_id == reservation_id)
+    if before is not None:
+        stmt = stmt.filter(FinancialTransaction.trx_date < before)
+    result = await session.execute(
+        stmt.values(is_open=False).execution_options(synchronize_session=False)
+    )
+    return result.rowcount
@@ -21,7 +21,7 @@ from src.schemas.cars import (
     CarPatchModel,
     CarResponse,
 )
-from src.services.ai_models import process_image
+from src.services.ai_models import RecognitionUnavailable, process_image
 from src.services.roles import RoleAccess
 
 
@@ -50,7 +50,13 @@ async def read_or_create_car_with_unrecognized_plate(
     :return: Read of newly created car.
     :rtype: Car
     """
-    data.plate = await process_image(data.plate.file)
+    try:
+        data.plate = await process_image(data.plate.file)
+    except RecognitionUnavailable:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="License plate recognition is unavailable, try again later",
+        )
     try:
         data = CarRecognizedPlateModel(**data.model_dump())
     except:
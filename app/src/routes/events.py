@@ -15,7 +15,11 @@ from src.repository import events as repository_events
 from src.repository import parking_spots as repository_parking_spots
 from src.repository import rates as repository_rates
 from src.repository import reservations as repository_reservations
-from src.services.ai_models import process_image
+from src.services.ai_models import (
+    RecognitionUnavailable,
+    process_image,
+    provisional_plates,
+)
 from src.services.roles import RoleAccess
 from src.schemas.cars import CarRecognizedPlateModel
 from src.schemas.events import EventModel, EventImageModel, EventDB
@@ -27,6 +31,24 @@ allowed_operations_for_self = RoleAccess([Role.administrator, Role.user])
 allowed_operations_for_all = RoleAccess([Role.administrator])
 
 
+async def get_in_house_reservation(car, session: AsyncSession):
+    """
+    Gets the reservation of the car parked at the moment.
+
+    :param car: The car, or None.
+    :type car: Car | None
+    :param session: The database session.
+    :type session: AsyncSession
+    :return: The reservation, or None if the car is not parked.
+    :rtype: Reservation | None
+    """
+    if not car:
+        return None
+    return await repository_reservations.get_in_house_reservation_by_car_id(
+        car.id, session
+    )
+
+
 @router.post(
     "/{event_type}",
     response_model=EventDB,
@@ -47,7 +69,17 @@ async def create_event(
     :return: Newly created event.
     :rtype: Event
     """
-    data.plate = await process_image(data.plate.file)
+    try:
+        # in the degraded mode the gate opens for a check-in with a provisional
+        # plate while the recognition container is unavailable
+        data.plate = await process_image(
+            data.plate.file, provisional=event_type == Status.CHECKED_IN
+        )
+    except RecognitionUnavailable:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="License plate recognition is unavailable, try again later",
+        )
     try:
         data = CarRecognizedPlateModel(plate=data.plate)
     except:
@@ -85,14 +117,23 @@ async def create_event(
             reservation.parking_spot_id, False, session
         )
     elif event_type == Status.CHECKED_OUT:
+        reservation = await get_in_house_reservation(car, session)
+        if not reservation:
+            # a car checked in with a provisional plate may leave before its
+            # plate is resolved in the background
+            await provisional_plates.resolve_pending()
+            car = await repository_cars.read_car_by_plate(data.plate, session)
+            reservation = await get_in_house_reservation(car, session)
         if not car:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail="Car not found or license plate was recognized incorrectly",
             )
-        reservation = await repository_reservations.get_in_house_reservation_by_car_id(
-            car.id, session
-        )
+        if not reservation:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Car is not checked in",
+            )
         balance = reservation.debit - reservation.credit
         if balance > 0:
             raise HTTPException(
@@ -109,6 +150,10 @@ async def create_event(
             end_date=datetime.now(timezone.utc),
             user_id=car.user_id,
         )
+        # committed with the update of the reservation
+        await repository_reservations.close_charge_periods(
+            session, reservation_id=reservation.id
+        )
         reservation = await repository_reservations.update_reservation(
             reservation.id, data, session
         )
@@ -21,8 +21,6 @@ from src.schemas.financial_transactions import (
     FinancialTransactionModel,
     FinancialTransactionResponse,
 )
-from src.schemas.reservations import ReservationUpdateModel
-
 
 router = APIRouter(prefix="/fin_trans", tags=["fin_trans"])
 
@@ -50,13 +48,6 @@ async def create_financial_transaction(
             data, session
         )
     )
-    debit, credit = await repository_reservations.get_debit_credit_of_reservation(
-        financial_transaction.reservation_id, session
-    )
-    data = ReservationUpdateModel(debit=debit, credit=credit)
-    await repository_reservations.update_reservation(
-        financial_transaction.reservation_id, data, session
-    )
     return financial_transaction
 
 
@@ -52,3 +52,5 @@ class FinancialTransactionResponse(BaseModel):
     credit: float
     user_id: UUID4 | int | None = None
     reservation_id: UUID4 | int
+    period_end: datetime | None = None
+    is_open: bool = False
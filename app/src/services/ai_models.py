@@ -2,26 +2,905 @@
 Module to work with AI models
 """
 
-from httpx import AsyncClient
+import asyncio
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial
+import hashlib
+import importlib.util
+import io
+import multiprocessing
+import random
+import sys
+from time import monotonic, perf_counter
+from uuid import uuid4
 
-from src.conf.config import settings
+from fastapi import HTTPException, UploadFile
+from httpx import (
+    USE_CLIENT_DEFAULT,
+    AsyncClient,
+    HTTPError,
+    Limits,
+    PoolTimeout,
+    Timeout,
+    TimeoutException,
+)
 
+from src.conf.config import BASE_DIR, settings
+from src.database.connect_db import get_session
+from src.repository import cars as repository_cars
 
-async def process_image(img_file):
+
+class RecognitionUnavailable(Exception):
+    """
+    The recognition container did not answer within the deadline, or all its
+    replicas are cut off by the circuit breakers.
+    """
+
+
+class CircuitBreaker:
+    """
+    Latency-aware circuit breaker of a replica of the recognition container.
+
+    A call slower than slow_call counts as a failure even if it succeeds, so a
+    container that hangs is cut off as well as one that fails. After
+    failure_threshold failures in a row the breaker opens and the calls are
+    rejected without waiting. After reset_timeout it lets one probe call
+    through, which closes it again or reopens it.
+    """
+
+    def __init__(self, failure_threshold: int, slow_call: float, reset_timeout: float):
+        self.failure_threshold = failure_threshold
+        self.slow_call = slow_call
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+        self.opened = 0
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if monotonic() - self.opened_at < self.reset_timeout:
+            return "open"
+        return "half_open"
+
+    def allow(self) -> bool:
+        """
+        Checks whether a call may go to the replica.
+
+        :return: True if the call is allowed.
+        :rtype: bool
+        """
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half_open" and not self.probing:
+            self.probing = True
+            return True
+        return False
+
+    def record(self, elapsed: float, ok: bool) -> None:
+        """
+        Records the outcome of a call.
+
+        :param elapsed: The duration of the call in seconds.
+        :type elapsed: float
+        :param ok: Whether the call succeeded.
+        :type ok: bool
+        """
+        self.probing = False
+        if ok and elapsed <= self.slow_call:
+            self.failures = 0
+            self.opened_at = None
+            return
+        self.failures += 1
+        if self.opened_at is not None:
+            # a failed probe or a late failure keeps the breaker open longer
+            self.opened_at = monotonic()
+        elif self.failures >= self.failure_threshold:
+            self.opened_at = monotonic()
+            self.opened += 1
+
+    def release(self) -> None:
+        """
+        Forgets a call that was cancelled before its outcome was known.
+
+        """
+        self.probing = False
+
+
+class RetryBudget:
+    """
+    Limits the retries to a ratio of the calls.
+
+    Every call deposits ratio of a token and every retry withdraws a whole
+    one, so when the container is down the retries can't multiply the load
+    on it by more than 1 + ratio.
+    """
+
+    def __init__(self, ratio: float, max_tokens: float = 10.0):
+        self.ratio = ratio
+        self.max_tokens = max_tokens
+        self.tokens = max_tokens
+
+    def deposit(self) -> None:
+        self.tokens = min(self.max_tokens, self.tokens + self.ratio)
+
+    def withdraw(self) -> bool:
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+
+class SingleFlight:
+    """
+    Coalesces the recognitions of the same images.
+
+    The gate controllers that time out send the same image again while the
+    first request is still in flight. The calls are keyed by the hash of the
+    images, so a duplicate waits for the call in flight and shares its result,
+    and one sent within ttl seconds after it finished gets the memoized result.
+    """
+
+    def __init__(self, ttl: float, max_size: int):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.calls = {}
+        self.memo = OrderedDict()
+        self.coalesced = 0
+        self.memo_hits = 0
+
+    @staticmethod
+    def key(route: str, images: list[bytes]) -> str:
+        """
+        Returns the key of the call by the content of the images.
+
+        :param route: The route of the recognition container.
+        :type route: str
+        :param images: The images.
+        :type images: list[bytes]
+        :return: The hash of the route and the images.
+        :rtype: str
+        """
+        digest = hashlib.blake2b(route.encode(), digest_size=16)
+        for img_bytes in images:
+            digest.update(len(img_bytes).to_bytes(8, "big"))
+            digest.update(img_bytes)
+        return digest.hexdigest()
+
+    async def run(self, key: str, call):
+        """
+        Runs the call, unless the same one is in flight or memoized.
+
+        :param key: The key of the call.
+        :type key: str
+        :param call: The coroutine function making the call.
+        :type call: callable
+        :return: The result of the call.
+        """
+        memoized = self.memo.get(key)
+        if memoized is not None:
+            expires_at, result = memoized
+            if monotonic() < expires_at:
+                self.memo_hits += 1
+                self.memo.move_to_end(key)
+                return result
+            del self.memo[key]
+        task = self.calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(call())
+            task.add_done_callback(partial(self._done, key))
+            self.calls[key] = task
+        else:
+            self.coalesced += 1
+        # a caller that gives up doesn't cancel the call for the others
+        return await asyncio.shield(task)
+
+    def _done(self, key: str, task: asyncio.Task) -> None:
+        del self.calls[key]
+        if task.cancelled() or task.exception() is not None or self.ttl <= 0:
+            return
+        self.memo[key] = (monotonic() + self.ttl, task.result())
+        self.memo.move_to_end(key)
+        while len(self.memo) > self.max_size:
+            self.memo.popitem(last=False)
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": len(self.calls),
+            "memoized": len(self.memo),
+            "coalesced": self.coalesced,
+            "memo_hits": self.memo_hits,
+        }
+
+
+_local_pipeline = None
+
+
+def start_local_pipeline(model_dir: str) -> None:
+    """
+    Loads the recognition pipeline of main_model.py in a worker process of the
+    local backend.
+
+    :param model_dir: The directory of main_model.py.
+    :type model_dir: str
+    """
+    global _local_pipeline
+    sys.path.insert(0, model_dir)
+    import main_model
+
+    loop = asyncio.new_event_loop()
+    # the lifespan starts the executors and the batcher of the pipeline and
+    # loads the models, it is kept open until the worker exits
+    lifespan = main_model.lifespan(main_model.app)
+    loop.run_until_complete(lifespan.__aenter__())
+    while not main_model.registry.is_ready:
+        if main_model.registry.error:
+            # the executors of the pipeline would keep the worker alive
+            loop.run_until_complete(lifespan.__aexit__(None, None, None))
+            raise RuntimeError(f"Model loading error: {main_model.registry.error}")
+        loop.run_until_complete(asyncio.sleep(0.1))
+    _local_pipeline = (main_model, loop, lifespan)
+
+
+def local_pipeline_ready() -> bool:
+    return _local_pipeline is not None
+
+
+def recognize_locally(route: str, images: list[bytes]) -> str | None:
+    """
+    Runs the images through the handler of the route in a worker process of
+    the local backend.
+
+    :param route: The route of the recognition container.
+    :type route: str
+    :param images: The images.
+    :type images: list[bytes]
+    :return: The recognized plate number.
+    :rtype: str | None
+    """
+    main_model, loop, _ = _local_pipeline
+    uploads = [UploadFile(io.BytesIO(img_bytes)) for img_bytes in images]
+    try:
+        if route == "/process_image":
+            response = main_model.upload_image(uploads[0], camera_id=None)
+        else:
+            response = main_model.upload_images(uploads, camera_id=None)
+        return loop.run_until_complete(response)["result"]
+    except HTTPException as error:
+        # the container answers the same way, a rejected image has no plate
+        if error.status_code >= 500:
+            raise RuntimeError(error.detail) from None
+        return None
+
+
+class LocalRecognizer:
+    """
+    The in-process backend of the recognition.
+
+    The pipeline of models/main_model.py runs in a dedicated pool of processes
+    inside the API, so the API works without the recognition container, and
+    the images are not sent over the network. Every worker loads the models
+    once, and runs the images through the same handlers as the container.
+    """
+
+    def __init__(self, model_dir, workers: int):
+        self.model_dir = model_dir
+        self.workers = workers
+        self.pool = None
+        self.requests = 0
+        self.errors = 0
+        self.restarts = 0
+
+    @staticmethod
+    def is_available(model_dir) -> bool:
+        """
+        Checks whether the pipeline and its dependencies can be imported.
+
+        :param model_dir: The directory of main_model.py.
+        :type model_dir: Path
+        :return: True if the local backend can run.
+        :rtype: bool
+        """
+        return (model_dir / "main_model.py").is_file() and all(
+            importlib.util.find_spec(name) is not None
+            for name in ("tensorflow", "cv2", "pytesseract")
+        )
+
+    def start(self) -> None:
+        if self.pool is None:
+            self.pool = ProcessPoolExecutor(
+                max_workers=self.workers,
+                # TensorFlow is not fork-safe, and the API has its own threads
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=start_local_pipeline,
+                initargs=(str(self.model_dir),),
+            )
+
+    def stop(self) -> None:
+        if self.pool is not None:
+            self.pool.shutdown(wait=False, cancel_futures=True)
+            self.pool = None
+
+    async def warm_up(self) -> None:
+        """
+        Starts the workers, so the first images don't wait for the models.
+
+        """
+        self.start()
+        loop = asyncio.get_running_loop()
+        try:
+            await asyncio.gather(
+                *(
+                    loop.run_in_executor(self.pool, local_pipeline_ready)
+                    for _ in range(self.workers)
+                )
+            )
+        except Exception as error_message:
+            print(f"Local recognition error: {str(error_message)}")
+
+    async def recognize(self, route: str, images: list[bytes]) -> str | None:
+        """
+        Recognizes the plate number on the images in the worker processes.
+
+        :param route: The route of the recognition container to run.
+        :type route: str
+        :param images: The images.
+        :type images: list[bytes]
+        :return: The recognized plate number.
+        :rtype: str | None
+        """
+        self.start()
+        pool = self.pool
+        self.requests += 1
+        try:
+            async with asyncio.timeout(settings.tensorflow_deadline):
+                return await asyncio.get_running_loop().run_in_executor(
+                    pool, recognize_locally, route, images
+                )
+        except TimeoutError as error:
+            self.errors += 1
+            raise RecognitionUnavailable("The deadline is exceeded") from error
+        except BrokenProcessPool as error:
+            self.errors += 1
+            if pool is self.pool:
+                # a worker died, the next call starts a new pool
+                self.stop()
+                self.restarts += 1
+            raise RecognitionUnavailable(str(error)) from error
+        except Exception as error:
+            self.errors += 1
+            raise RecognitionUnavailable(str(error)) from error
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "started": self.pool is not None,
+            "requests": self.requests,
+            "errors": self.errors,
+            "restarts": self.restarts,
+        }
+
+
+model_dir = settings.tensorflow_model_path
+if not model_dir.is_absolute():
+    model_dir = BASE_DIR.parent / model_dir
+local_recognizer = LocalRecognizer(model_dir, settings.tensorflow_local_workers)
+
+
+class AIModelsClient:
+    """
+    The HTTP client of the recognition container.
+
+    One client is shared by all the requests, so the connections to the
+    container are kept alive and reused instead of being opened for every car
+    event. The number of the concurrent calls is bounded, so a burst of events
+    waits here instead of overloading the container.
+
+    The calls are bounded by a deadline. A replica that fails or is slow is cut
+    off by its circuit breaker. A failed call is retried with a jittered
+    exponential backoff within the retry budget. When the container has
+    replicas, a call that is slower than the 95th percentile of the recent
+    ones is hedged to the next replica, and the first answer wins. The
+    duplicate recognitions of the same images share one call.
+
+    With the local backend the plates are recognized inside the API instead,
+    and the auto one picks it when the pipeline can be imported.
+    """
+
+    LATENCY_WINDOW = 200
+
+    def __init__(self):
+        self.backend = settings.tensorflow_backend
+        if self.backend == "auto":
+            self.backend = (
+                "local" if LocalRecognizer.is_available(model_dir) else "remote"
+            )
+        self.warming_up = None
+        self.single_flight = SingleFlight(
+            settings.tensorflow_memo_ttl, settings.tensorflow_memo_size
+        )
+        self.client = None
+        self.semaphore = asyncio.Semaphore(settings.tensorflow_max_concurrency)
+        self.replicas = [
+            f"{settings.api_protocol}://{settings.tensorflow_container_name}:{settings.tensorflow_port}",
+            *settings.tensorflow_replicas,
+        ]
+        self.breakers = {
+            replica: CircuitBreaker(
+                settings.tensorflow_breaker_failures,
+                settings.tensorflow_breaker_slow_call,
+                settings.tensorflow_breaker_reset,
+            )
+            for replica in self.replicas
+        }
+        self.retry_budget = RetryBudget(settings.tensorflow_retry_budget)
+        self.latencies = deque(maxlen=self.LATENCY_WINDOW)
+        self.in_flight = 0
+        self.waiting = 0
+        self.requests = 0
+        self.errors = 0
+        self.timeouts = 0
+        self.pool_timeouts = 0
+        self.retries = 0
+        self.hedges = 0
+        self.rejected = 0
+        self.wait_time_total = 0.0
+        self.wait_time_max = 0.0
+
+    def get_client(self) -> AsyncClient:
+        """
+        Returns the shared client, creating it on the first call.
+
+        :return: The shared client.
+        :rtype: AsyncClient
+        """
+        if self.client is None or self.client.is_closed:
+            self.client = AsyncClient(
+                base_url=self.replicas[0],
+                http2=settings.tensorflow_http2,
+                timeout=Timeout(
+                    connect=settings.tensorflow_connect_timeout,
+                    # a read longer than the deadline would never end as
+                    # a timeout, only be cancelled by the deadline
+                    read=min(
+                        settings.tensorflow_read_timeout, settings.tensorflow_deadline
+                    ),
+                    write=settings.tensorflow_write_timeout,
+                    pool=settings.tensorflow_pool_timeout,
+                ),
+                limits=Limits(
+                    max_connections=settings.tensorflow_max_connections,
+                    max_keepalive_connections=settings.tensorflow_max_keepalive_connections,
+                    keepalive_expiry=settings.tensorflow_keepalive_expiry,
+                ),
+            )
+        return self.client
+
+    async def startup(self) -> None:
+        """
+        Opens the shared client, starts the local workers and starts resolving
+        the provisional plates.
+
+        """
+        self.get_client()
+        if self.backend == "local":
+            self.warming_up = asyncio.create_task(local_recognizer.warm_up())
+        if settings.tensorflow_degraded_mode:
+            provisional_plates.start()
+
+    async def shutdown(self) -> None:
+        """
+        Stops resolving the provisional plates, stops the local workers and
+        closes the shared client.
+
+        """
+        await provisional_plates.stop()
+        local_recognizer.stop()
+        if self.client is not None:
+            await self.client.aclose()
+            self.client = None
+
+    async def post(self, url: str, timeout: float | None = None, **kwargs):
+        """
+        Sends a POST request to the recognition container.
+
+        :param url: The route of the container, or the absolute URL of a replica.
+        :type url: str
+        :param timeout: The timeout of the call instead of the configured ones.
+        :type timeout: float | None
+        :return: The response.
+        :rtype: Response
+        """
+        start = perf_counter()
+        self.waiting += 1
+        try:
+            await self.semaphore.acquire()
+        finally:
+            self.waiting -= 1
+        wait_time = perf_counter() - start
+        self.wait_time_total += wait_time
+        self.wait_time_max = max(self.wait_time_max, wait_time)
+        self.in_flight += 1
+        self.requests += 1
+        try:
+            return await self.get_client().post(
+                url,
+                timeout=USE_CLIENT_DEFAULT if timeout is None else timeout,
+                **kwargs,
+            )
+        except PoolTimeout:
+            self.pool_timeouts += 1
+            raise
+        except TimeoutException:
+            self.timeouts += 1
+            raise
+        except HTTPError:
+            self.errors += 1
+            raise
+        finally:
+            self.in_flight -= 1
+            self.semaphore.release()
+
+    def hedge_delay(self) -> float:
+        """
+        Returns how long a call waits before it is hedged to the next replica.
+
+        :return: The 95th percentile of the recent latencies in seconds.
+        :rtype: float
+        """
+        if len(self.latencies) < 20:
+            return settings.tensorflow_hedge_delay
+        latencies = sorted(self.latencies)
+        return latencies[int(0.95 * (len(latencies) - 1))]
+
+    async def call(self, route: str, files, timeout: float | None = None) -> dict:
+        """
+        Calls the route of the recognition container with the resilience policies.
+
+        :param route: The route of the container.
+        :type route: str
+        :param files: The files to upload, as bytes so they can be sent again.
+        :type files: dict | list
+        :param timeout: The timeout of an attempt instead of the configured ones.
+        :type timeout: float | None
+        :return: The JSON answer of the container.
+        :rtype: dict
+        """
+        self.retry_budget.deposit()
+        attempt = 0
+        try:
+            async with asyncio.timeout(settings.tensorflow_deadline):
+                while True:
+                    try:
+                        response = await self._hedged(route, files, timeout)
+                        return response.json()
+                    except HTTPError as error:
+                        if (
+                            attempt >= settings.tensorflow_retries
+                            or not self.retry_budget.withdraw()
+                        ):
+                            raise RecognitionUnavailable(str(error)) from error
+                    attempt += 1
+                    self.retries += 1
+                    # full jitter, so the retries of concurrent calls spread out
+                    await asyncio.sleep(
+                        random.uniform(
+                            0, settings.tensorflow_retry_backoff * 2**attempt
+                        )
+                    )
+        except TimeoutError as error:
+            raise RecognitionUnavailable("The deadline is exceeded") from error
+        except RecognitionUnavailable:
+            self.rejected += 1
+            raise
+
+    async def _hedged(self, route: str, files, timeout: float | None):
+        candidates = list(self.replicas)
+
+        def next_attempt():
+            while candidates:
+                replica = candidates.pop(0)
+                if self.breakers[replica].allow():
+                    return asyncio.ensure_future(
+                        self._attempt(replica, route, files, timeout)
+                    )
+            return None
+
+        task = next_attempt()
+        if task is None:
+            raise RecognitionUnavailable("The circuit breakers are open")
+        pending = {task}
+        error = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending,
+                    timeout=self.hedge_delay() if candidates else None,
+                    return_when=asyncio.FIRST_COMPLETED,
+                )
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                    error = task.exception()
+                # a failed attempt is replaced at once, a slow one is hedged
+                task = next_attempt()
+                if task is not None:
+                    if not done:
+                        self.hedges += 1
+                    pending.add(task)
+        finally:
+            for task in pending:
+                task.cancel()
+            # the cancelled attempts record their outcome in the breakers
+            # before the call returns
+            await asyncio.gather(*pending, return_exceptions=True)
+        raise error
+
+    async def _attempt(self, replica: str, route: str, files, timeout: float | None):
+        breaker = self.breakers[replica]
+        start = perf_counter()
+        try:
+            response = await self.post(replica + route, timeout=timeout, files=files)
+            if response.status_code >= 500:
+                response.raise_for_status()
+        except asyncio.CancelledError:
+            # an attempt cut off by the deadline or by a hedge after the slow
+            # call threshold is as bad as a slow answer, so a hanging
+            # container opens the breaker
+            elapsed = perf_counter() - start
+            if elapsed >= breaker.slow_call:
+                breaker.record(elapsed, ok=False)
+            else:
+                breaker.release()
+            raise
+        except HTTPError:
+            breaker.record(perf_counter() - start, ok=False)
+            raise
+        elapsed = perf_counter() - start
+        breaker.record(elapsed, ok=True)
+        self.latencies.append(elapsed)
+        return response
+
+    async def recognize(
+        self, route: str, images: list[bytes], timeout: float | None = None
+    ) -> str | None:
+        """
+        Recognizes the plate number on the images with the configured backend.
+
+        :param route: The route of the recognition container.
+        :type route: str
+        :param images: The images.
+        :type images: list[bytes]
+        :param timeout: The timeout of an attempt instead of the configured ones.
+        :type timeout: float | None
+        :return: The recognized plate number.
+        :rtype: str | None
+        """
+        return await self.single_flight.run(
+            SingleFlight.key(route, images),
+            partial(self._recognize, route, images, timeout),
+        )
+
+    async def _recognize(
+        self, route: str, images: list[bytes], timeout: float | None
+    ) -> str | None:
+        if self.backend == "local":
+            return await local_recognizer.recognize(route, images)
+        if route == "/process_image":
+            files = {"img_file": images[0]}
+        else:
+            files = [("img_files", img_bytes) for img_bytes in images]
+        data = await self.call(route, files, timeout)
+        return data.get("result")
+
+    def stats(self) -> dict:
+        """
+        Reports the saturation of the client and the state of the policies.
+
+        :return: The counters of the calls, the slots and the breakers.
+        :rtype: dict
+        """
+        max_concurrency = settings.tensorflow_max_concurrency
+        return {
+            "backend": self.backend,
+            "local": local_recognizer.stats(),
+            "single_flight": self.single_flight.stats(),
+            "in_flight": self.in_flight,
+            "waiting": self.waiting,
+            "max_concurrency": max_concurrency,
+            "saturation": self.in_flight / max_concurrency,
+            "available": max_concurrency - self.in_flight,
+            "max_connections": settings.tensorflow_max_connections,
+            "requests": self.requests,
+            "errors": self.errors,
+            "timeouts": self.timeouts,
+            "pool_timeouts": self.pool_timeouts,
+            "retries": self.retries,
+            "retry_tokens": self.retry_budget.tokens,
+            "hedges": self.hedges,
+            "hedge_delay_ms": 1000 * self.hedge_delay(),
+            "rejected": self.rejected,
+            "wait_time_avg_ms": (
+                1000 * self.wait_time_total / self.requests if self.requests else 0.0
+            ),
+            "wait_time_max_ms": 1000 * self.wait_time_max,
+            "breakers": {
+                replica: {"state": breaker.state, "opened": breaker.opened}
+                for replica, breaker in self.breakers.items()
+            },
+            "provisional_plates": provisional_plates.stats(),
+        }
+
+
+ai_models_client = AIModelsClient()
+
+
+class ProvisionalPlates:
+    """
+    The degraded mode of the check-in.
+
+    When the plate can't be recognized in time, the car gets a provisional
+    plate, so the gate opens, and its image is queued. The images are
+    recognized in the background once the container is back, and the
+    provisional car gets its real plate, or its reservations are moved to the
+    car that already has the plate. A car that leaves before that has its
+    plate resolved by the check-out, as long as its image was queued by the
+    same replica.
+    """
+
+    PREFIX = "PROV"
+    MAX_ATTEMPTS = 5
+
+    def __init__(self, max_size: int):
+        self.queue = asyncio.Queue(max_size)
+        self.worker = None
+        self.issued = 0
+        self.resolved = 0
+        self.failed = 0
+
+    def add(self, img_bytes: bytes) -> str:
+        """
+        Queues the image and returns the provisional plate for the car.
+
+        :param img_bytes: The image of the car.
+        :type img_bytes: bytes
+        :return: The provisional plate.
+        :rtype: str
+        """
+        if self.queue.full():
+            raise RecognitionUnavailable("The provisional plate queue is full")
+        plate = self.PREFIX + uuid4().hex[:12].upper()
+        self.queue.put_nowait((plate, img_bytes, 0))
+        self.issued += 1
+        return plate
+
+    def start(self) -> None:
+        if self.worker is None:
+            self.worker = asyncio.create_task(self.run())
+
+    async def stop(self) -> None:
+        if self.worker is not None:
+            self.worker.cancel()
+            self.worker = None
+
+    async def run(self) -> None:
+        while True:
+            plate, img_bytes, attempt = await self.queue.get()
+            if await self.resolve(plate, img_bytes):
+                continue
+            if attempt + 1 < self.MAX_ATTEMPTS and not self.queue.full():
+                # queued again before the pause, so a check-out resolves it
+                # meanwhile, the container is likely still down, give its
+                # breaker time
+                self.queue.put_nowait((plate, img_bytes, attempt + 1))
+                await asyncio.sleep(settings.tensorflow_breaker_reset / 2)
+            else:
+                self.failed += 1
+                print(f"Provisional plate {plate} is not resolved")
+
+    async def resolve(self, plate: str, img_bytes: bytes) -> bool:
+        """
+        Recognizes the image of the provisional car and gives it the plate.
+
+        :param plate: The provisional plate.
+        :type plate: str
+        :param img_bytes: The image of the car.
+        :type img_bytes: bytes
+        :return: False if it should be tried again later.
+        :rtype: bool
+        """
+        car = None
+        try:
+            result = await ai_models_client.recognize("/process_image", [img_bytes])
+            if len(result or "") >= 3:
+                async for session in get_session():
+                    car = await repository_cars.resolve_provisional_car(
+                        plate, result, session
+                    )
+        except RecognitionUnavailable:
+            return False
+        except Exception as error_message:
+            print(f"Provisional plate {plate} error: {str(error_message)}")
+            return False
+        if car is not None:
+            self.resolved += 1
+        else:
+            # the plate is unreadable, or the car left or can't be merged,
+            # another attempt would end the same way
+            self.failed += 1
+            print(f"Provisional plate {plate} is not resolved")
+        return True
+
+    async def resolve_pending(self) -> None:
+        """
+        Resolves the queued provisional plates at once, so a car that leaves
+        before its plate is resolved in the background is found by it.
+
+        """
+        pending = []
+        while not self.queue.empty():
+            pending.append(self.queue.get_nowait())
+        for plate, img_bytes, attempt in pending:
+            if await self.resolve(plate, img_bytes):
+                continue
+            try:
+                self.queue.put_nowait((plate, img_bytes, attempt))
+            except asyncio.QueueFull:
+                self.failed += 1
+                print(f"Provisional plate {plate} is not resolved")
+
+    def stats(self) -> dict:
+        return {
+            "queued": self.queue.qsize(),
+            "issued": self.issued,
+            "resolved": self.resolved,
+            "failed": self.failed,
+        }
+
+
+provisional_plates = ProvisionalPlates(settings.tensorflow_provisional_queue_size)
+
+
+async def process_image(
+    img_file, timeout: float | None = None, provisional: bool = False
+):
     """
-    Generates a PNG image with a QR code from the url of the image:
+    Recognizes the plate number on the image:
 
     :param img_file: The image file
     :type img_file: file.
+    :param timeout: The timeout of an attempt instead of the configured ones
+    :type timeout: float | None
+    :param provisional: Return a provisional plate in the degraded mode when the plate can't be recognized
+    :type provisional: bool
     :return: The recognized text from image
     :rtype: str
     """
-    client = AsyncClient(
-        base_url=f"{settings.api_protocol}://{settings.tensorflow_container_name}:{settings.tensorflow_port}",
-    )
-    response = await client.post(
-        "/process_image",
-        files={"img_file": img_file},
+    img_bytes = img_file.read()
+    try:
+        return await ai_models_client.recognize("/process_image", [img_bytes], timeout)
+    except RecognitionUnavailable:
+        if provisional and settings.tensorflow_degraded_mode:
+            return provisional_plates.add(img_bytes)
+        raise
+
+
+async def process_images(img_files, timeout: float | None = None):
+    """
+    Recognizes the plate number on several frames of the same car in one request:
+
+    :param img_files: The image files
+    :type img_files: list of files.
+    :param timeout: The timeout of an attempt instead of the configured ones
+    :type timeout: float | None
+    :return: The consensus plate number by majority vote over the frames
+    :rtype: str
+    """
+    return await ai_models_client.recognize(
+        "/process_images", [img_file.read() for img_file in img_files], timeout
     )
-    data = response.json()
-    return data.get("result")
@@ -0,0 +1,217 @@
+"""
+Module to coordinate the scheduler jobs of the API replicas
+"""
+
+import asyncio
+import os
+import socket
+from uuid import uuid4
+
+import redis.asyncio as redis
+
+from src.conf.config import settings
+
+
+# Takes the lease if it is free or renews it if this replica holds it
+ACQUIRE_LEASE = """
+local holder = redis.call("GET", KEYS[1])
+if holder == false or holder == ARGV[1] then
+    redis.call("SET", KEYS[1], ARGV[1], "PX", ARGV[2])
+    return 1
+end
+return 0
+"""
+
+# Registers the replica until the TTL, forgets the expired ones and returns
+# the live ones, by the clock of Redis, so the clocks of the hosts don't matter
+HEARTBEAT = """
+local now = redis.call("TIME")
+local ms = tonumber(now[1]) * 1000 + math.floor(tonumber(now[2]) / 1000)
+redis.call("ZADD", KEYS[1], ms + tonumber(ARGV[2]), ARGV[1])
+redis.call("ZREMRANGEBYSCORE", KEYS[1], "-inf", ms)
+redis.call("PEXPIRE", KEYS[1], ARGV[2])
+return redis.call("ZRANGE", KEYS[1], 0, -1)
+"""
+
+RELEASE_LEASE = """
+if redis.call("GET", KEYS[1]) == ARGV[1] then
+    return redis.call("DEL", KEYS[1])
+end
+return 0
+"""
+
+
+class JobCoordinator:
+    """
+    Coordinates the scheduler jobs of the API replicas through Redis.
+
+    Every replica runs the scheduler, so the jobs fire on all of them, and ask
+    the coordinator what to do. In the "leader" mode the replicas compete for a
+    lease and only its holder runs the jobs. The lease expires unless it is
+    renewed, so when the leader dies another replica takes over within the
+    lease TTL. In the "partitioned" mode the replicas register themselves with
+    a heartbeat, and every one runs the jobs for its slice of the reservations,
+    so the work is spread over them. The "all" mode runs the jobs everywhere,
+    as a single replica does.
+
+    When a replica joins or leaves, the slices of the others may shift before
+    they see it, so a reservation can fall into two slices or none for one
+    tick. The charges are guarded by the minute a reservation was charged for
+    last, so it is charged once, and a skipped minute is caught up on the next
+    tick.
+    """
+
+    LEASE_KEY = "scheduler:leader"
+    MEMBERS_KEY = "scheduler:members"
+
+    def __init__(self, mode: str, lease_ttl: float):
+        self.mode = mode
+        self.lease_ttl_ms = int(lease_ttl * 1000)
+        self.replica_id = f"{socket.gethostname()}:{os.getpid()}:{uuid4().hex[:8]}"
+        self.redis = None
+        self.task = None
+        self.is_leader = False
+        self.part = 0
+        self.parts = 1
+        self.acquisitions = 0
+        self.renewals = 0
+        self.renewal_failures = 0
+        self.losses = 0
+        self.reassignments = 0
+        self.jobs_run = 0
+        self.jobs_skipped = 0
+
+    async def startup(self) -> None:
+        """
+        Connects to Redis and starts renewing the lease or the heartbeat.
+
+        """
+        if self.mode == "all":
+            return
+        self.redis = redis.from_url(
+            settings.redis_url,
+            db=settings.redis_db_for_apscheduler,
+            encoding="utf-8",
+            decode_responses=True,
+        )
+        self.task = asyncio.create_task(self.run())
+
+    async def shutdown(self) -> None:
+        """
+        Stops the renewals and hands the lease or the slice over at once.
+
+        """
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+        if self.redis is None:
+            return
+        try:
+            if self.mode == "leader":
+                await self.redis.eval(RELEASE_LEASE, 1, self.LEASE_KEY, self.replica_id)
+            else:
+                await self.redis.zrem(self.MEMBERS_KEY, self.replica_id)
+        except redis.RedisError as error_message:
+            print(f"Scheduler coordination error: {str(error_message)}")
+        await self.redis.aclose()
+        self.redis = None
+        self.is_leader = False
+
+    async def run(self) -> None:
+        while True:
+            await self.renew()
+            await asyncio.sleep(self.lease_ttl_ms / 3000)
+
+    async def renew(self) -> None:
+        """
+        Renews the lease or the heartbeat of the replica.
+
+        A replica that can't reach Redis stops running the jobs, since another
+        one may have taken its lease or its slice.
+        """
+        try:
+            if self.mode == "leader":
+                await self._renew_lease()
+            else:
+                await self._heartbeat()
+        except redis.RedisError as error_message:
+            self.renewal_failures += 1
+            if self.is_leader:
+                self.losses += 1
+            self.is_leader = False
+            self.parts = 0
+            print(f"Scheduler coordination error: {str(error_message)}")
+
+    async def _renew_lease(self) -> None:
+        held = await self.redis.eval(
+            ACQUIRE_LEASE, 1, self.LEASE_KEY, self.replica_id, self.lease_ttl_ms
+        )
+        if held and self.is_leader:
+            self.renewals += 1
+        elif held:
+            self.acquisitions += 1
+        elif self.is_leader:
+            self.losses += 1
+        self.is_leader = bool(held)
+
+    async def _heartbeat(self) -> None:
+        members = await self.redis.eval(
+            HEARTBEAT, 1, self.MEMBERS_KEY, self.replica_id, self.lease_ttl_ms
+        )
+        self.renewals += 1
+        # by the IDs, the scores change with every heartbeat
+        members = sorted(members)
+        part, parts = members.index(self.replica_id), len(members)
+        if (part, parts) != (self.part, self.parts):
+            self.reassignments += 1
+            print(f"Scheduler slice {part + 1} of {parts}")
+        self.part, self.parts = part, parts
+
+    async def assignment(self) -> tuple[int, int] | None:
+        """
+        Returns the slice of the work of the replica for the tick of a job.
+
+        The lease or the heartbeat is renewed right before, so the decision is
+        taken on the state of Redis at the tick.
+
+        :return: The index of the slice and the number of the slices, or None if the replica skips the tick.
+        :rtype: tuple[int, int] | None
+        """
+        if self.mode == "all":
+            assignment = (0, 1)
+        else:
+            await self.renew()
+            if self.mode == "leader":
+                assignment = (0, 1) if self.is_leader else None
+            else:
+                assignment = (self.part, self.parts) if self.parts else None
+        if assignment is None:
+            self.jobs_skipped += 1
+        else:
+            self.jobs_run += 1
+        return assignment
+
+    def stats(self) -> dict:
+        """
+        Reports the state of the lease or of the slice of the replica.
+
+        :return: The role of the replica and the counters of the renewals.
+        :rtype: dict
+        """
+        return {
+            "mode": self.mode,
+            "replica_id": self.replica_id,
+            "is_leader": self.is_leader,
+            "part": self.part,
+            "parts": self.parts,
+            "acquisitions": self.acquisitions,
+            "renewals": self.renewals,
+            "renewal_failures": self.renewal_failures,
+            "losses": self.losses,
+            "reassignments": self.reassignments,
+            "jobs_run": self.jobs_run,
+            "jobs_skipped": self.jobs_skipped,
+        }
+
+
+job_coordinator = JobCoordinator(settings.scheduler_mode, settings.scheduler_lease_ttl)
@@ -0,0 +1,219 @@
+"""
+Module of the pipeline of the limit warning notifications
+"""
+
+import asyncio
+from email.message import EmailMessage
+from email.utils import formataddr
+
+from aiosmtplib import SMTPException, SMTPServerDisconnected
+from fastapi_mail.connection import Connection
+from fastapi_mail.errors import ConnectionErrors
+import redis.asyncio as redis
+
+from src.conf.config import settings
+from src.services.email import conf
+
+
+class Mailer:
+    """
+    Keeps one SMTP connection open between the messages, instead of the
+    connection, the TLS handshake and the login for every message.
+
+    The servers close the idle connections, so a message sent over a closed
+    one is sent again over a new connection.
+    """
+
+    def __init__(self):
+        self.connection = None
+        self.connects = 0
+
+    async def connect(self) -> None:
+        await self.close()
+        connection = Connection(conf)
+        await connection.__aenter__()
+        self.connection = connection
+        self.connects += 1
+
+    async def close(self) -> None:
+        if self.connection is None:
+            return
+        connection, self.connection = self.connection, None
+        try:
+            await connection.__aexit__(None, None, None)
+        except (SMTPException, OSError):
+            pass
+
+    async def send(self, message: EmailMessage) -> None:
+        """
+        Sends the message over the kept connection.
+
+        :param message: The message.
+        :type message: EmailMessage
+        """
+        if self.connection is None:
+            await self.connect()
+        if conf.SUPPRESS_SEND:
+            return
+        try:
+            await self.connection.session.send_message(message)
+        except SMTPServerDisconnected:
+            await self.connect()
+            await self.connection.session.send_message(message)
+
+
+class LimitWarningNotifier:
+    """
+    Sends the limit warnings of the reservations through a bounded queue
+    drained by a few workers, so the scheduler job only finds the balances
+    over the limit and never waits for the mail server.
+
+    A reservation is warned once for every multiple of the limit its balance
+    gets over, remembered in Redis for the TTL, so the warning is repeated
+    once a TTL while the balance stays there, and the replicas don't warn it
+    twice. A warning that can't be queued or sent is forgotten, so it is
+    tried again on the next check.
+    """
+
+    KEY_PREFIX = "limit_warning"
+
+    def __init__(self, queue_size: int, workers: int, ttl: int):
+        self.queue_size = queue_size
+        self.workers = workers
+        self.ttl = ttl
+        self.queue = None
+        self.tasks = []
+        self.mailers = []
+        self.redis = None
+        self.template = None
+        self.queued = 0
+        self.duplicates = 0
+        self.dropped = 0
+        self.sent = 0
+        self.failed = 0
+
+    async def startup(self) -> None:
+        """
+        Connects to Redis and starts the workers.
+
+        """
+        self.redis = redis.from_url(
+            settings.redis_url,
+            db=settings.redis_db_for_objects,
+            encoding="utf-8",
+            decode_responses=True,
+        )
+        self.template = conf.template_engine().get_template("limit_warning.html")
+        self.queue = asyncio.Queue(self.queue_size)
+        self.mailers = [Mailer() for _ in range(self.workers)]
+        self.tasks = [asyncio.create_task(self.work(mailer)) for mailer in self.mailers]
+
+    async def shutdown(self) -> None:
+        """
+        Stops the workers and closes their connections.
+
+        """
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+        for mailer in self.mailers:
+            await mailer.close()
+        if self.redis is not None:
+            await self.redis.aclose()
+            self.redis = None
+
+    def key(self, reservation_id, balance: float, limit: float) -> str:
+        threshold = int(balance // limit) * limit
+        return f"{self.KEY_PREFIX}:{reservation_id}:{threshold}"
+
+    async def notify(self, rows, limit: float) -> int:
+        """
+        Queues the warnings of the reservations not warned about their
+        thresholds yet.
+
+        :param rows: The rows of the reservation ID, the balance, the user ID, the email and the username.
+        :type rows: list[Row]
+        :param limit: The limit of the balance.
+        :type limit: float
+        :return: The number of the queued warnings.
+        :rtype: int
+        """
+        if not rows or self.queue is None:
+            return 0
+        keys = [self.key(row[0], row[1], limit) for row in rows]
+        try:
+            async with self.redis.pipeline(transaction=False) as pipe:
+                for key in keys:
+                    pipe.set(key, 1, nx=True, ex=self.ttl)
+                fresh = await pipe.execute()
+        except redis.RedisError as error_message:
+            print(f"Limit warning error: {str(error_message)}")
+            return 0
+        queued = 0
+        for key, row, is_fresh in zip(keys, rows, fresh):
+            if not is_fresh:
+                self.duplicates += 1
+                continue
+            try:
+                self.queue.put_nowait((key, row))
+            except asyncio.QueueFull:
+                self.dropped += 1
+                await self.forget(key)
+                continue
+            queued += 1
+        self.queued += queued
+        return queued
+
+    async def forget(self, key: str) -> None:
+        try:
+            await self.redis.delete(key)
+        except redis.RedisError as error_message:
+            print(f"Limit warning error: {str(error_message)}")
+
+    def message(self, email: str, username: str, balance: float) -> EmailMessage:
+        message = EmailMessage()
+        message["Subject"] = "Limit warning"
+        message["From"] = formataddr((conf.MAIL_FROM_NAME, conf.MAIL_FROM))
+        message["To"] = email
+        message.set_content(
+            self.template.render(username=username, balance=balance), subtype="html"
+        )
+        return message
+
+    async def work(self, mailer: Mailer) -> None:
+        while True:
+            key, (_, balance, _, email, username) = await self.queue.get()
+            try:
+                await mailer.send(self.message(email, username, balance))
+                self.sent += 1
+            except (ConnectionErrors, SMTPException) as error_message:
+                self.failed += 1
+                await mailer.close()
+                await self.forget(key)
+                print(f"Connection error: {str(error_message)}")
+            except Exception as error_message:
+                # a worker that died would leave the queue undrained
+                self.failed += 1
+                await self.forget(key)
+                print(f"Limit warning error: {str(error_message)}")
+            finally:
+                self.queue.task_done()
+
+    def stats(self) -> dict:
+        return {
+            "queued": self.queued,
+            "pending": self.queue.qsize() if self.queue is not None else 0,
+            "duplicates": self.duplicates,
+            "dropped": self.dropped,
+            "sent": self.sent,
+            "failed": self.failed,
+            "connections": sum(mailer.connects for mailer in self.mailers),
+        }
+
+
+limit_warning_notifier = LimitWarningNotifier(
+    settings.notifications_queue_size,
+    settings.notifications_workers,
+    settings.limit_warning_ttl,
+)
@@ -0,0 +1,298 @@
+"""
+Module of the in-memory index of the rate schedules
+"""
+
+from bisect import bisect_right
+from datetime import datetime, time
+from time import monotonic
+from zoneinfo import ZoneInfo
+
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src.conf.config import settings
+from src.database.models import RateDetail
+
+
+SECONDS_IN_DAY = 24 * 60 * 60
+
+
+def seconds_of_day(value: time) -> int:
+    return value.hour * 3600 + value.minute * 60 + value.second
+
+
+def hour_windows(start_hour: time, end_hour: time) -> list[tuple[int, int]]:
+    """
+    Converts the hours of a rate detail to the windows in seconds of the day.
+
+    The start hour is included and the end hour is not. Equal hours cover the
+    whole day, and an end hour before the start hour wraps over the midnight.
+
+    :param start_hour: The start hour.
+    :type start_hour: time
+    :param end_hour: The end hour.
+    :type end_hour: time
+    :return: The windows as the pairs of the start and the end seconds.
+    :rtype: list[tuple[int, int]]
+    """
+    start, end = seconds_of_day(start_hour), seconds_of_day(end_hour)
+    if start == end:
+        return [(0, SECONDS_IN_DAY)]
+    if start < end:
+        return [(start, end)]
+    return [(start, SECONDS_IN_DAY), (0, end)]
+
+
+class RateSchedule:
+    """
+    The schedule of one rate, resolved into the amounts of the elementary
+    intervals of the dates and the hours.
+
+    The boundaries of the date ranges of the details split the dates into the
+    intervals covered by the same details, and the boundaries of their hour
+    windows split the day of every interval the same way. When several
+    details cover a moment, the one with the latest start date wins, then the
+    one with the narrowest hour window. An amount is then found by two binary
+    searches.
+
+    A moment not covered by any detail gets the amount of its hour in the
+    closest interval before it that covers the hour, or after it if there is
+    none, so a car is never parked for free because of a gap in the schedule,
+    and an expired seasonal detail doesn't outlive the ones that ended later.
+    """
+
+    def __init__(self, details: list):
+        self.date_bounds = []
+        self.days = []
+        details = sorted(details, key=lambda detail: (detail.start_date, detail.id))
+        # the last resort is the detail that ended last, by the end dates
+        ended = sorted(details, key=lambda detail: detail.end_date)
+        self.fallback_dates = [detail.end_date.toordinal() for detail in ended]
+        self.fallback_amounts = [detail.amount for detail in ended]
+        if not details:
+            return
+        bounds = sorted(
+            {detail.start_date.toordinal() for detail in details}
+            | {detail.end_date.toordinal() + 1 for detail in details}
+        )
+        for start, end in zip(bounds, bounds[1:]):
+            covering = [
+                detail
+                for detail in details
+                if detail.start_date.toordinal() <= start
+                and end <= detail.end_date.toordinal() + 1
+            ]
+            self.date_bounds.append(start)
+            self.days.append(self._resolve_day(covering) if covering else None)
+        self.date_bounds.append(bounds[-1])
+
+    @staticmethod
+    def _resolve_day(details: list) -> tuple[list[int], list]:
+        windows = [
+            (window, detail)
+            for detail in details
+            for window in hour_windows(detail.start_hour, detail.end_hour)
+        ]
+        bounds = sorted(
+            {0, SECONDS_IN_DAY} | {edge for window, _ in windows for edge in window}
+        )
+        starts, amounts = [], []
+        for start, end in zip(bounds, bounds[1:]):
+            covering = [
+                detail
+                for (window_start, window_end), detail in windows
+                if window_start <= start and end <= window_end
+            ]
+            winner = (
+                max(
+                    covering,
+                    key=lambda detail: (
+                        detail.start_date,
+                        -sum(
+                            window_end - window_start
+                            for window_start, window_end in hour_windows(
+                                detail.start_hour, detail.end_hour
+                            )
+                        ),
+                    ),
+                )
+                if covering
+                else None
+            )
+            amount = winner.amount if winner is not None else None
+            # the neighbour segments with the same amount are merged
+            if amounts and amounts[-1] == amount:
+                continue
+            starts.append(start)
+            amounts.append(amount)
+        return starts, amounts
+
+    def resolve(self, moment: datetime):
+        """
+        Finds the amount of the rate at the moment.
+
+        :param moment: The moment in the time zone of the rate hours.
+        :type moment: datetime
+        :return: The amount, or None if the rate has no details.
+        :rtype: Decimal | None
+        """
+        if not self.fallback_amounts:
+            return None
+        day = moment.date().toordinal()
+        seconds = seconds_of_day(moment.time())
+        index = bisect_right(self.date_bounds, day) - 1
+        index = min(max(index, 0), len(self.days) - 1)
+        # the interval of the moment, then the closest earlier ones, so a
+        # moment after the expired details gets the ones that ended last,
+        # then the later ones for a moment before all of them
+        for candidate in [*range(index, -1, -1), *range(index + 1, len(self.days))]:
+            if self.days[candidate] is None:
+                continue
+            starts, amounts = self.days[candidate]
+            amount = amounts[bisect_right(starts, seconds) - 1]
+            if amount is not None:
+                return amount
+        index = bisect_right(self.fallback_dates, day) - 1
+        return self.fallback_amounts[max(index, 0)]
+
+
+class RateIndex:
+    """
+    The schedules of all the rates, kept in memory, so the charging job
+    resolves the amounts without querying the database for every car.
+
+    The writes of the rates and the rate details through the repositories
+    rebuild the schedule of their rate at once. The writes of the other API
+    replicas are found by the fingerprint of the rate_details table, the
+    number of its rows and their latest update, checked once before the
+    resolution of a batch, and the whole index is reloaded at least every
+    max_age seconds.
+
+    The dates and the hours of the details are the local ones of the
+    timezone, so an aware moment is converted to it before the resolution.
+    """
+
+    def __init__(self, max_age: float, timezone: ZoneInfo):
+        self.max_age = max_age
+        self.timezone = timezone
+        self.schedules = {}
+        self.fingerprint = None
+        self.loaded_at = None
+        self.reloads = 0
+        self.refreshes = 0
+
+    @staticmethod
+    async def _fingerprint(session: AsyncSession) -> tuple:
+        result = await session.execute(
+            select(func.count(RateDetail.id), func.max(RateDetail.updated_at))
+        )
+        return tuple(result.one())
+
+    async def reload(self, session: AsyncSession) -> None:
+        """
+        Loads the schedules of all the rates.
+
+        :param session: The database session.
+        :type session: AsyncSession
+        """
+        fingerprint = await self._fingerprint(session)
+        result = await session.execute(select(RateDetail))
+        details = {}
+        for detail in result.scalars():
+            details.setdefault(detail.rate_id, []).append(detail)
+        self.schedules = {
+            rate_id: RateSchedule(rate_details)
+            for rate_id, rate_details in details.items()
+        }
+        self.fingerprint = fingerprint
+        self.loaded_at = monotonic()
+        self.reloads += 1
+
+    async def ensure_fresh(self, session: AsyncSession) -> None:
+        """
+        Reloads the schedules if the rate details were changed elsewhere.
+
+        :param session: The database session.
+        :type session: AsyncSession
+        """
+        if (
+            self.loaded_at is None
+            or monotonic() - self.loaded_at > self.max_age
+            or await self._fingerprint(session) != self.fingerprint
+        ):
+            await self.reload(session)
+
+    async def refresh_rate(self, rate_id, session: AsyncSession) -> None:
+        """
+        Rebuilds the schedule of the rate after a write.
+
+        :param rate_id: The ID of the rate.
+        :type rate_id: UUID | int
+        :param session: The database session.
+        :type session: AsyncSession
+        """
+        if self.loaded_at is None:
+            return
+        result = await session.execute(
+            select(RateDetail).filter(RateDetail.rate_id == rate_id)
+        )
+        details = list(result.scalars())
+        if details:
+            self.schedules[rate_id] = RateSchedule(details)
+        else:
+            self.schedules.pop(rate_id, None)
+        self.fingerprint = await self._fingerprint(session)
+        self.refreshes += 1
+
+    def resolve(self, rate_id, moment: datetime):
+        """
+        Finds the amount of the rate at the moment without the database.
+
+        :param rate_id: The ID of the rate.
+        :type rate_id: UUID | int
+        :param moment: The moment, a naive one is taken as a local one.
+        :type moment: datetime
+        :return: The amount, or None if the rate is unknown or has no details.
+        :rtype: Decimal | None
+        """
+        schedule = self.schedules.get(rate_id)
+        if schedule is None:
+            return None
+        if moment.tzinfo is not None:
+            moment = moment.astimezone(self.timezone)
+        return schedule.resolve(moment)
+
+    def day_start(self, moment: datetime) -> datetime:
+        """
+        Finds the start of the local day of the moment, so the days of the
+        charges begin at the same midnight as the dates of the rates.
+
+        :param moment: The aware moment.
+        :type moment: datetime
+        :return: The local midnight in the time zone of the moment.
+        :rtype: datetime
+        """
+        local = moment.astimezone(self.timezone)
+        midnight = datetime.combine(local.date(), time(0), tzinfo=self.timezone)
+        return midnight.astimezone(moment.tzinfo)
+
+    def resolve_many(self, pairs) -> list:
+        """
+        Finds the amounts of the rates at the moments.
+
+        :param pairs: The pairs of the rate ID and the moment.
+        :type pairs: Iterable[tuple[UUID | int, datetime]]
+        :return: The amounts in the order of the pairs.
+        :rtype: list[Decimal | None]
+        """
+        return [self.resolve(rate_id, moment) for rate_id, moment in pairs]
+
+    def stats(self) -> dict:
+        return {
+            "rates": len(self.schedules),
+            "reloads": self.reloads,
+            "refreshes": self.refreshes,
+        }
+
+
+rate_index = RateIndex(settings.rates_index_max_age, ZoneInfo(settings.rates_timezone))
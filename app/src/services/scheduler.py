@@ -1,67 +1,52 @@
+from time import perf_counter
+
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
-from apscheduler.jobstores.redis import RedisJobStore
 
-from src.conf.config import settings
 from src.database.connect_db import get_session
-from src.database.models import TrxType
-from src.repository import cars as repository_cars
-from src.repository import financial_transactions as repository_financial_transactions
-from src.repository import rates as repository_rates
 from src.repository import reservations as repository_reservations
-from src.repository import users as repository_users
-from src.schemas.financial_transactions import FinancialTransactionModel
-from src.schemas.reservations import ReservationUpdateModel
-from src.services.email import send_email_for_limit_warning
+from src.services.coordination import job_coordinator
+from src.services.notifications import limit_warning_notifier
 
 
-scheduler = AsyncIOScheduler(
-    jobstores={
-        "default": RedisJobStore(
-            db=settings.redis_db_for_apscheduler,
-            host=settings.redis_host,
-            port=settings.redis_port,
-            password=settings.redis_password,
-        )
-    }
-)
+# the jobs fire in every replica and the coordinator decides which one does
+# the work, so they live in the memory of the replica: a shared job store
+# would run them in whichever replica picks them up first
+scheduler = AsyncIOScheduler()
 
 
 @scheduler.scheduled_job("cron", second=0)
 async def make_charges_to_in_house_reservations():
+    assignment = await job_coordinator.assignment()
+    if assignment is None:
+        return
     async for session in get_session():
-        reservations = await repository_reservations.get_all_in_house_reservations(
-            session
+        start = perf_counter()
+        charged = await repository_reservations.charge_in_house_reservations(
+            session, *assignment
         )
-        for reservation in reservations.all():
-            amount = await repository_rates.get_rate_amount(
-                reservation.rate_id, session
-            )
-            if not reservation.user_id:
-                car = await repository_cars.read_car_by_car_id(
-                    reservation.car_id, session
-                )
-                if car.user_id:
-                    reservation.user_id = car.user_id
-            data = FinancialTransactionModel(
-                trx_type=TrxType.CHARGE,
-                debit=amount,
-                credit=0.0,
-                user_id=reservation.user_id,
-                reservation_id=reservation.id,
-            )
-            financial_transaction = (
-                await repository_financial_transactions.create_financial_transaction(
-                    data, session
-                )
-            )
-            debit, credit = (
-                await repository_reservations.get_debit_credit_of_reservation(
-                    financial_transaction.reservation_id, session
-                )
-            )
-            data = ReservationUpdateModel(debit=debit, credit=credit)
-            await repository_reservations.update_reservation(
-                financial_transaction.reservation_id, data, session
+        print(
+            f"Charged {charged} in-house reservations "
+            f"in {perf_counter() - start:.3f} s"
+        )
+
+
+@scheduler.scheduled_job("cron", minute=30, second=30)
+async def reconcile_reservation_balances():
+    assignment = await job_coordinator.assignment()
+    if assignment is None:
+        return
+    async for session in get_session():
+        start = perf_counter()
+        drift = await repository_reservations.get_balance_drift(session, *assignment)
+        print(
+            f"Checked the reservation balances against the ledger "
+            f"in {perf_counter() - start:.3f} s, {len(drift)} drifted"
+        )
+        for row in drift:
+            print(
+                f"Reservation {row.id} balance drift: "
+                f"debit {row.debit} vs {row.ledger_debit}, "
+                f"credit {row.credit} vs {row.ledger_credit}"
             )
 
 
@@ -70,21 +55,11 @@ LIMIT_WARNING = 1000
 
 @scheduler.scheduled_job("cron", second=0)
 async def check_for_limit_warnings():
+    assignment = await job_coordinator.assignment()
+    if assignment is None:
+        return
     async for session in get_session():
-        reservations = await repository_reservations.get_all_in_house_reservations(
-            session
+        rows = await repository_reservations.get_over_limit_reservations(
+            LIMIT_WARNING, session, *assignment
         )
-        for reservation in reservations.all():
-            balance = reservation.debit - reservation.credit
-            if balance > LIMIT_WARNING:
-                user_id = reservation.user_id
-                if not user_id:
-                    car = await repository_cars.read_car_by_car_id(
-                        reservation.car_id, session
-                    )
-                    user_id = car.user_id
-                if user_id:
-                    user = await repository_users.get_user_by_id(user_id, session)
-                    await send_email_for_limit_warning(
-                        user.email, user.username, balance
-                    )
+        await limit_warning_notifier.notify(rows, LIMIT_WARNING)
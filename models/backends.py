@@ -0,0 +1,121 @@
+"""
+Inference backends of the character classifier
+"""
+
+from pathlib import Path
+import threading
+
+from keras.models import model_from_json
+import numpy as np
+import tensorflow as tf
+
+
+BACKENDS = ("keras", "graph", "tflite")
+
+
+def load_keras_model(model_dir: Path):
+    """Load the model architecture from JSON and the weights
+
+    :model_dir path: The directory with model.json and model.weights.h5
+    """
+    with open(model_dir / "model.json", "r") as json_file:
+        loaded_model_json = json_file.read()
+    model = model_from_json(loaded_model_json)
+    model.load_weights(str(model_dir / "model.weights.h5"))
+    return model
+
+
+class KerasBackend:
+    """Runs the Keras model as it is."""
+
+    name = "keras"
+
+    def __init__(self, model):
+        self.model = model
+
+    def predict(self, batch: np.ndarray) -> np.ndarray:
+        return np.asarray(self.model.predict_on_batch(batch))
+
+
+class GraphBackend:
+    """Runs the Keras model as a graph compiled by ``tf.function``.
+
+    The input signature is fixed, so the graph is traced once for any batch
+    size instead of once per shape.
+    """
+
+    name = "graph"
+
+    def __init__(self, model):
+        self.model = model
+        self.function = tf.function(
+            lambda batch: model(batch, training=False),
+            input_signature=[tf.TensorSpec([None, 28, 28, 3], tf.float32)],
+            reduce_retracing=True,
+        )
+
+    def predict(self, batch: np.ndarray) -> np.ndarray:
+        return self.function(tf.convert_to_tensor(batch, tf.float32)).numpy()
+
+
+class TFLiteBackend:
+    """Runs the model converted to TFLite by convert_model.py.
+
+    The interpreter is not thread-safe, so every thread of the executor gets
+    its own one. They all map the same model file, so the weights are loaded
+    into memory once.
+    """
+
+    name = "tflite"
+
+    def __init__(self, model_path: Path, num_threads: int | None = None):
+        self.model_path = str(model_path)
+        self.num_threads = num_threads
+        self.local = threading.local()
+        # fail at the startup instead of the first request if the file is broken
+        self._interpreter()
+
+    def _interpreter(self):
+        interpreter = getattr(self.local, "interpreter", None)
+        if interpreter is None:
+            interpreter = tf.lite.Interpreter(
+                model_path=self.model_path, num_threads=self.num_threads
+            )
+            interpreter.allocate_tensors()
+            self.local.interpreter = interpreter
+            self.local.batch_size = None
+        return interpreter
+
+    def predict(self, batch: np.ndarray) -> np.ndarray:
+        interpreter = self._interpreter()
+        input_index = interpreter.get_input_details()[0]["index"]
+        if self.local.batch_size != len(batch):
+            interpreter.resize_tensor_input(input_index, batch.shape, strict=False)
+            interpreter.allocate_tensors()
+            self.local.batch_size = len(batch)
+        interpreter.set_tensor(input_index, batch.astype(np.float32, copy=False))
+        interpreter.invoke()
+        output_index = interpreter.get_output_details()[0]["index"]
+        return interpreter.get_tensor(output_index).copy()
+
+
+def load_backend(
+    name: str,
+    model_dir: Path,
+    tflite_path: Path | None = None,
+    num_threads: int | None = None,
+):
+    """Create the inference backend by its name
+
+    :name name: One of BACKENDS
+    :model_dir path: The directory with the Keras model
+    :tflite_path path: The TFLite model, model.tflite in model_dir by default
+    :num_threads threads: The number of threads of the TFLite interpreter
+    """
+    if name == "keras":
+        return KerasBackend(load_keras_model(model_dir))
+    if name == "graph":
+        return GraphBackend(load_keras_model(model_dir))
+    if name == "tflite":
+        return TFLiteBackend(tflite_path or model_dir / "model.tflite", num_threads)
+    raise ValueError(f"Unknown inference backend: {name}")
@@ -0,0 +1,291 @@
+"""
+Recognition benchmark and accuracy harness over the demo_car_img images.
+
+Runs the full /process_image pipeline in-process (or through HTTP against a
+running server with --url) over the sample images and their synthetic
+augmentations, and reports per-stage latency percentiles, throughput at
+several concurrency levels, peak RSS and the plate accuracy as JSON, so the
+runs can be diffed. With --allocations the samples are run once more one by
+one under tracemalloc to report the memory allocated by every request.
+
+    python benchmark.py --concurrency 1,4,16 --output before.json
+    python benchmark.py --url http://localhost:8001 --concurrency 1,8
+    python benchmark.py --concurrency 1 --allocations
+"""
+
+import argparse
+import asyncio
+from collections import defaultdict
+from datetime import datetime, timezone
+import io
+import json
+from pathlib import Path
+import resource
+import sys
+from time import perf_counter
+import tracemalloc
+
+import cv2
+import numpy as np
+from starlette.datastructures import UploadFile
+
+import main_model
+
+IMAGES_DIR = main_model.MODEL_DIR.parent / "demo_car_img"
+
+
+def augment(img, seed: int):
+    """Make the synthetic variations of the image
+
+    :img image: The source image
+    :seed seed: The seed of the random noise
+    """
+    rng = np.random.default_rng(seed)
+    height, width = img.shape[:2]
+    rotation = cv2.getRotationMatrix2D((width / 2, height / 2), 5, 1.0)
+    noise = rng.normal(0, 8, img.shape)
+    return {
+        "bright": cv2.convertScaleAbs(img, alpha=1.0, beta=40),
+        "dark": cv2.convertScaleAbs(img, alpha=1.0, beta=-40),
+        "blur": cv2.GaussianBlur(img, (5, 5), 0),
+        "rotate": cv2.warpAffine(img, rotation, (width, height)),
+        "noise": np.clip(img + noise, 0, 255).astype(np.uint8),
+        "half": cv2.resize(img, (width // 2, height // 2)),
+    }
+
+
+def load_samples(images_dir: Path, augmentations: bool, seed: int):
+    """Load the sample images as upload bytes
+
+    Every sample is (name, source image name, bytes); the augmented samples
+    keep the name of the source image to share its label.
+    """
+    samples = []
+    for path in sorted(images_dir.iterdir()):
+        img = cv2.imread(str(path))
+        if img is None:
+            continue
+        samples.append((path.name, path.name, path.read_bytes()))
+        if augmentations:
+            for name, variant in augment(img, seed).items():
+                _, encoded = cv2.imencode(
+                    ".jpg", variant, [cv2.IMWRITE_JPEG_QUALITY, 90]
+                )
+                samples.append((f"{path.name}:{name}", path.name, encoded.tobytes()))
+    return samples
+
+
+def percentiles(values) -> dict:
+    if not values:
+        return {"count": 0}
+    values = np.asarray(values) * 1000
+    return {
+        "count": len(values),
+        "mean_ms": float(values.mean()),
+        "p50_ms": float(np.percentile(values, 50)),
+        "p90_ms": float(np.percentile(values, 90)),
+        "p95_ms": float(np.percentile(values, 95)),
+        "p99_ms": float(np.percentile(values, 99)),
+        "max_ms": float(values.max()),
+    }
+
+
+def accuracy(readings: dict, samples, labels: dict) -> dict:
+    """Score the readings against the labels
+
+    Without labels for a sample, the reading of the original image is taken
+    as the reference, so the augmented readings measure the consistency.
+    """
+    report = {"samples": len(samples), "recognized": 0}
+    correct = labelled = consistent = augmented = 0
+    for name, source, _ in samples:
+        reading = readings[name]
+        report["recognized"] += bool(reading)
+        if source in labels:
+            labelled += 1
+            correct += reading == labels[source]
+        if name != source:
+            augmented += 1
+            consistent += reading == readings[source]
+    report["recognized_rate"] = report["recognized"] / len(samples) if samples else 0.0
+    report["labelled"] = labelled
+    report["plate_accuracy"] = correct / labelled if labelled else None
+    report["augmentation_consistency"] = consistent / augmented if augmented else None
+    return report
+
+
+async def run_in_process(samples, concurrency: int):
+    """Run the samples through the /process_image handler of the service"""
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    readings = {}
+
+    async def run(name, img_bytes):
+        async with semaphore:
+            start = perf_counter()
+            response = await main_model.upload_image(
+                UploadFile(io.BytesIO(img_bytes), filename=name), camera_id=None
+            )
+            latencies.append(perf_counter() - start)
+            readings[name] = response["result"]
+
+    start = perf_counter()
+    await asyncio.gather(*(run(name, img_bytes) for name, _, img_bytes in samples))
+    return readings, latencies, perf_counter() - start
+
+
+async def measure_allocations(samples) -> dict:
+    """Run the samples one by one and measure the memory allocated by each
+
+    The peak is the largest amount of memory allocated by the request on top of
+    what was allocated before it, and the retained memory is what is still
+    allocated after it. tracemalloc sees the NumPy arrays, so the OpenCV images
+    are counted as well.
+    """
+    peaks = []
+    retained = []
+    tracemalloc.start()
+    try:
+        for name, _, img_bytes in samples:
+            before, _ = tracemalloc.get_traced_memory()
+            tracemalloc.reset_peak()
+            await main_model.upload_image(
+                UploadFile(io.BytesIO(img_bytes), filename=name), camera_id=None
+            )
+            after, peak = tracemalloc.get_traced_memory()
+            peaks.append(peak - before)
+            retained.append(after - before)
+    finally:
+        tracemalloc.stop()
+    peaks = np.asarray(peaks) / 2**20
+    return {
+        "requests": len(samples),
+        "upload_mb": float(np.mean([len(sample[2]) for sample in samples]) / 2**20),
+        "peak_mean_mb": float(peaks.mean()),
+        "peak_p50_mb": float(np.percentile(peaks, 50)),
+        "peak_p95_mb": float(np.percentile(peaks, 95)),
+        "peak_max_mb": float(peaks.max()),
+        "retained_mean_mb": float(np.mean(retained) / 2**20),
+    }
+
+
+async def run_http(samples, concurrency: int, url: str):
+    """Run the samples through a running recognition server"""
+    from httpx import AsyncClient
+
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    readings = {}
+
+    async with AsyncClient(base_url=url, timeout=60) as client:
+
+        async def run(name, img_bytes):
+            async with semaphore:
+                start = perf_counter()
+                response = await client.post(
+                    "/process_image", files={"img_file": (name, img_bytes)}
+                )
+                latencies.append(perf_counter() - start)
+                readings[name] = response.json().get("result")
+
+        start = perf_counter()
+        await asyncio.gather(*(run(name, img_bytes) for name, _, img_bytes in samples))
+        return readings, latencies, perf_counter() - start
+
+
+async def benchmark(args, samples, labels):
+    stages = defaultdict(list)
+
+    def observe(stage, seconds):
+        stages[stage].append(seconds)
+
+    runs = []
+    allocations = None
+    if args.url is None:
+        # the cache would hide the cost of the pipeline from the second run on
+        main_model.cache.mode = args.cache
+        main_model.stage_observers.append(observe)
+        async with main_model.lifespan(main_model.app):
+            while not main_model.registry.is_ready:
+                if main_model.registry.error:
+                    sys.exit(f"Model loading error: {main_model.registry.error}")
+                await asyncio.sleep(0.1)
+            for concurrency in args.concurrency:
+                stages.clear()
+                readings, latencies, elapsed = await run_in_process(
+                    samples, concurrency
+                )
+                runs.append(
+                    report_run(concurrency, readings, latencies, elapsed, stages)
+                )
+            if args.allocations:
+                allocations = await measure_allocations(samples)
+    else:
+        for concurrency in args.concurrency:
+            readings, latencies, elapsed = await run_http(
+                samples, concurrency, args.url
+            )
+            runs.append(report_run(concurrency, readings, latencies, elapsed, {}))
+
+    return {
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "mode": "http" if args.url else "in_process",
+        "url": args.url,
+        "inference_backend": main_model.INFERENCE_BACKEND,
+        "strategy_mode": main_model.STRATEGY_MODE,
+        "cache_mode": args.cache if args.url is None else None,
+        "samples": len(samples),
+        "runs": runs,
+        "accuracy": accuracy(readings, samples, labels),
+        "allocations": allocations,
+        # ru_maxrss is in kilobytes on Linux
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+
+
+def report_run(concurrency, readings, latencies, elapsed, stages) -> dict:
+    return {
+        "concurrency": concurrency,
+        "elapsed_s": elapsed,
+        "throughput_per_s": len(latencies) / elapsed if elapsed else 0.0,
+        "latency": percentiles(latencies),
+        "stages": {stage: percentiles(values) for stage, values in stages.items()},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--images", type=Path, default=IMAGES_DIR)
+    parser.add_argument(
+        "--labels",
+        type=Path,
+        help='JSON file with the true plates: {"Car0.png": "AB1234CD", ...}',
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=lambda value: [int(level) for level in value.split(",")],
+        default=[1, 4, 16],
+    )
+    parser.add_argument("--no-augmentations", action="store_true")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--url", help="benchmark a running server through HTTP")
+    parser.add_argument("--cache", choices=("off", "exact"), default="off")
+    parser.add_argument(
+        "--allocations",
+        action="store_true",
+        help="measure the memory allocated by every request (in-process only)",
+    )
+    parser.add_argument("--output", type=Path, help="write the JSON report to the file")
+    args = parser.parse_args()
+
+    labels = json.loads(args.labels.read_text()) if args.labels else {}
+    samples = load_samples(args.images, not args.no_augmentations, args.seed)
+    report = asyncio.run(benchmark(args, samples, labels))
+    output = json.dumps(report, indent=2)
+    if args.output:
+        args.output.write_text(output)
+    print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+"""
+Offline conversion of the character classifier to TFLite and the accuracy
+parity check of the inference backends against the Keras model.
+
+    python convert_model.py --quantization float16
+    python convert_model.py --quantization int8 --check
+    python convert_model.py --check-only --backend graph
+"""
+
+import argparse
+import json
+from pathlib import Path
+import sys
+
+import cv2
+import numpy as np
+import tensorflow as tf
+
+from backends import BACKENDS, load_backend
+from main_model import (
+    MODEL_DIR,
+    ModelRegistry,
+    decode_predictions,
+    detect_plate,
+    prepare_characters,
+    prepare_frame,
+    segment_characters,
+)
+
+
+IMAGES_DIR = MODEL_DIR.parent / "demo_car_img"
+
+
+def sample_plates(registry, images_dir: Path):
+    """Segment the characters of the plates found on the sample images by
+    both cascades
+
+    :registry registry: The loaded model registry
+    :images_dir path: The directory with the sample images
+    """
+    plates = []
+    for path in sorted(images_dir.iterdir()):
+        img = cv2.imread(str(path))
+        if img is None:
+            continue
+        frame = prepare_frame(img)
+        for mod in (1, 2):
+            _, chars = segment_characters(
+                detect_plate(frame, registry.cascades[mod], mod)
+            )
+            if chars is not None and len(chars):
+                plates.append(prepare_characters(chars))
+    return plates
+
+
+def convert(model, quantization: str, plates, output: Path):
+    """Convert the Keras model to TFLite
+
+    :model model: The Keras model
+    :quantization quantization: "none", "float16" or "int8"
+    :plates batches: The character batches for the int8 calibration
+    :output path: The file to write the model to
+    """
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    if quantization == "float16":
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        converter.target_spec.supported_types = [tf.float16]
+    elif quantization == "int8":
+        if not plates:
+            raise ValueError("The int8 quantization needs sample images")
+
+        def representative_dataset():
+            for batch in plates:
+                for char in batch:
+                    yield [char[np.newaxis]]
+
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        converter.representative_dataset = representative_dataset
+    output.write_bytes(converter.convert())
+
+
+def check_parity(reference, candidate, plates) -> dict:
+    """Compare the predictions of the backend with the Keras model
+
+    :reference backend: The Keras backend
+    :candidate backend: The backend to check
+    :plates batches: The character batches of the sample plates
+    """
+    chars = agreed_chars = agreed_plates = 0
+    max_abs_diff = 0.0
+    for batch in plates:
+        expected = reference.predict(batch)
+        actual = candidate.predict(batch)
+        agreed = np.argmax(expected, axis=1) == np.argmax(actual, axis=1)
+        chars += len(batch)
+        agreed_chars += int(agreed.sum())
+        agreed_plates += (
+            decode_predictions(expected).text == decode_predictions(actual).text
+        )
+        max_abs_diff = max(max_abs_diff, float(np.max(np.abs(expected - actual))))
+    return {
+        "backend": candidate.name,
+        "plates": len(plates),
+        "characters": chars,
+        "character_agreement": agreed_chars / chars if chars else 1.0,
+        "plate_agreement": agreed_plates / len(plates) if plates else 1.0,
+        "max_abs_diff": max_abs_diff,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--quantization", choices=("none", "float16", "int8"), default="float16"
+    )
+    parser.add_argument("--output", type=Path, default=MODEL_DIR / "model.tflite")
+    parser.add_argument("--images", type=Path, default=IMAGES_DIR)
+    parser.add_argument(
+        "--check", action="store_true", help="check the parity after the conversion"
+    )
+    parser.add_argument(
+        "--check-only", action="store_true", help="only check the parity"
+    )
+    parser.add_argument("--backend", choices=BACKENDS, default="tflite")
+    parser.add_argument("--min-agreement", type=float, default=0.99)
+    args = parser.parse_args()
+
+    registry = ModelRegistry(backend="keras")
+    registry.load()
+    if not registry.is_ready:
+        sys.exit(f"Model loading error: {registry.error}")
+    plates = sample_plates(registry, args.images) if args.images.is_dir() else []
+
+    if not args.check_only:
+        convert(registry.backend.model, args.quantization, plates, args.output)
+        print(f"Saved {args.quantization} model to {args.output}")
+
+    if args.check or args.check_only:
+        candidate = load_backend(args.backend, MODEL_DIR, args.output)
+        report = check_parity(registry.backend, candidate, plates)
+        print(json.dumps(report, indent=2))
+        if report["character_agreement"] < args.min_agreement:
+            sys.exit(
+                f"Character agreement {report['character_agreement']:.4f} "
+                f"is below {args.min_agreement}"
+            )
+
+
+if __name__ == "__main__":
+    main()
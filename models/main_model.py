@@ -1,4 +1,32 @@
-from fastapi import FastAPI, File, UploadFile
+from bisect import bisect_left, insort
+from collections import Counter, OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import asynccontextmanager, contextmanager
+import asyncio
+import ctypes
+from functools import partial
+import hashlib
+import json
+import multiprocessing
+from pathlib import Path
+import signal
+import socket
+import threading
+from time import monotonic, perf_counter
+from typing import List, NamedTuple
+
+from fastapi import (
+    FastAPI,
+    File,
+    Form,
+    HTTPException,
+    Request,
+    UploadFile,
+    WebSocket,
+    WebSocketDisconnect,
+    status,
+)
+from fastapi.responses import PlainTextResponse
 import uvicorn
 import numpy as np
 import cv2
@@ -8,103 +36,779 @@ import tensorflow as tf
 # from tensorflow.keras.models import Sequential
 # from tensorflow.keras.preprocessing.image import ImageDataGenerator
 # from tensorflow.keras.layers import Dense, Flatten, MaxPooling2D, Dropout, Conv2D
-from keras.models import model_from_json
 import os
 import pytesseract
 import re
+import uuid
+
+from backends import load_backend
+from metrics import Counter as MetricCounter, Gauge, Histogram, MetricsRegistry
+
+try:
+    import redis.asyncio as redis
+except ImportError:
+    redis = None
 
 pytesseract.pytesseract.tesseract_cmd = "/usr/bin/tesseract"
 
-app = FastAPI()
+MODEL_DIR = Path(__file__).resolve().parent
 
+# The inference backend of the character classifier: "keras", "graph" or
+# "tflite" (the model converted by convert_model.py)
+INFERENCE_BACKEND = os.getenv("INFERENCE_BACKEND", "keras")
+TFLITE_MODEL = Path(os.getenv("TFLITE_MODEL", MODEL_DIR / "model.tflite"))
 
-@app.post("/process_image")
-async def upload_image(img_file: UploadFile = File(...)):
-
-    img_bytes = await img_file.read()
-    np_array = np.frombuffer(img_bytes, np.uint8)
-    img_in = cv2.imdecode(np_array, cv2.IMREAD_COLOR)
-
-    def detect_plate(img, mod=1):
-        """The function detects the number plate.
-
-        :img image: The image
-        :mod mode: The model mode
-        """
-        plate_cascade_1 = cv2.CascadeClassifier("license_plate.xml")
-        plate_cascade_2 = cv2.CascadeClassifier("license_plate_m2.xml")
-
-        plate_img = img.copy()
-        roi = img.copy()
-        plate_cascade = plate_cascade_1 if mod == 1 else plate_cascade_2
-        plate_rect = plate_cascade.detectMultiScale(
-            plate_img, scaleFactor=1.2, minNeighbors=7
+# Micro-batching of the character classification across concurrent requests
+BATCH_WINDOW_MS = float(os.getenv("BATCH_WINDOW_MS", "5"))
+BATCH_MAX_SIZE = int(os.getenv("BATCH_MAX_SIZE", "64"))
+
+# Serving: WORKERS processes share the listening socket and every one of them
+# is pinned to its own slice of the cores. INTRA_OP_THREADS is the number of
+# the TensorFlow, TFLite and OpenCV threads of a worker, its share of the cores
+# by default, so the workers don't oversubscribe the CPU. With the "tflite"
+# backend all the workers map the same model file, so the weights are in
+# memory once whatever the number of the workers
+HOST = os.getenv("HOST", "0.0.0.0")
+PORT = int(os.getenv("PORT", "8001"))
+WORKERS = int(os.getenv("WORKERS", "1"))
+PIN_WORKERS = os.getenv("PIN_WORKERS", "True").lower() in ("1", "true", "yes")
+INTRA_OP_THREADS = int(
+    os.getenv("INTRA_OP_THREADS", str(max(1, len(os.sched_getaffinity(0)) // WORKERS)))
+)
+
+# Executors for the CPU-bound stages of the pipeline
+CPU_WORKERS = int(os.getenv("CPU_WORKERS", str(INTRA_OP_THREADS)))
+OCR_WORKERS = int(os.getenv("OCR_WORKERS", "2"))
+MAX_PENDING_REQUESTS = int(os.getenv("MAX_PENDING_REQUESTS", "32"))
+
+# The maximum number of frames in one /process_images request
+MAX_FRAMES = int(os.getenv("MAX_FRAMES", "16"))
+
+# How the recognition strategies are combined: "sequential" or "race"
+STRATEGY_MODE = os.getenv("STRATEGY_MODE", "sequential")
+MIN_CONFIDENCE = float(os.getenv("MIN_CONFIDENCE", "0"))
+
+# Cache of the recognition results: "exact" keys by the upload bytes, "off"
+# disables it. There is no similarity key: a hash of the whole frame barely
+# changes with the plate, so a car at a static gate would get the plate of the
+# car before it
+CACHE_MODE = os.getenv("CACHE_MODE", "exact")
+CACHE_MAX_SIZE = int(os.getenv("CACHE_MAX_SIZE", "1024"))
+CACHE_TTL = int(os.getenv("CACHE_TTL", "300"))
+CACHE_REDIS_URL = os.getenv("CACHE_REDIS_URL")
+
+# The plates are detected on the frame downscaled to WORKING_SIZE pixels on
+# the longest side, within the region of interest of the camera if it is set:
+# CAMERA_ROIS='{"gate-1": [x, y, width, height]}' in fractions of the frame
+WORKING_SIZE = int(os.getenv("WORKING_SIZE", "1280"))
+CAMERA_ROIS = json.loads(os.getenv("CAMERA_ROIS", "{}"))
+
+# The uploads are read into reusable buffers, and the JPEG and PNG images
+# larger than DECODE_SIZE pixels on the longest side are decoded at 1/2, 1/4
+# or 1/8 of their size as long as they stay at least that large (0 decodes
+# them at the full size). The free buffers hold up to UPLOAD_POOL_BYTES, and
+# a buffer larger than UPLOAD_POOL_BUFFER_SIZE is freed after its request, so
+# a burst of large uploads doesn't stay in memory
+MAX_UPLOAD_SIZE = int(os.getenv("MAX_UPLOAD_SIZE", str(20 * 1024 * 1024)))
+UPLOAD_POOL_BYTES = int(os.getenv("UPLOAD_POOL_BYTES", str(64 * 1024 * 1024)))
+UPLOAD_POOL_BUFFER_SIZE = int(
+    os.getenv("UPLOAD_POOL_BUFFER_SIZE", str(4 * 1024 * 1024))
+)
+DECODE_SIZE = int(os.getenv("DECODE_SIZE", str(WORKING_SIZE)))
+
+# Streaming ingestion: a frame of the feed is recognized only if it differs
+# from the previous one in more than STREAM_MOTION_THRESHOLD of the pixels of
+# its STREAM_MOTION_SIZE thumbnail and a plate cascade finds a plate on it
+# downscaled to STREAM_GATE_SIZE. The plate event is sent once the reading is
+# the same on STREAM_STABLE_FRAMES recognized frames in a row, and the same
+# plate is reported again only after STREAM_RESET_FRAMES frames without a plate
+STREAM_MOTION_SIZE = int(os.getenv("STREAM_MOTION_SIZE", "64"))
+STREAM_MOTION_THRESHOLD = float(os.getenv("STREAM_MOTION_THRESHOLD", "0.02"))
+STREAM_GATE_SIZE = int(os.getenv("STREAM_GATE_SIZE", "640"))
+STREAM_STABLE_FRAMES = int(os.getenv("STREAM_STABLE_FRAMES", "3"))
+STREAM_RESET_FRAMES = int(os.getenv("STREAM_RESET_FRAMES", "10"))
+
+# Draw the character rectangles on the plate and save it for debugging
+DEBUG_DRAW = os.getenv("DEBUG_DRAW", "False").lower() in ("1", "true", "yes")
+DEBUG_DIR = Path(os.getenv("DEBUG_DIR", MODEL_DIR / "debug"))
+
+# The thread pools are created on the first use, so this must come first
+tf.config.threading.set_intra_op_parallelism_threads(INTRA_OP_THREADS)
+tf.config.threading.set_inter_op_parallelism_threads(1)
+cv2.setNumThreads(INTRA_OP_THREADS)
+
+metrics = MetricsRegistry()
+STAGE_SECONDS = metrics.register(
+    Histogram(
+        "recognition_stage_duration_seconds",
+        "Duration of the recognition pipeline stages",
+        ["stage"],
+    )
+)
+STAGES_IN_FLIGHT = metrics.register(
+    Gauge(
+        "recognition_stages_in_flight",
+        "Number of the pipeline stages being processed",
+        ["stage"],
+    )
+)
+REQUEST_SECONDS = metrics.register(
+    Histogram(
+        "recognition_request_duration_seconds",
+        "Duration of the recognition requests",
+        ["endpoint"],
+    )
+)
+REQUESTS = metrics.register(
+    MetricCounter(
+        "recognition_requests_total",
+        "Number of the recognition requests by the response status",
+        ["endpoint", "status"],
+    )
+)
+RESULTS = metrics.register(
+    MetricCounter(
+        "recognition_results_total",
+        "Number of the recognized frames by the path that produced the answer",
+        ["strategy"],
+    )
+)
+STREAMS_OPEN = metrics.register(
+    Gauge("recognition_streams_open", "Number of the open frame streams")
+)
+STREAM_FRAMES = metrics.register(
+    MetricCounter(
+        "recognition_stream_frames_total",
+        "Number of the stream frames by what happened to them",
+        ["result"],
+    )
+)
+STREAM_EVENTS = metrics.register(
+    MetricCounter(
+        "recognition_stream_events_total", "Number of the stable plate events sent"
+    )
+)
+
+# Observers of the pipeline stage durations, called as observer(stage, seconds)
+stage_observers = [lambda stage, seconds: STAGE_SECONDS.observe(seconds, stage=stage)]
+
+
+@contextmanager
+def timed_stage(stage: str):
+    """Measure the duration of the pipeline stage and report it to the observers."""
+    STAGES_IN_FLIGHT.inc(stage=stage)
+    start = perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = perf_counter() - start
+        STAGES_IN_FLIGHT.dec(stage=stage)
+        for observer in stage_observers:
+            observer(stage, elapsed)
+
+
+class ModelRegistry:
+    """Holds the character classifier and both plate cascades for the process.
+
+    The model and the cascades are loaded once at startup and then shared by
+    all requests instead of being rebuilt on every call.
+    """
+
+    def __init__(self, model_dir: Path = MODEL_DIR, backend: str = INFERENCE_BACKEND):
+        self.model_dir = model_dir
+        self.backend_name = backend
+        self.backend = None
+        self.cascades = {}
+        self.is_ready = False
+        self.error = None
+
+    def load(self):
+        """Load the inference backend and the cascades, then warm up the model."""
+        try:
+            backend = load_backend(
+                self.backend_name, self.model_dir, TFLITE_MODEL, INTRA_OP_THREADS
+            )
+            # The first predict builds the graph, so do it before taking traffic
+            backend.predict(np.zeros((1, 28, 28, 3), dtype=np.float32))
+
+            cascades = {
+                1: cv2.CascadeClassifier(str(self.model_dir / "license_plate.xml")),
+                2: cv2.CascadeClassifier(str(self.model_dir / "license_plate_m2.xml")),
+            }
+            for mod, cascade in cascades.items():
+                if cascade.empty():
+                    raise RuntimeError(f"Cascade for model {mod} could not be loaded")
+
+            self.backend = backend
+            self.cascades = cascades
+            self.is_ready = True
+        except Exception as error_message:
+            self.error = str(error_message)
+            print(f"Model loading error: {self.error}")
+
+
+registry = ModelRegistry()
+
+
+def exit_with_parent():
+    """Make the process get killed when its parent dies
+
+    A killed worker of the server leaves its OCR processes waiting on the task
+    queue forever otherwise.
+    """
+    PR_SET_PDEATHSIG = 1
+    ctypes.CDLL(None).prctl(PR_SET_PDEATHSIG, signal.SIGKILL)
+
+
+class ExecutorPool:
+    """Runs the CPU-bound stages of the pipeline off the event loop.
+
+    OpenCV and TensorFlow release the GIL, so they run in a thread pool, while
+    pytesseract goes to a process pool. The number of admitted requests is
+    bounded and the requests above the limit fail fast with 503.
+    """
+
+    def __init__(self, cpu_workers: int, ocr_workers: int, max_pending: int):
+        self.cpu_workers = cpu_workers
+        self.ocr_workers = ocr_workers
+        self.max_pending = max_pending
+        self.pending = 0
+        self.rejected = 0
+        self.cpu = None
+        self.ocr = None
+
+    def start(self):
+        self.cpu = ThreadPoolExecutor(
+            max_workers=self.cpu_workers, thread_name_prefix="recognition"
         )
-        plate = None
-        for x, y, w, h in plate_rect:
-            roi_ = roi[y : y + h, x : x + w, :]
-            plate = (
-                roi[y : y + h, x : x + w, :]
-                if mod == 1
-                else roi[y + 10 : y + 10 + h - 20, x + 5 : x + 5 + w - 10, :]
+        # The OCR workers are forked before the model is loaded, so they
+        # don't inherit the TensorFlow runtime threads
+        self.ocr = ProcessPoolExecutor(
+            max_workers=self.ocr_workers,
+            mp_context=multiprocessing.get_context("fork"),
+            initializer=exit_with_parent,
+        )
+        self.ocr.submit(os.getpid).result()
+
+    def shutdown(self, wait: bool = False):
+        if self.cpu is not None:
+            self.cpu.shutdown(wait=wait, cancel_futures=True)
+        if self.ocr is not None:
+            self.ocr.shutdown(wait=wait, cancel_futures=True)
+
+    async def run_cpu(self, fn, *args, **kwargs):
+        """Run OpenCV or TensorFlow work in the thread pool."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.cpu, partial(fn, *args, **kwargs))
+
+    async def run_ocr(self, fn, *args, **kwargs):
+        """Run Tesseract work in the process pool."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.ocr, partial(fn, *args, **kwargs))
+
+    @asynccontextmanager
+    async def admit(self):
+        """Admit a request into the pipeline or fail fast when saturated."""
+        if self.pending >= self.max_pending:
+            self.rejected += 1
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Recognition service is saturated",
             )
+        self.pending += 1
+        try:
+            yield
+        finally:
+            self.pending -= 1
+
+    def stats(self) -> dict:
+        return {
+            "pending": self.pending,
+            "max_pending": self.max_pending,
+            "rejected": self.rejected,
+        }
+
+
+executors = ExecutorPool(CPU_WORKERS, OCR_WORKERS, MAX_PENDING_REQUESTS)
+
+
+class RecognitionCache:
+    """Caches the recognized plate numbers by the content of the images.
+
+    The results live in a bounded in-process LRU and, when a Redis URL is set,
+    in Redis too, so the workers share them. The key is the hash of the
+    upload bytes, so only the same image gets the same result.
+    """
+
+    PREFIX = "plate:"
+
+    def __init__(
+        self,
+        mode: str,
+        max_size: int,
+        ttl: int,
+        redis_url: str | None = None,
+    ):
+        if mode not in ("off", "exact"):
+            raise ValueError(f"Unknown cache mode: {mode}")
+        self.mode = mode
+        self.max_size = max_size
+        self.ttl = ttl
+        self.redis_url = redis_url
+        self.redis = None
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.redis_hits = 0
+        self.misses = 0
+        self.redis_errors = 0
+
+    @property
+    def enabled(self):
+        return self.mode != "off"
 
-        if plate is None:
+    def start(self):
+        if self.enabled and self.redis_url and redis is not None:
+            self.redis = redis.from_url(
+                self.redis_url, encoding="utf-8", decode_responses=True
+            )
+
+    async def stop(self):
+        if self.redis is not None:
+            await self.redis.aclose()
+            self.redis = None
+
+    @staticmethod
+    def exact_key(img_bytes) -> str:
+        return "b:" + hashlib.blake2b(img_bytes, digest_size=16).hexdigest()
+
+    async def get(self, key):
+        result = self._get_local(key)
+        if result is not None:
+            self.hits += 1
+            return result
+        if self.redis is not None:
+            try:
+                result = await self.redis.get(self.PREFIX + key)
+            except Exception as error_message:
+                self.redis_errors += 1
+                print(f"Redis error: {str(error_message)}")
+            if result is not None:
+                self.redis_hits += 1
+                self._set_local(key, result)
+                return result
+        self.misses += 1
+        return None
+
+    async def set(self, key, result):
+        self._set_local(key, result)
+        if self.redis is not None:
+            try:
+                await self.redis.set(self.PREFIX + key, result, ex=self.ttl)
+            except Exception as error_message:
+                self.redis_errors += 1
+                print(f"Redis error: {str(error_message)}")
+
+    def _get_local(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
             return None
-        else:
-            return plate
+        result, expires_at = entry
+        if expires_at < monotonic():
+            del self.entries[key]
+            return None
+        self.entries.move_to_end(key)
+        return result
+
+    def _set_local(self, key, result):
+        self.entries[key] = (result, monotonic() + self.ttl)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.redis_hits + self.misses
+        return {
+            "mode": self.mode,
+            "size": len(self.entries),
+            "hits": self.hits,
+            "redis_hits": self.redis_hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits + self.redis_hits) / lookups if lookups else 0.0,
+            "redis_errors": self.redis_errors,
+        }
+
+
+cache = RecognitionCache(CACHE_MODE, CACHE_MAX_SIZE, CACHE_TTL, CACHE_REDIS_URL)
+
+
+class InferenceBatcher:
+    """Classifies the characters of concurrent requests in shared model calls.
 
-    file_path = "contour.png"
+    Requests put their character tensors into a queue. The collector waits up
+    to ``window_ms`` after the first item (or until ``max_size`` characters are
+    gathered), runs one model call for the whole batch and routes the slices of
+    the output back to the awaiting requests.
+    """
 
-    if os.path.exists(file_path):
-        os.remove(file_path)
+    BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256)
 
-    plate = detect_plate(img_in)
+    def __init__(self, predict, run, window_ms: float, max_size: int):
+        self.predict = predict
+        self.run = run
+        self.window = window_ms / 1000
+        self.max_size = max_size
+        self.queue = None
+        self.task = None
+        self.batches = 0
+        self.requests = 0
+        self.items = 0
+        self.batch_size_histogram = dict.fromkeys([*self.BATCH_SIZE_BUCKETS, "+Inf"], 0)
+        self.wait_time_total = 0.0
+        self.wait_time_max = 0.0
 
-    def find_contours(dimensions, img):
-        """Find all contours in the image
+    def start(self):
+        self.queue = asyncio.Queue()
+        self.task = asyncio.create_task(self._collect())
 
-        :dimensions dimensions: Dimensions
-        :img image: The plate image
-        """
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
 
-        # Find all contours in the image
-        cntrs, _ = cv2.findContours(img.copy(), cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE)
+    async def classify(self, batch: np.ndarray) -> np.ndarray:
+        """Queue the batch of characters and wait for its class probabilities."""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        await self.queue.put((batch, future, loop.time()))
+        return await future
 
-        # Retrieve potential dimensions
-        lower_width = dimensions[0]
-        upper_width = dimensions[1]
-        lower_height = dimensions[2]
-        upper_height = dimensions[3]
+    async def _collect(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            item = await self.queue.get()
+            items = [item]
+            size = len(item[0])
+            deadline = loop.time() + self.window
+            while size < self.max_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self.queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                items.append(item)
+                size += len(item[0])
+            await self._dispatch(items, size)
 
-        # Check largest 5 or  15 contours for license plate or character respectively
-        cntrs = sorted(cntrs, key=cv2.contourArea, reverse=True)[:15]
+    async def _dispatch(self, items, size):
+        now = asyncio.get_running_loop().time()
+        self._observe(items, size, now)
+        batch = np.concatenate([item_batch for item_batch, _, _ in items])
+        try:
+            y_prob = np.asarray(await self.run(self.predict, batch))
+        except Exception as error_message:
+            for _, future, _ in items:
+                if not future.done():
+                    future.set_exception(error_message)
+            return
+        offset = 0
+        for item_batch, future, _ in items:
+            if not future.done():
+                future.set_result(y_prob[offset : offset + len(item_batch)])
+            offset += len(item_batch)
 
-        ii = cv2.imread("contour.png")
+    def _observe(self, items, size, now):
+        self.batches += 1
+        self.requests += len(items)
+        self.items += size
+        bucket = next((b for b in self.BATCH_SIZE_BUCKETS if size <= b), "+Inf")
+        self.batch_size_histogram[bucket] += 1
+        for _, _, enqueued_at in items:
+            wait_time = now - enqueued_at
+            self.wait_time_total += wait_time
+            self.wait_time_max = max(self.wait_time_max, wait_time)
 
-        x_cntr_list = []
-        target_contours = []
-        img_res = []
-        for cntr in cntrs:
-            # detects contour in binary image and returns the coordinates of rectangle enclosing it
-            intX, intY, intWidth, intHeight = cv2.boundingRect(cntr)
+    def stats(self) -> dict:
+        return {
+            "queue_depth": self.queue.qsize() if self.queue is not None else 0,
+            "batches": self.batches,
+            "requests": self.requests,
+            "characters": self.items,
+            "batch_size_histogram": {
+                str(bucket): count
+                for bucket, count in self.batch_size_histogram.items()
+            },
+            "wait_time_avg_ms": (
+                1000 * self.wait_time_total / self.requests if self.requests else 0.0
+            ),
+            "wait_time_max_ms": 1000 * self.wait_time_max,
+        }
 
-            # checking the dimensions of the contour to filter out the characters by contour's size
-            if (
-                intWidth > lower_width
-                and intWidth < upper_width
-                and intHeight > lower_height
-                and intHeight < upper_height
-            ):
-                x_cntr_list.append(
-                    intX
-                )  # stores the x coordinate of the character's contour, to used later for indexing the contours
 
-                char_copy = np.zeros((44, 24))
-                # extracting each character using the enclosing rectangle's coordinates.
-                char = img[intY : intY + intHeight, intX : intX + intWidth]
-                char = cv2.resize(char, (20, 40))
+batcher = InferenceBatcher(
+    lambda batch: registry.backend.predict(batch),
+    executors.run_cpu,
+    BATCH_WINDOW_MS,
+    BATCH_MAX_SIZE,
+)
 
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Loads the models in the background, so the readiness probe can report
+    the progress while the worker is still cold.
+
+    """
+    executors.start()
+    loading = asyncio.create_task(executors.run_cpu(registry.load))
+    batcher.start()
+    cache.start()
+    yield
+    await cache.stop()
+    await batcher.stop()
+    await loading
+    # A spawned worker exits without the exit hook of concurrent.futures and
+    # the multiprocessing one closes the queues before the OCR processes are
+    # told to stop, so they are joined here
+    executors.shutdown(wait=True)
+
+
+app = FastAPI(lifespan=lifespan)
+
+
+RECOGNITION_ENDPOINTS = ("/process_image", "/process_images")
+
+
+@app.middleware("http")
+async def observe_requests(request: Request, call_next: callable):
+    """
+    Measures the duration of the recognition requests.
+
+    """
+    endpoint = request.url.path
+    if endpoint not in RECOGNITION_ENDPOINTS:
+        return await call_next(request)
+    start = perf_counter()
+    response = await call_next(request)
+    REQUEST_SECONDS.observe(perf_counter() - start, endpoint=endpoint)
+    REQUESTS.inc(endpoint=endpoint, status=response.status_code)
+    return response
+
+
+@app.get("/ready")
+async def readiness():
+    """Report whether the models are loaded and the worker can take traffic."""
+    if not registry.is_ready:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=registry.error or "Models are loading",
+        )
+    return {"status": "ready"}
+
+
+@app.get("/stats")
+async def read_stats():
+    """Report the state of the batcher, the executors, the strategies and the cache."""
+    return {
+        "batcher": batcher.stats(),
+        "executors": executors.stats(),
+        "strategies": engine.stats(),
+        "cache": cache.stats(),
+        "uploads": uploads.stats(),
+    }
+
+
+class Frame(NamedTuple):
+    """The decoded image prepared for the plate detection"""
+
+    image: np.ndarray
+    gray: np.ndarray
+    scale: float
+    offset: tuple
+
+
+def prepare_frame(img, roi=None):
+    """Crop the region of interest, downscale it to the working size and
+    convert it to grayscale once for both cascades
+
+    :img image: The full resolution image
+    :roi region: The region of interest as fractions (x, y, width, height)
+    """
+    height, width = img.shape[:2]
+    x0, y0 = 0, 0
+    region = img
+    if roi is not None:
+        x0, y0 = int(roi[0] * width), int(roi[1] * height)
+        x1 = min(width, x0 + int(roi[2] * width))
+        y1 = min(height, y0 + int(roi[3] * height))
+        region = img[y0:y1, x0:x1]
+    scale = min(1.0, WORKING_SIZE / max(region.shape[:2]))
+    if scale < 1.0:
+        region = cv2.resize(
+            region, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA
+        )
+    gray = cv2.cvtColor(region, cv2.COLOR_BGR2GRAY)
+    return Frame(img, gray, scale, (x0, y0))
+
+
+metrics.register(
+    Gauge(
+        "recognition_requests_in_flight",
+        "Number of the admitted recognition requests",
+        function=lambda: executors.pending,
+    )
+)
+metrics.register(
+    MetricCounter(
+        "recognition_requests_rejected_total",
+        "Number of the requests rejected because the service was saturated",
+        function=lambda: executors.rejected,
+    )
+)
+metrics.register(
+    Gauge(
+        "recognition_batcher_queue_depth",
+        "Number of the requests waiting for the character classification",
+        function=lambda: batcher.queue.qsize() if batcher.queue is not None else 0,
+    )
+)
+metrics.register(
+    MetricCounter(
+        "recognition_batcher_batches_total",
+        "Number of the model calls of the batcher",
+        function=lambda: batcher.batches,
+    )
+)
+metrics.register(
+    MetricCounter(
+        "recognition_batcher_characters_total",
+        "Number of the characters classified by the batcher",
+        function=lambda: batcher.items,
+    )
+)
+metrics.register(
+    MetricCounter(
+        "recognition_cache_lookups_total",
+        "Number of the cache lookups by the result",
+        ["result"],
+        function=lambda: {
+            ("hit",): cache.hits,
+            ("redis_hit",): cache.redis_hits,
+            ("miss",): cache.misses,
+        },
+    )
+)
+metrics.register(
+    MetricCounter(
+        "recognition_strategy_runs_total",
+        "Number of the strategy runs",
+        ["strategy"],
+        function=lambda: {
+            (name,): counters["runs"] for name, counters in engine.counters.items()
+        },
+    )
+)
+metrics.register(
+    MetricCounter(
+        "recognition_strategy_cancelled_total",
+        "Number of the strategy runs cancelled by a faster strategy",
+        ["strategy"],
+        function=lambda: {
+            (name,): counters["cancelled"] for name, counters in engine.counters.items()
+        },
+    )
+)
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def read_metrics():
+    """Expose the metrics in the Prometheus text format."""
+    return PlainTextResponse(
+        metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8"
+    )
+
+
+def detect_plate(frame, plate_cascade, mod=1):
+    """The function detects the number plate.
+
+    The plate is detected on the working frame, and the detected rectangle is
+    mapped back to crop the plate from the full resolution image.
+
+    :frame frame: The prepared frame
+    :plate_cascade cascade: The cascade classifier of the model
+    :mod mode: The model mode
+    """
+    plate_rect = plate_cascade.detectMultiScale(
+        frame.gray, scaleFactor=1.2, minNeighbors=7
+    )
+    roi = frame.image
+    plate = None
+    for rect in plate_rect:
+        x, y, w, h = (int(round(value / frame.scale)) for value in rect)
+        x, y = x + frame.offset[0], y + frame.offset[1]
+        plate = (
+            roi[y : y + h, x : x + w, :]
+            if mod == 1
+            else roi[y + 10 : y + 10 + h - 20, x + 5 : x + 5 + w - 10, :]
+        )
+
+    if plate is None or plate.size == 0:
+        return None
+    else:
+        return plate
+
+
+def find_contours(dimensions, img):
+    """Find all contours in the image
+
+    :dimensions dimensions: Dimensions
+    :img image: The plate image
+    """
+
+    # Find all contours in the image
+    cntrs, _ = cv2.findContours(img, cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE)
+
+    # Retrieve potential dimensions
+    lower_width = dimensions[0]
+    upper_width = dimensions[1]
+    lower_height = dimensions[2]
+    upper_height = dimensions[3]
+
+    # Check largest 5 or  15 contours for license plate or character respectively
+    cntrs = sorted(cntrs, key=cv2.contourArea, reverse=True)[:15]
+
+    ii = cv2.cvtColor(img, cv2.COLOR_GRAY2BGR) if DEBUG_DRAW else None
+
+    x_cntr_list = []
+    target_contours = []
+    img_res = []
+    for cntr in cntrs:
+        # detects contour in binary image and returns the coordinates of rectangle enclosing it
+        intX, intY, intWidth, intHeight = cv2.boundingRect(cntr)
+
+        # checking the dimensions of the contour to filter out the characters by contour's size
+        if (
+            intWidth > lower_width
+            and intWidth < upper_width
+            and intHeight > lower_height
+            and intHeight < upper_height
+        ):
+            x_cntr_list.append(
+                intX
+            )  # stores the x coordinate of the character's contour, to used later for indexing the contours
+
+            char_copy = np.zeros((44, 24))
+            # extracting each character using the enclosing rectangle's coordinates.
+            char = img[intY : intY + intHeight, intX : intX + intWidth]
+            char = cv2.resize(char, (20, 40))
+
+            if ii is not None:
                 cv2.rectangle(
                     ii,
                     (intX, intY),
@@ -113,136 +817,904 @@ async def upload_image(img_file: UploadFile = File(...)):
                     2,
                 )
 
-                # Make result formatted for classification: invert colors
-                char = cv2.subtract(255, char)
-
-                # Resize the image to 24x44 with black border
-                char_copy[2:42, 2:22] = char
-                char_copy[0:2, :] = 0
-                char_copy[:, 0:2] = 0
-                char_copy[42:44, :] = 0
-                char_copy[:, 22:24] = 0
-
-                img_res.append(
-                    char_copy
-                )  # List that stores the character's binary image (unsorted)
-
-        # arbitrary function that stores sorted list of character indeces
-        indices = sorted(range(len(x_cntr_list)), key=lambda k: x_cntr_list[k])
-        img_res_copy = []
-        for idx in indices:
-            img_res_copy.append(
-                img_res[idx]
-            )  # stores character images according to their index
-        img_res = np.array(img_res_copy)
-
-        return img_res
-
-    # Find characters in the resulting images
-    def segment_characters(image):
-        """Segment characters
-
-        :image image: The plate image
-        """
-        if image is None:
-            return None
-        # Preprocess cropped license plate image
-        img_lp = cv2.resize(image, (333, 75))
-        img_gray_lp = cv2.cvtColor(img_lp, cv2.COLOR_BGR2GRAY)
-        _, img_binary_lp = cv2.threshold(
-            img_gray_lp, 200, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU
-        )
-        img_binary_lp = cv2.erode(img_binary_lp, (3, 3))
-        img_binary_lp = cv2.dilate(img_binary_lp, (3, 3))
+            # Make result formatted for classification: invert colors
+            char = cv2.subtract(255, char)
+
+            # Resize the image to 24x44 with black border
+            char_copy[2:42, 2:22] = char
+            char_copy[0:2, :] = 0
+            char_copy[:, 0:2] = 0
+            char_copy[42:44, :] = 0
+            char_copy[:, 22:24] = 0
+
+            img_res.append(
+                char_copy
+            )  # List that stores the character's binary image (unsorted)
+
+    # arbitrary function that stores sorted list of character indeces
+    indices = sorted(range(len(x_cntr_list)), key=lambda k: x_cntr_list[k])
+    img_res_copy = []
+    for idx in indices:
+        img_res_copy.append(
+            img_res[idx]
+        )  # stores character images according to their index
+    img_res = np.array(img_res_copy)
+
+    if ii is not None:
+        DEBUG_DIR.mkdir(parents=True, exist_ok=True)
+        cv2.imwrite(str(DEBUG_DIR / f"contour_{uuid.uuid4().hex}.png"), ii)
 
-        LP_WIDTH = img_binary_lp.shape[0]
-        LP_HEIGHT = img_binary_lp.shape[1]
+    return img_res
 
-        # Make borders white
-        img_binary_lp[0:3, :] = 255
-        img_binary_lp[:, 0:3] = 255
-        img_binary_lp[72:75, :] = 255
-        img_binary_lp[:, 330:333] = 255
 
-        # Estimations of character contours sizes of cropped license plates
-        dimensions = [LP_WIDTH / 6, LP_WIDTH / 2, LP_HEIGHT / 10, 2 * LP_HEIGHT / 3]
+# Find characters in the resulting images
+def segment_characters(image):
+    """Segment characters
 
-        cv2.imwrite("contour.png", img_binary_lp)
+    Returns the binarized plate together with the characters, so the OCR
+    fallback can reuse it without touching the disk.
 
-        # Get contours within cropped license plate
+    :image image: The plate image
+    """
+    if image is None:
+        return None, None
+    # Preprocess cropped license plate image
+    img_lp = cv2.resize(image, (333, 75))
+    img_gray_lp = cv2.cvtColor(img_lp, cv2.COLOR_BGR2GRAY)
+    _, img_binary_lp = cv2.threshold(
+        img_gray_lp, 200, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU
+    )
+    img_binary_lp = cv2.erode(img_binary_lp, (3, 3))
+    img_binary_lp = cv2.dilate(img_binary_lp, (3, 3))
+
+    LP_WIDTH = img_binary_lp.shape[0]
+    LP_HEIGHT = img_binary_lp.shape[1]
+
+    # Make borders white
+    img_binary_lp[0:3, :] = 255
+    img_binary_lp[:, 0:3] = 255
+    img_binary_lp[72:75, :] = 255
+    img_binary_lp[:, 330:333] = 255
+
+    # Estimations of character contours sizes of cropped license plates
+    dimensions = [LP_WIDTH / 6, LP_WIDTH / 2, LP_HEIGHT / 10, 2 * LP_HEIGHT / 3]
+
+    # Get contours within cropped license plate
+    with timed_stage("find_contours"):
         char_list = find_contours(dimensions, img_binary_lp)
 
-        return char_list
+    return img_binary_lp, char_list
+
+
+CHARACTERS = np.array(list("0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ"))
+
+
+class Reading(NamedTuple):
+    """The plate number read by a strategy and the confidence of the reading"""
+
+    text: str
+    confidence: float
+
+
+# Predicting the output
+def prepare_characters(char):
+    """Stack the segmented characters into one (N, 28, 28, 3) batch
+
+    :char characters: The segmented characters
+    """
+    batch = np.empty((len(char), 28, 28, 3), dtype=np.float32)
+    for i, ch in enumerate(char):
+        # broadcast to the three channels while writing into the batch
+        batch[i] = cv2.resize(ch, (28, 28), interpolation=cv2.INTER_AREA)[
+            ..., np.newaxis
+        ]
+    return batch
+
+
+def decode_predictions(y_prob):
+    """Decode the class probabilities of the characters into the plate number
+
+    The confidence is the mean probability of the predicted classes.
+
+    :y_prob probabilities: The model output of shape (N, len(CHARACTERS))
+    """
+    if len(y_prob) == 0:
+        return Reading("", 0.0)
+    return Reading(
+        "".join(CHARACTERS[np.argmax(y_prob, axis=1)]),
+        float(np.mean(np.max(y_prob, axis=1))),
+    )
 
-    # segmented characters
-    char = segment_characters(plate)
 
-    # download the model architecture from JSON and weights
-    with open("model.json", "r") as json_file:
-        loaded_model_json = json_file.read()
-    model = model_from_json(loaded_model_json)
-    model.load_weights("model.weights.h5")
+async def show_results(chars):
+    """Classify the characters of several plates
 
-    # Predicting the output
-    def fix_dimension(img):
-        new_img = np.zeros((28, 28, 3))
-        for i in range(3):
-            new_img[:, :, i] = img
-        return new_img
+    The characters of all the plates are classified in one batch, which is
+    shared with the concurrent requests as well.
 
-    def show_results():
-        dic = {}
-        characters = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ"
-        for i, c in enumerate(characters):
-            dic[i] = c
+    :chars characters: The segmented characters of every plate (or None)
+    """
+    sizes = [0 if char is None else len(char) for char in chars]
+    if sum(sizes) == 0:
+        return [None if char is None else Reading("", 0.0) for char in chars]
 
+    with timed_stage("classify"):
+        y_prob = await batcher.classify(
+            prepare_characters(
+                [ch for char in chars if char is not None for ch in char]
+            )
+        )
+
+    results = []
+    offset = 0
+    for char, size in zip(chars, sizes):
         if char is None:
+            results.append(None)
+            continue
+        results.append(decode_predictions(y_prob[offset : offset + size]))
+        offset += size
+    return results
+
+
+def text_ocr(image):
+    data = pytesseract.image_to_data(image, output_type=pytesseract.Output.DICT)
+    words = [
+        (text, float(conf))
+        for text, conf in zip(data["text"], data["conf"])
+        if float(conf) >= 0 and text.strip()
+    ]
+    result = "".join(text for text, _ in words)
+    result = re.sub(r"[^a-zA-Z0-9]", "", result)
+    confidence = sum(conf for _, conf in words) / len(words) / 100 if words else 0.0
+    return Reading(result, confidence)
+
+
+class UploadBuffers:
+    """Reusable buffers the uploads are read into.
+
+    A buffer is kept for the next request after the upload is decoded, so the
+    uploads are not allocated as new bytes objects on every request. An upload
+    takes the smallest free buffer it fits in, and a new one is allocated only
+    when none does. The pool keeps at most max_buffers buffers and max_bytes
+    bytes, and no buffer above max_buffer_size, so its memory stays bounded
+    whatever the uploads were.
+    """
+
+    def __init__(self, max_buffers: int, max_bytes: int, max_buffer_size: int):
+        self.max_buffers = max_buffers
+        self.max_bytes = max_bytes
+        self.max_buffer_size = max_buffer_size
+        # sorted by the size, for the best fit
+        self.free = []
+        self.free_bytes = 0
+        self.allocations = 0
+        self.reuses = 0
+        self.discards = 0
+
+    @contextmanager
+    def buffer(self, size: int):
+        """A buffer of the size, returned to the pool on exit"""
+        index = bisect_left(self.free, size, key=len)
+        if index < len(self.free):
+            buffer = self.free.pop(index)
+            self.free_bytes -= len(buffer)
+            self.reuses += 1
+        else:
+            buffer = bytearray(size)
+            self.allocations += 1
+        try:
+            yield memoryview(buffer)[:size]
+        finally:
+            self._release(buffer)
+
+    def _release(self, buffer):
+        if (
+            len(buffer) > self.max_buffer_size
+            or len(self.free) >= self.max_buffers
+            or self.free_bytes + len(buffer) > self.max_bytes
+        ):
+            self.discards += 1
+            return
+        insort(self.free, buffer, key=len)
+        self.free_bytes += len(buffer)
+
+    def stats(self) -> dict:
+        return {
+            "free": len(self.free),
+            "free_bytes": self.free_bytes,
+            "allocations": self.allocations,
+            "reuses": self.reuses,
+            "discards": self.discards,
+        }
+
+
+uploads = UploadBuffers(
+    MAX_PENDING_REQUESTS, UPLOAD_POOL_BYTES, UPLOAD_POOL_BUFFER_SIZE
+)
+
+
+def upload_size(img_file: UploadFile) -> int:
+    """The size of the upload, rejecting the ones above MAX_UPLOAD_SIZE"""
+    size = img_file.file.seek(0, os.SEEK_END)
+    img_file.file.seek(0)
+    if size > MAX_UPLOAD_SIZE:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"No more than {MAX_UPLOAD_SIZE} bytes are allowed",
+        )
+    return size
+
+
+def read_upload(file, buffer):
+    """Read the spooled upload into the buffer
+
+    :file file: The spooled file of the upload
+    :buffer buffer: The memoryview of the size of the upload
+    """
+    read = 0
+    while read < len(buffer):
+        chunk = file.readinto(buffer[read:])
+        if not chunk:
+            break
+        read += chunk
+    return read
+
+
+def image_size(data):
+    """Read (width, height) from the JPEG or PNG header without decoding
+
+    :data bytes: The encoded image
+    """
+    if data[:8] == b"\x89PNG\r\n\x1a\n":
+        return int.from_bytes(data[16:20], "big"), int.from_bytes(data[20:24], "big")
+    if data[:2] != b"\xff\xd8":
+        return None
+    i = 2
+    while i + 9 < len(data):
+        if data[i] != 0xFF:
             return None
+        marker = data[i + 1]
+        if marker == 0xFF:
+            i += 1
+            continue
+        # the start of frame markers, except DHT, JPG and DAC
+        if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+            height = int.from_bytes(data[i + 5 : i + 7], "big")
+            width = int.from_bytes(data[i + 7 : i + 9], "big")
+            return width, height
+        i += 2 + int.from_bytes(data[i + 2 : i + 4], "big")
+    return None
 
-        output = []
-        for i, ch in enumerate(char):  # iterating over the characters
-            img_ = cv2.resize(ch, (28, 28), interpolation=cv2.INTER_AREA)
-            img = fix_dimension(img_)
-            img = img.reshape(1, 28, 28, 3)  # preparing image for the model
-            y_prob = model.predict(img)[0]  # predicting the class
-            y_class = np.argmax(y_prob)
-            character = dic[y_class]  #
-            output.append(character)  # storing the result in a list
 
-        plate_number = "".join(output)
+REDUCED_DECODES = (
+    (8, cv2.IMREAD_REDUCED_COLOR_8),
+    (4, cv2.IMREAD_REDUCED_COLOR_4),
+    (2, cv2.IMREAD_REDUCED_COLOR_2),
+)
 
-        return plate_number
 
-    license_plate_number = show_results()
+def decode_flags(data):
+    """The largest reduction of the image keeping DECODE_SIZE pixels
 
-    def text_ocr(image):
-        result = pytesseract.image_to_string(image)
-        result = result.strip()
-        result = re.sub(r"[^a-zA-Z0-9]", "", result)
-        return result
+    The JPEG decoder scales the image while decoding, so the full size image
+    is never allocated.
 
-    if license_plate_number is not None and len(license_plate_number) > 3:
-        print(f"License plate number (model 1): {license_plate_number}")
-        return {"result": license_plate_number}
-
-    plate = detect_plate(img_in, mod=2)
-
-    if plate is not None:
-        char = segment_characters(plate)
-        result = show_results()
-        if result is not None and len(result) > 3:
-            print(f"License plate number (model 2): {result}")
-            return {"result": result}
-
-    if os.path.exists(file_path):
-        image = cv2.imread("contour.png")
-        result = text_ocr(image)
-        print(f"License plate number (no_mod): {result}")
-        os.remove(file_path)
-        return {"result": result}
-    else:
-        return {"result": ""}
+    :data bytes: The encoded image
+    """
+    size = image_size(data) if DECODE_SIZE else None
+    if size is not None:
+        for factor, flags in REDUCED_DECODES:
+            if max(size) // factor >= DECODE_SIZE:
+                return flags
+    return cv2.IMREAD_COLOR
+
+
+def decode_frames(images_bytes, roi=None):
+    """Decode the uploaded images and prepare them for the detection
+
+    :images_bytes bytes: The raw bytes of the uploads (any bytes-like object)
+    :roi region: The region of interest of the camera
+    """
+    frames = []
+    for img_bytes in images_bytes:
+        with timed_stage("decode"):
+            img = cv2.imdecode(
+                np.frombuffer(img_bytes, np.uint8), decode_flags(img_bytes)
+            )
+            frames.append(None if img is None else prepare_frame(img, roi))
+    return frames
+
+
+def detect_and_segment(frames, mod=1):
+    """Detect the plates with the cascade of the model and segment their characters
+
+    :frames frames: The prepared frames (None for the undecodable images)
+    :mod mode: The model mode
+    """
+    results = []
+    for frame in frames:
+        if frame is None:
+            results.append((None, None))
+            continue
+        with timed_stage("detect"):
+            plate = detect_plate(frame, registry.cascades[mod], mod)
+        with timed_stage("segment"):
+            results.append(segment_characters(plate))
+    return results
+
+
+class Segmentations:
+    """Detection and segmentation results of the frames of one call.
+
+    Every (model, frame) pair is processed once, whatever strategy asks for it
+    first, and the others reuse the result.
+    """
+
+    def __init__(self, frames):
+        self.frames = frames
+        self.tasks = {}
+
+    async def get(self, mod, frames):
+        uncovered = [i for i in frames if (mod, i) not in self.tasks]
+        if uncovered:
+            task = asyncio.ensure_future(
+                executors.run_cpu(
+                    detect_and_segment, [self.frames[i] for i in uncovered], mod=mod
+                )
+            )
+            for position, i in enumerate(uncovered):
+                self.tasks[(mod, i)] = (task, position)
+        results = {}
+        for i in frames:
+            task, position = self.tasks[(mod, i)]
+            # the task is shared, so a cancelled strategy must not cancel it
+            results[i] = (await asyncio.shield(task))[position]
+        return results
+
+    def cancel(self):
+        for task, _ in self.tasks.values():
+            task.cancel()
+
+
+class StrategyEngine:
+    """Combines the recognition strategies: cascade model 1, cascade model 2
+    and the Tesseract OCR of the binarized plate.
+
+    In the "sequential" mode the strategies are tried one after another for the
+    frames without a confident reading yet. In the "race" mode they run
+    concurrently, the first confident reading of every frame wins and the
+    strategies still running are cancelled. When no strategy is confident, the
+    OCR reading is the answer, as it is the last resort in both modes.
+    """
+
+    STRATEGIES = ("model_1", "model_2", "ocr")
+    LABELS = {"model_1": "model 1", "model_2": "model 2", "ocr": "no_mod"}
+
+    def __init__(self, mode: str, min_confidence: float):
+        if mode not in ("sequential", "race"):
+            raise ValueError(f"Unknown strategy mode: {mode}")
+        self.mode = mode
+        self.min_confidence = min_confidence
+        self.counters = {
+            name: {
+                "runs": 0,
+                "frames": 0,
+                "wins": 0,
+                "cancelled": 0,
+                "errors": 0,
+                "latency_total": 0.0,
+            }
+            for name in self.STRATEGIES
+        }
+
+    def is_confident(self, reading):
+        return (
+            reading is not None
+            and len(reading.text) > 3
+            and reading.confidence >= self.min_confidence
+        )
+
+    async def recognize(self, images):
+        segmentations = Segmentations(images)
+        frames = list(range(len(images)))
+        try:
+            if self.mode == "race":
+                results = await self._race(segmentations, frames)
+            else:
+                results = await self._sequential(segmentations, frames)
+        finally:
+            segmentations.cancel()
+        plates = []
+        for i in frames:
+            text, name = results[i]
+            RESULTS.inc(strategy=name or "none")
+            if name is not None:
+                self.counters[name]["wins"] += 1
+                print(f"License plate number ({self.LABELS[name]}): {text}")
+            plates.append(text)
+        return plates
+
+    async def _sequential(self, segmentations, frames):
+        results = {}
+        pending = frames
+        for name in self.STRATEGIES:
+            readings = await self._run(name, segmentations, pending)
+            for i in pending:
+                reading = readings.get(i)
+                if self.is_confident(reading) or (name == "ocr" and reading):
+                    results[i] = (reading.text, name)
+            pending = [i for i in pending if i not in results]
+            if not pending:
+                break
+        for i in pending:
+            results[i] = ("", None)
+        return results
+
+    async def _race(self, segmentations, frames):
+        results = {}
+        ocr_readings = {}
+        tasks = {
+            asyncio.ensure_future(self._run(name, segmentations, frames)): name
+            for name in self.STRATEGIES
+        }
+        pending = set(tasks)
+        try:
+            while pending and len(results) < len(frames):
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in sorted(done, key=lambda t: self.STRATEGIES.index(tasks[t])):
+                    name = tasks[task]
+                    readings = task.result()
+                    if name == "ocr":
+                        ocr_readings = readings
+                    for i, reading in readings.items():
+                        if i not in results and self.is_confident(reading):
+                            results[i] = (reading.text, name)
+        finally:
+            for task in pending:
+                task.cancel()
+                self.counters[tasks[task]]["cancelled"] += 1
+        for i in frames:
+            if i not in results:
+                reading = ocr_readings.get(i)
+                results[i] = (reading.text, "ocr") if reading else ("", None)
+        return results
+
+    async def _run(self, name, segmentations, frames):
+        """Run the strategy for the frames and return the readings by frame."""
+        counters = self.counters[name]
+        counters["runs"] += 1
+        counters["frames"] += len(frames)
+        start = perf_counter()
+        try:
+            if name == "ocr":
+                return await self._ocr(segmentations, frames)
+            return await self._classify(segmentations, frames, int(name[-1]))
+        except asyncio.CancelledError:
+            raise
+        except Exception as error_message:
+            counters["errors"] += 1
+            print(f"Strategy {name} error: {str(error_message)}")
+            return {}
+        finally:
+            counters["latency_total"] += perf_counter() - start
+
+    async def _classify(self, segmentations, frames, mod):
+        segmented = await segmentations.get(mod, frames)
+        readings = await show_results([segmented[i][1] for i in frames])
+        return dict(zip(frames, readings))
+
+    async def _ocr(self, segmentations, frames):
+        # the plate binarized for model 2 is preferred, like in the
+        # sequential flow where it is the latest one
+        binary_plates = {
+            i: binary_plate
+            for i, (binary_plate, _) in (await segmentations.get(2, frames)).items()
+            if binary_plate is not None
+        }
+        missing = [i for i in frames if i not in binary_plates]
+        if missing:
+            binary_plates.update(
+                (i, binary_plate)
+                for i, (binary_plate, _) in (
+                    await segmentations.get(1, missing)
+                ).items()
+                if binary_plate is not None
+            )
+        ocr_frames = list(binary_plates)
+        if not ocr_frames:
+            return {}
+        with timed_stage("ocr"):
+            readings = await asyncio.gather(
+                *(executors.run_ocr(text_ocr, binary_plates[i]) for i in ocr_frames)
+            )
+        return dict(zip(ocr_frames, readings))
+
+    def stats(self) -> dict:
+        return {
+            "mode": self.mode,
+            "strategies": {
+                name: {
+                    "runs": counters["runs"],
+                    "frames": counters["frames"],
+                    "wins": counters["wins"],
+                    "hit_rate": (
+                        counters["wins"] / counters["frames"]
+                        if counters["frames"]
+                        else 0.0
+                    ),
+                    "cancelled": counters["cancelled"],
+                    "errors": counters["errors"],
+                    "latency_avg_ms": (
+                        1000 * counters["latency_total"] / counters["runs"]
+                        if counters["runs"]
+                        else 0.0
+                    ),
+                }
+                for name, counters in self.counters.items()
+            },
+        }
+
+
+engine = StrategyEngine(STRATEGY_MODE, MIN_CONFIDENCE)
+
+
+async def recognize_plates(frames):
+    """Recognize the plate numbers on the frames
+
+    Every stage runs once for all the frames, so detection, segmentation and
+    classification are batched across them.
+
+    :frames frames: The prepared frames
+    """
+    return await engine.recognize(frames)
+
+
+def vote_plate(plates):
+    """Pick the consensus plate number by majority vote over the characters
+
+    Only the readings of the most common length take part in the vote.
+
+    :plates plates: The plate numbers recognized on the frames
+    """
+    plates = [plate for plate in plates if plate]
+    if not plates:
+        return ""
+    length, _ = Counter(len(plate) for plate in plates).most_common(1)[0]
+    plates = [plate for plate in plates if len(plate) == length]
+    return "".join(Counter(chars).most_common(1)[0][0] for chars in zip(*plates))
+
+
+def camera_roi(camera_id):
+    if camera_id is None:
+        return None
+    return CAMERA_ROIS.get(camera_id)
+
+
+def check_ready():
+    if not registry.is_ready:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Models are not loaded yet",
+        )
+
+
+@app.post("/process_image")
+async def upload_image(
+    img_file: UploadFile = File(...), camera_id: str | None = Form(None)
+):
+    check_ready()
+    roi = camera_roi(camera_id)
+    # the region of interest changes the result, so it is a part of the key
+    key_prefix = f"{camera_id}:" if roi is not None else ""
+
+    async with executors.admit():
+        size = upload_size(img_file)
+        # the buffer is only held until the upload is decoded
+        with uploads.buffer(size) as img_bytes:
+            await executors.run_cpu(read_upload, img_file.file, img_bytes)
+            key = None
+            if cache.mode == "exact":
+                key = key_prefix + cache.exact_key(img_bytes)
+                result = await cache.get(key)
+                if result is not None:
+                    return {"result": result}
+
+            frames = await executors.run_cpu(decode_frames, [img_bytes], roi)
+
+        results = await recognize_plates(frames)
+        # the unreadable images are not cached, they might be a transient failure
+        if key is not None and results[0]:
+            await cache.set(key, results[0])
+        return {"result": results[0]}
+
+
+@app.post("/process_images")
+async def upload_images(
+    img_files: List[UploadFile] = File(...), camera_id: str | None = Form(None)
+):
+    """Recognize the plate on several frames of the same car
+
+    Returns the result of every frame and the consensus plate number.
+    """
+    check_ready()
+    if len(img_files) > MAX_FRAMES:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"No more than {MAX_FRAMES} images are allowed",
+        )
+
+    async with executors.admit():
+        frames = []
+        for img_file in img_files:
+            with uploads.buffer(upload_size(img_file)) as img_bytes:
+                await executors.run_cpu(read_upload, img_file.file, img_bytes)
+                frames += await executors.run_cpu(
+                    decode_frames, [img_bytes], camera_roi(camera_id)
+                )
+        results = await recognize_plates(frames)
+        return {
+            "results": [{"result": result} for result in results],
+            "result": vote_plate(results),
+        }
+
+
+class StreamGate:
+    """Cheap checks deciding whether a frame of the stream is worth the full
+    recognition: the motion since the previous frame and the plate presence.
+    """
+
+    # The change of the brightness that counts as a moved pixel
+    PIXEL_DELTA = 25
+
+    def __init__(self, motion_size: int, motion_threshold: float, gate_size: int):
+        self.motion_size = motion_size
+        self.motion_threshold = motion_threshold
+        self.gate_size = gate_size
+        self.previous = None
+
+    def moved(self, frame) -> bool:
+        thumbnail = cv2.resize(
+            frame.gray,
+            (self.motion_size, self.motion_size),
+            interpolation=cv2.INTER_AREA,
+        )
+        previous, self.previous = self.previous, thumbnail
+        if previous is None:
+            return True
+        changed = cv2.absdiff(thumbnail, previous) > self.PIXEL_DELTA
+        return changed.mean() > self.motion_threshold
+
+    def has_plate(self, frame) -> bool:
+        gray = frame.gray
+        scale = min(1.0, self.gate_size / max(gray.shape))
+        if scale < 1.0:
+            gray = cv2.resize(
+                gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA
+            )
+        return any(
+            len(
+                registry.cascades[mod].detectMultiScale(
+                    gray, scaleFactor=1.2, minNeighbors=7
+                )
+            )
+            for mod in (1, 2)
+        )
+
+
+def gate_frame(gate, img_bytes, roi, tracking):
+    """Decode the frame of the stream and check it against the gates
+
+    Returns the prepared frame, or None and the reason it was skipped.
+
+    :gate gate: The gate of the stream
+    :img_bytes bytes: The encoded frame
+    :roi region: The region of interest of the camera
+    :tracking tracking: Whether a reading is waiting for its confirmation, so
+        a still frame is recognized too
+    """
+    frame = decode_frames([img_bytes], roi)[0]
+    if frame is None:
+        return None, "undecodable"
+    with timed_stage("gate"):
+        if not gate.moved(frame) and not tracking:
+            return None, "still"
+        if not gate.has_plate(frame):
+            return None, "no_plate"
+    return frame, None
+
+
+class PlateTracker:
+    """Confirms the plate readings of a stream.
+
+    A plate is confirmed once it is read the same on the last stable_frames
+    recognized frames, and it is not confirmed again until reset_frames frames
+    without a plate pass, so a car standing at the gate is reported once.
+    """
+
+    def __init__(self, stable_frames: int, reset_frames: int):
+        self.readings = deque(maxlen=stable_frames)
+        self.reset_frames = reset_frames
+        self.confirmed = None
+        self.empty_frames = 0
+
+    @property
+    def tracking(self) -> bool:
+        return bool(self.readings) and self.readings[-1] != self.confirmed
+
+    def no_plate(self):
+        self.empty_frames += 1
+        if self.empty_frames >= self.reset_frames:
+            self.readings.clear()
+            self.confirmed = None
+
+    def update(self, plate: str):
+        """Add the reading of the frame and return the plate once it is confirmed"""
+        self.empty_frames = 0
+        if not plate:
+            return None
+        self.readings.append(plate)
+        if (
+            len(self.readings) == self.readings.maxlen
+            and len(set(self.readings)) == 1
+            and plate != self.confirmed
+        ):
+            self.confirmed = plate
+            return plate
+        return None
+
+
+@app.websocket("/stream")
+async def stream_frames(websocket: WebSocket, camera_id: str | None = None):
+    """Recognize the plates on the frames of a camera feed
+
+    Every binary message is an encoded frame. Only the frames passing the
+    motion and the plate presence gates are recognized, and the event
+    {"event": "plate", "plate": ..., "frame": ...} is sent once the reading is
+    stable. While a frame is processed only the latest of the arriving frames
+    is kept, so a slow pipeline skips frames instead of lagging behind the feed.
+    """
+    await websocket.accept()
+    if not registry.is_ready:
+        await websocket.close(
+            code=status.WS_1013_TRY_AGAIN_LATER, reason="Models are not loaded yet"
+        )
+        return
+
+    roi = camera_roi(camera_id)
+    gate = StreamGate(STREAM_MOTION_SIZE, STREAM_MOTION_THRESHOLD, STREAM_GATE_SIZE)
+    tracker = PlateTracker(STREAM_STABLE_FRAMES, STREAM_RESET_FRAMES)
+    latest = asyncio.Queue(maxsize=1)
+
+    async def receive():
+        index = 0
+        try:
+            while True:
+                message = await websocket.receive()
+                if message["type"] == "websocket.disconnect":
+                    break
+                img_bytes = message.get("bytes")
+                if img_bytes is None:
+                    # a text message is not a frame
+                    STREAM_FRAMES.inc(result="not_binary")
+                    continue
+                if latest.full():
+                    latest.get_nowait()
+                    STREAM_FRAMES.inc(result="dropped")
+                latest.put_nowait((index, img_bytes))
+                index += 1
+        except (WebSocketDisconnect, RuntimeError) as error_message:
+            print(f"Stream error: {str(error_message)}")
+        # the frame still waiting is processed before the stream ends. A
+        # cancelled receiver skips it: the processing is gone and nothing
+        # would read the queue, so the put would wait forever
+        await latest.put(None)
+
+    STREAMS_OPEN.inc()
+    receiver = asyncio.create_task(receive())
+    try:
+        while (item := await latest.get()) is not None:
+            index, img_bytes = item
+            frame, skipped = await executors.run_cpu(
+                gate_frame, gate, img_bytes, roi, tracker.tracking
+            )
+            if frame is None:
+                STREAM_FRAMES.inc(result=skipped)
+                if skipped == "no_plate":
+                    tracker.no_plate()
+                continue
+            try:
+                async with executors.admit():
+                    plate = (await recognize_plates([frame]))[0]
+            except HTTPException:
+                STREAM_FRAMES.inc(result="rejected")
+                continue
+            STREAM_FRAMES.inc(result="recognized")
+            if tracker.update(plate):
+                STREAM_EVENTS.inc()
+                await websocket.send_json(
+                    {"event": "plate", "plate": plate, "frame": index}
+                )
+        await receiver
+    finally:
+        receiver.cancel()
+        await asyncio.gather(receiver, return_exceptions=True)
+        STREAMS_OPEN.dec()
+
+
+def worker_cores(index: int, workers: int) -> set:
+    """The cores of the worker: its slice of the cores available to the server
+
+    :index index: The number of the worker
+    :workers workers: The number of the workers
+    """
+    cores = sorted(os.sched_getaffinity(0))
+    share = max(1, len(cores) // workers)
+    start = index * share % len(cores)
+    return set(cores[start : start + share])
+
+
+def run_worker(sock: socket.socket):
+    """Serve the app on the socket shared by the workers"""
+    uvicorn.Server(uvicorn.Config(app, host=HOST, port=PORT)).run(sockets=[sock])
+
+
+def serve():
+    """Run the server in WORKERS processes
+
+    The workers are spawned rather than forked, so none of them inherits the
+    TensorFlow runtime of another, and every worker loads its own inference
+    session. The worker inherits the CPU affinity of the supervisor at the
+    start, so the supervisor pins itself to the cores of the worker before
+    starting it. A worker that dies is restarted on the same cores.
+    """
+    if WORKERS <= 1:
+        uvicorn.run(app, host=HOST, port=PORT)
+        return
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((HOST, PORT))
+    sock.set_inheritable(True)
+    context = multiprocessing.get_context("spawn")
+    cores = os.sched_getaffinity(0)
+    # a worker imports the module already pinned to its slice of the cores,
+    # where dividing them by WORKERS again would shrink its share, so the
+    # share is computed here once and passed down
+    os.environ.setdefault("INTRA_OP_THREADS", str(max(1, len(cores) // WORKERS)))
+    stopping = threading.Event()
+
+    def start_worker(index):
+        if PIN_WORKERS:
+            os.sched_setaffinity(0, worker_cores(index, WORKERS))
+        try:
+            worker = context.Process(
+                target=run_worker, args=(sock,), name=f"recognition-{index}"
+            )
+            worker.start()
+        finally:
+            os.sched_setaffinity(0, cores)
+        print(f"Started worker {index} (pid {worker.pid})")
+        return worker
+
+    def stop(signum, frame):
+        stopping.set()
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+    workers = [start_worker(index) for index in range(WORKERS)]
+    while not stopping.wait(1):
+        for index, worker in enumerate(workers):
+            if not worker.is_alive():
+                print(f"Worker {index} exited with code {worker.exitcode}")
+                workers[index] = start_worker(index)
+    for worker in workers:
+        worker.terminate()
+    for worker in workers:
+        worker.join()
+    sock.close()
 
 
 if __name__ == "__main__":
-    uvicorn.run(app, host="0.0.0.0", port=8001)
+    serve()
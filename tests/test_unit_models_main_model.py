@@ -0,0 +1,101 @@
+import os
+import sys
+import unittest
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, f"{os.path.dirname(SCRIPT_DIR)}/models")
+
+try:
+    import cv2
+    import numpy as np
+
+    import main_model
+except ImportError as error:
+    raise unittest.SkipTest(f"The recognition service is not installed: {error}")
+
+from main_model import RecognitionCache, UploadBuffers
+
+
+IMAGE = sorted(main_model.MODEL_DIR.parent.glob("demo_car_img/*"))[0]
+
+
+def encode(image) -> bytes:
+    return cv2.imencode(".png", image)[1].tobytes()
+
+
+class TestRecognitionCache(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.cache = RecognitionCache("exact", 10, 300)
+        self.image = cv2.imread(str(IMAGE))
+
+    async def test_different_plates_do_not_collide(self):
+        other = self.image.copy()
+        # a different plate on the same frame: a small patch of it changes
+        height, width = other.shape[:2]
+        patch = other[height // 2 : height // 2 + 20, width // 2 : width // 2 + 60]
+        patch[:] = np.random.default_rng(0).integers(0, 256, patch.shape)
+        first = self.cache.exact_key(encode(self.image))
+        second = self.cache.exact_key(encode(other))
+        self.assertNotEqual(first, second)
+        await self.cache.set(first, "AB1234CD")
+        self.assertIsNone(await self.cache.get(second))
+        self.assertEqual(await self.cache.get(first), "AB1234CD")
+
+    async def test_same_image_hits(self):
+        key = self.cache.exact_key(encode(self.image))
+        await self.cache.set(key, "AB1234CD")
+        self.assertEqual(await self.cache.get(key), "AB1234CD")
+        self.assertEqual(self.cache.hits, 1)
+
+    async def test_lru_evicts_oldest(self):
+        cache = RecognitionCache("exact", 2, 300)
+        await cache.set("a", "A")
+        await cache.set("b", "B")
+        await cache.get("a")
+        await cache.set("c", "C")
+        self.assertIsNone(await cache.get("b"))
+        self.assertEqual(await cache.get("a"), "A")
+
+    def test_unknown_mode(self):
+        with self.assertRaises(ValueError):
+            RecognitionCache("perceptual", 10, 300)
+
+
+class TestUploadBuffers(unittest.TestCase):
+    def setUp(self):
+        self.uploads = UploadBuffers(4, 1000, 400)
+
+    def test_reuses_buffer(self):
+        with self.uploads.buffer(100) as buffer:
+            self.assertEqual(len(buffer), 100)
+        with self.uploads.buffer(80) as buffer:
+            self.assertEqual(len(buffer), 80)
+        self.assertEqual(self.uploads.allocations, 1)
+        self.assertEqual(self.uploads.reuses, 1)
+
+    def test_best_fit(self):
+        with self.uploads.buffer(100), self.uploads.buffer(300):
+            pass
+        # the small one was returned last, but the large one is taken
+        with self.uploads.buffer(200) as buffer:
+            self.assertEqual(len(buffer.obj), 300)
+        # and the small one stays in the pool
+        self.assertEqual([len(buffer) for buffer in self.uploads.free], [100, 300])
+
+    def test_large_buffer_is_not_pooled(self):
+        with self.uploads.buffer(500):
+            pass
+        self.assertEqual(self.uploads.free, [])
+        self.assertEqual(self.uploads.discards, 1)
+
+    def test_pooled_bytes_are_capped(self):
+        with self.uploads.buffer(400), self.uploads.buffer(400):
+            with self.uploads.buffer(400), self.uploads.buffer(400):
+                pass
+        self.assertLessEqual(self.uploads.free_bytes, 1000)
+        self.assertEqual(self.uploads.stats()["free"], 2)
+        self.assertEqual(self.uploads.discards, 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -18,6 +18,7 @@ from src.repository.cars import (
     update_car,
     block_or_unblock_car,
     is_car_blocked,
+    resolve_provisional_car,
 )
 
 
@@ -110,3 +111,66 @@ class TestUsers(unittest.IsolatedAsyncioTestCase):
             session=self.session,
         )
         self.assertTrue(result)
+
+    async def test_resolve_provisional_car_with_new_plate(self):
+        provisional_car = Car(id=2, plate="PROV0123456789AB", is_blocked=False)
+        self.session.execute.return_value = MagicMock(spec=ChunkedIteratorResult)
+        self.session.execute.return_value.scalar.side_effect = [provisional_car, None]
+        result = await resolve_provisional_car(
+            provisional_plate=provisional_car.plate,
+            plate="XYZ67890",
+            session=self.session,
+        )
+        self.assertEqual(result, provisional_car)
+        self.assertEqual(result.plate, "XYZ67890")
+        self.session.delete.assert_not_called()
+
+    async def test_resolve_provisional_car_with_known_plate(self):
+        provisional_car = Car(id=2, plate="PROV0123456789AB", is_blocked=False)
+        self.session.execute.return_value = MagicMock(spec=ChunkedIteratorResult)
+        self.session.execute.return_value.scalar.side_effect = [
+            provisional_car,
+            self.car,
+            None,
+        ]
+        result = await resolve_provisional_car(
+            provisional_plate=provisional_car.plate,
+            plate=self.car.plate,
+            session=self.session,
+        )
+        self.assertEqual(result, self.car)
+        self.session.delete.assert_awaited_once_with(provisional_car)
+        # the charges of the ledger and the reservations get the owner
+        ledger, reservations = [
+            str(call.args[0]) for call in self.session.execute.await_args_list[3:]
+        ]
+        self.assertIn("UPDATE financial_transactions SET user_id", ledger)
+        self.assertIn("car_id=:car_id", reservations)
+        self.session.commit.assert_awaited_once()
+
+    async def test_resolve_provisional_car_with_parked_car(self):
+        provisional_car = Car(id=2, plate="PROV0123456789AB", is_blocked=False)
+        self.session.execute.return_value = MagicMock(spec=ChunkedIteratorResult)
+        self.session.execute.return_value.scalar.side_effect = [
+            provisional_car,
+            self.car,
+            10,
+        ]
+        result = await resolve_provisional_car(
+            provisional_plate=provisional_car.plate,
+            plate=self.car.plate,
+            session=self.session,
+        )
+        self.assertIsNone(result)
+        self.session.delete.assert_not_called()
+        self.session.commit.assert_not_called()
+
+    async def test_resolve_provisional_car_not_found(self):
+        self.session.execute.return_value = MagicMock(spec=ChunkedIteratorResult)
+        self.session.execute.return_value.scalar.return_value = None
+        result = await resolve_provisional_car(
+            provisional_plate="PROV0123456789AB",
+            plate=self.car.plate,
+            session=self.session,
+        )
+        self.assertIsNone(result)
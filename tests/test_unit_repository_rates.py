@@ -0,0 +1,110 @@
+import unittest
+from datetime import date, datetime, time
+from unittest.mock import MagicMock
+from zoneinfo import ZoneInfo
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.src.database.models import RateDetail
+from app.src.repository.rates import get_rate_amount, rate_index
+from app.src.services.rate_index import RateIndex
+
+
+class TestGetRateAmount(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.session = MagicMock(spec=AsyncSession)
+        self.session.execute.return_value = MagicMock()
+        self.session.execute.return_value.one.return_value = (3, None)
+        self.session.execute.return_value.scalars.return_value = [
+            RateDetail(
+                id=1,
+                rate_id=1,
+                start_date=date(2024, 1, 1),
+                end_date=date(2024, 12, 31),
+                start_hour=time(0),
+                end_hour=time(0),
+                amount=1.0,
+            ),
+            RateDetail(
+                id=2,
+                rate_id=1,
+                start_date=date(2024, 1, 1),
+                end_date=date(2024, 12, 31),
+                start_hour=time(22),
+                end_hour=time(6),
+                amount=0.5,
+            ),
+            RateDetail(
+                id=3,
+                rate_id=1,
+                start_date=date(2024, 6, 1),
+                end_date=date(2024, 8, 31),
+                start_hour=time(0),
+                end_hour=time(0),
+                amount=2.0,
+            ),
+        ]
+        rate_index.loaded_at = None
+
+    async def test_get_rate_amount(self):
+        amount = await get_rate_amount(1, self.session, datetime(2024, 3, 1, 12))
+        self.assertEqual(amount, 1.0)
+
+    async def test_get_rate_amount_night_window(self):
+        amount = await get_rate_amount(1, self.session, datetime(2024, 3, 1, 23))
+        self.assertEqual(amount, 0.5)
+        amount = await get_rate_amount(1, self.session, datetime(2024, 3, 2, 5, 59))
+        self.assertEqual(amount, 0.5)
+        amount = await get_rate_amount(1, self.session, datetime(2024, 3, 2, 6))
+        self.assertEqual(amount, 1.0)
+
+    async def test_get_rate_amount_latest_start_date(self):
+        amount = await get_rate_amount(1, self.session, datetime(2024, 7, 1, 23))
+        self.assertEqual(amount, 2.0)
+
+    async def test_get_rate_amount_out_of_range(self):
+        # the expired summer detail doesn't outlive the all-year ones
+        amount = await get_rate_amount(1, self.session, datetime(2025, 2, 1, 12))
+        self.assertEqual(amount, 1.0)
+        amount = await get_rate_amount(1, self.session, datetime(2025, 2, 1, 23))
+        self.assertEqual(amount, 0.5)
+        amount = await get_rate_amount(1, self.session, datetime(2023, 2, 1, 12))
+        self.assertEqual(amount, 1.0)
+        amount = await get_rate_amount(2, self.session, datetime(2024, 3, 1, 12))
+        self.assertIsNone(amount)
+
+    async def test_get_rate_amount_timezone(self):
+        timezone = rate_index.timezone
+        rate_index.timezone = ZoneInfo("Europe/Kyiv")
+        try:
+            # 20:00 UTC is 22:00 in Kyiv in March
+            moment = datetime(2024, 3, 1, 20, tzinfo=ZoneInfo("UTC"))
+            amount = await get_rate_amount(1, self.session, moment)
+        finally:
+            rate_index.timezone = timezone
+        self.assertEqual(amount, 0.5)
+
+    async def test_get_rate_amount_crosses_local_midnight(self):
+        timezone = rate_index.timezone
+        rate_index.timezone = ZoneInfo("Europe/Kyiv")
+        try:
+            # 21:30 UTC on May 31 is 00:30 on June 1 in Kyiv, the first
+            # moment of the summer detail
+            moment = datetime(2024, 5, 31, 21, 30, tzinfo=ZoneInfo("UTC"))
+            amount = await get_rate_amount(1, self.session, moment)
+            day_start = rate_index.day_start(moment)
+        finally:
+            rate_index.timezone = timezone
+        self.assertEqual(amount, 2.0)
+        self.assertEqual(day_start, datetime(2024, 5, 31, 21, tzinfo=ZoneInfo("UTC")))
+
+    def test_day_start_in_utc(self):
+        index = RateIndex(300.0, ZoneInfo("UTC"))
+        moment = datetime(2024, 5, 31, 21, 30, tzinfo=ZoneInfo("UTC"))
+        self.assertEqual(
+            index.day_start(moment), datetime(2024, 5, 31, tzinfo=ZoneInfo("UTC"))
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
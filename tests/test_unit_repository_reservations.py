@@ -1,12 +1,20 @@
 import unittest
-from unittest.mock import AsyncMock, MagicMock
+from unittest.mock import AsyncMock, MagicMock, patch
+
+from sqlalchemy.dialects import sqlite
+from sqlalchemy.dialects.postgresql import asyncpg
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.src.database.models import Reservation
 from app.src.schemas.reservations import ReservationModel
 from app.src.repository.reservations import (
     create_reservation,
     get_all_reservations,
-    get_debit_credit_of_reservation,
+    charge_in_house_reservations,
+    apply_to_balance,
+    get_over_limit_reservations,
+    in_part,
+    settings,
 )
 
 
@@ -33,13 +41,111 @@ class TestReservations(unittest.TestCase):
         reservations = await get_all_reservations(0, 10, self.session)
         self.assertIsInstance(reservations, list)
 
-    async def test_get_debit_credit_of_reservation(self):
-        result = MagicMock()
-        result.all.return_value = [(50.0, 0.0)]
-        self.session.execute.return_value = result
-        debit, credit = await get_debit_credit_of_reservation(1, self.session)
-        self.assertEqual(debit, 50.0)
-        self.assertEqual(credit, 0.0)
+
+class TestInPart(unittest.TestCase):
+    @staticmethod
+    def compile(clause, dialect) -> str:
+        return str(
+            clause.compile(dialect=dialect, compile_kwargs={"literal_binds": True})
+        )
+
+    def test_single_part_takes_all(self):
+        self.assertEqual(self.compile(in_part(0, 1), sqlite.dialect()), "1")
+
+    def test_postgresql_hashes_the_ids(self):
+        self.assertEqual(
+            self.compile(in_part(1, 4), asyncpg.dialect()),
+            "abs(hashtext(CAST(reservations.id AS TEXT)) % 4) = 1",
+        )
+
+    def test_sqlite_takes_the_ids(self):
+        self.assertEqual(
+            self.compile(in_part(1, 4), sqlite.dialect()),
+            "abs(reservations.id % 4) = 1",
+        )
+
+
+class TestChargeInHouseReservations(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.session = MagicMock(spec=AsyncSession)
+        self.session.execute.return_value = MagicMock()
+
+    @patch.object(settings, "scheduler_charge_catch_up", 2)
+    @patch("app.src.repository.reservations.rate_index")
+    async def test_charge_in_house_reservations(self, rate_index):
+        rate_index.ensure_fresh = AsyncMock()
+        rate_index.resolve_many.return_value = [50.0]
+        rates = MagicMock()
+        rates.scalars.return_value = [1]
+        charged = MagicMock()
+        charged.all.return_value = [(1, 1, 1), (2, None, 1)]
+        caught_up = MagicMock()
+        caught_up.all.return_value = [(3, 1, 1)]
+        open_charges = MagicMock()
+        open_charges.all.return_value = [(1, 10)]
+        self.session.execute.side_effect = [
+            MagicMock(),
+            rates,
+            charged,
+            caught_up,
+            open_charges,
+            MagicMock(),
+            MagicMock(),
+        ]
+        result = await charge_in_house_reservations(self.session)
+        self.assertEqual(result, 3)
+        # the open period of the first one is extended, the others open one
+        extended = self.session.execute.await_args_list[5].args[1]
+        self.assertEqual(extended, [{"charge_id": 10, "amount": 50.0}])
+        opened = self.session.execute.await_args_list[6].args[1]
+        self.assertEqual([charge["reservation_id"] for charge in opened], [2, 3])
+        self.assertEqual(opened[0]["debit"], 50.0)
+        # the missed minute is caught up
+        self.assertEqual(opened[1]["debit"], 100.0)
+        self.assertTrue(opened[0]["is_open"])
+        self.session.commit.assert_awaited_once()
+
+    @patch.object(settings, "scheduler_charge_catch_up", 2)
+    @patch("app.src.repository.reservations.rate_index")
+    async def test_charge_is_guarded_by_charged_minute(self, rate_index):
+        rate_index.ensure_fresh = AsyncMock()
+        rate_index.resolve_many.return_value = [50.0]
+        self.session.execute.return_value.scalars.return_value = [1]
+        self.session.execute.return_value.all.return_value = []
+        await charge_in_house_reservations(self.session)
+        statements = [
+            str(call.args[0].compile(compile_kwargs={"literal_binds": True}))
+            for call in self.session.execute.await_args_list[2:4]
+        ]
+        # every update sets the minute and only takes the rows charged before it
+        for statement in statements:
+            self.assertIn("charged_until=", statement.replace(" ", ""))
+            self.assertIn("reservations.charged_until <=", statement)
+        self.assertIn("reservations.charged_until IS NULL", statements[0])
+        self.assertNotIn("IS NULL", statements[1])
+
+    @patch("app.src.repository.reservations.rate_index")
+    async def test_charge_in_house_reservations_none(self, rate_index):
+        rate_index.ensure_fresh = AsyncMock()
+        rate_index.resolve_many.return_value = []
+        self.session.execute.return_value.scalars.return_value = []
+        result = await charge_in_house_reservations(self.session)
+        self.assertEqual(result, 0)
+        self.assertEqual(self.session.execute.await_count, 2)
+
+    async def test_apply_to_balance(self):
+        self.session.execute.return_value.first.return_value = (150.0, 100.0)
+        debit, credit = await apply_to_balance(1, 0.0, 100.0, self.session)
+        self.assertEqual(debit, 150.0)
+        self.assertEqual(credit, 100.0)
+        self.session.commit.assert_not_awaited()
+
+    async def test_get_over_limit_reservations(self):
+        rows = [(1, 1500.0, 1, "user@example.com", "user")]
+        self.session.execute.return_value.all.return_value = rows
+        result = await get_over_limit_reservations(1000, self.session)
+        self.assertEqual(result, rows)
+        self.session.execute.assert_awaited_once()
 
 
 if __name__ == "__main__":
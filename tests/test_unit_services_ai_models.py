@@ -0,0 +1,413 @@
+import asyncio
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+from time import monotonic
+from unittest.mock import AsyncMock, MagicMock, patch
+
+from app.src.services.ai_models import (
+    AIModelsClient,
+    CircuitBreaker,
+    LocalRecognizer,
+    ProvisionalPlates,
+    RecognitionUnavailable,
+    RetryBudget,
+    SingleFlight,
+    settings,
+)
+
+
+class TestCircuitBreaker(unittest.TestCase):
+    def setUp(self):
+        self.breaker = CircuitBreaker(2, 1.0, 30.0)
+
+    def test_opens_after_failures(self):
+        self.breaker.record(0.1, ok=False)
+        self.assertEqual(self.breaker.state, "closed")
+        self.breaker.record(0.1, ok=False)
+        self.assertEqual(self.breaker.state, "open")
+        self.assertFalse(self.breaker.allow())
+        self.assertEqual(self.breaker.opened, 1)
+
+    def test_slow_call_is_failure(self):
+        self.breaker.record(2.0, ok=True)
+        self.breaker.record(2.0, ok=True)
+        self.assertEqual(self.breaker.state, "open")
+
+    def test_success_resets_failures(self):
+        self.breaker.record(0.1, ok=False)
+        self.breaker.record(0.1, ok=True)
+        self.breaker.record(0.1, ok=False)
+        self.assertEqual(self.breaker.state, "closed")
+
+    def test_half_open_lets_one_probe(self):
+        self.breaker.record(0.1, ok=False)
+        self.breaker.record(0.1, ok=False)
+        self.breaker.opened_at = monotonic() - 31.0
+        self.assertEqual(self.breaker.state, "half_open")
+        self.assertTrue(self.breaker.allow())
+        self.assertFalse(self.breaker.allow())
+        self.breaker.record(0.1, ok=True)
+        self.assertEqual(self.breaker.state, "closed")
+
+    def test_failed_probe_reopens(self):
+        self.breaker.record(0.1, ok=False)
+        self.breaker.record(0.1, ok=False)
+        self.breaker.opened_at = monotonic() - 31.0
+        self.assertTrue(self.breaker.allow())
+        self.breaker.record(0.1, ok=False)
+        self.assertEqual(self.breaker.state, "open")
+        self.assertEqual(self.breaker.opened, 1)
+
+    def test_release_frees_probe(self):
+        self.breaker.record(0.1, ok=False)
+        self.breaker.record(0.1, ok=False)
+        self.breaker.opened_at = monotonic() - 31.0
+        self.assertTrue(self.breaker.allow())
+        self.breaker.release()
+        self.assertTrue(self.breaker.allow())
+
+
+class TestRetryBudget(unittest.TestCase):
+    def test_withdraw_until_empty(self):
+        budget = RetryBudget(0.5, max_tokens=2.0)
+        self.assertTrue(budget.withdraw())
+        self.assertTrue(budget.withdraw())
+        self.assertFalse(budget.withdraw())
+
+    def test_deposit_refills_up_to_max(self):
+        budget = RetryBudget(0.5, max_tokens=2.0)
+        budget.withdraw()
+        budget.withdraw()
+        budget.deposit()
+        self.assertFalse(budget.withdraw())
+        budget.deposit()
+        self.assertTrue(budget.withdraw())
+        for _ in range(10):
+            budget.deposit()
+        self.assertEqual(budget.tokens, 2.0)
+
+
+class TestHedged(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.client = AIModelsClient()
+        self.client.replicas = ["http://first", "http://second"]
+        self.client.breakers = {
+            replica: CircuitBreaker(2, 0.2, 30.0) for replica in self.client.replicas
+        }
+        self.client.hedge_delay = lambda: 0.05
+        self.cancelled = []
+
+    async def fake_attempt(self, delays: dict, replica, route, files, timeout):
+        try:
+            await asyncio.sleep(delays[replica])
+        except asyncio.CancelledError:
+            self.cancelled.append(replica)
+            raise
+        return replica
+
+    async def test_slow_attempt_is_hedged(self):
+        delays = {"http://first": 1.0, "http://second": 0.01}
+        self.client._attempt = lambda *args: self.fake_attempt(delays, *args)
+        result = await self.client._hedged("/process_image", {}, None)
+        self.assertEqual(result, "http://second")
+        self.assertEqual(self.client.hedges, 1)
+        self.assertEqual(self.cancelled, ["http://first"])
+
+    async def test_fast_attempt_is_not_hedged(self):
+        delays = {"http://first": 0.01, "http://second": 0.01}
+        self.client._attempt = lambda *args: self.fake_attempt(delays, *args)
+        result = await self.client._hedged("/process_image", {}, None)
+        self.assertEqual(result, "http://first")
+        self.assertEqual(self.client.hedges, 0)
+
+    async def test_open_breakers_reject(self):
+        for breaker in self.client.breakers.values():
+            breaker.opened_at = monotonic()
+        with self.assertRaises(RecognitionUnavailable):
+            await self.client._hedged("/process_image", {}, None)
+
+    async def test_hanging_attempt_opens_breaker(self):
+        async def hang(*args, **kwargs):
+            await asyncio.sleep(10)
+
+        self.client.post = hang
+        breaker = self.client.breakers["http://first"]
+        for _ in range(2):
+            with self.assertRaises(TimeoutError):
+                await asyncio.wait_for(
+                    self.client._attempt("http://first", "/process_image", {}, None),
+                    0.3,
+                )
+        self.assertEqual(breaker.state, "open")
+
+    async def test_cancelled_fast_attempt_is_released(self):
+        async def hang(*args, **kwargs):
+            await asyncio.sleep(10)
+
+        self.client.post = hang
+        breaker = self.client.breakers["http://first"]
+        breaker.probing = True
+        with self.assertRaises(TimeoutError):
+            await asyncio.wait_for(
+                self.client._attempt("http://first", "/process_image", {}, None),
+                0.05,
+            )
+        self.assertEqual(breaker.failures, 0)
+        self.assertFalse(breaker.probing)
+
+
+class TestPooledClient(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.client = AIModelsClient()
+
+    async def asyncTearDown(self):
+        if self.client.client is not None:
+            await self.client.client.aclose()
+
+    def test_client_is_shared(self):
+        client = self.client.get_client()
+        self.assertIs(self.client.get_client(), client)
+        self.assertEqual(str(client.base_url).rstrip("/"), self.client.replicas[0])
+
+    def test_read_timeout_is_bounded_by_deadline(self):
+        timeout = self.client.get_client().timeout
+        self.assertEqual(timeout.connect, settings.tensorflow_connect_timeout)
+        self.assertEqual(timeout.pool, settings.tensorflow_pool_timeout)
+        self.assertLessEqual(timeout.read, settings.tensorflow_deadline)
+
+    async def test_closed_client_is_reopened(self):
+        client = self.client.get_client()
+        await client.aclose()
+        self.assertIsNot(self.client.get_client(), client)
+
+    async def test_semaphore_bounds_concurrent_calls(self):
+        self.client.semaphore = asyncio.Semaphore(2)
+        peak = 0
+
+        async def post(url, **kwargs):
+            nonlocal peak
+            peak = max(peak, self.client.in_flight)
+            await asyncio.sleep(0.02)
+            return url
+
+        self.client.client = MagicMock(is_closed=False)
+        self.client.client.post = post
+        results = await asyncio.gather(
+            *(self.client.post(f"/route/{index}") for index in range(5))
+        )
+        self.assertEqual(results, [f"/route/{index}" for index in range(5)])
+        self.assertEqual(peak, 2)
+        self.assertEqual(self.client.in_flight, 0)
+        self.assertEqual(self.client.requests, 5)
+        stats = self.client.stats()
+        self.assertEqual(stats["available"], settings.tensorflow_max_concurrency)
+        self.client.client = None
+
+
+def thread_pool(max_workers, **kwargs):
+    # the workers of the real pool load the models, the threads don't
+    return ThreadPoolExecutor(max_workers)
+
+
+@patch("app.src.services.ai_models.ProcessPoolExecutor", thread_pool)
+class TestLocalRecognizer(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.recognizer = LocalRecognizer(Path("models"), 2)
+
+    def tearDown(self):
+        self.recognizer.stop()
+
+    @patch("app.src.services.ai_models.recognize_locally")
+    async def test_recognizes_in_the_pool(self, recognize_locally):
+        recognize_locally.return_value = "AB1234CD"
+        plate = await self.recognizer.recognize("/process_image", [b"image"])
+        self.assertEqual(plate, "AB1234CD")
+        recognize_locally.assert_called_once_with("/process_image", [b"image"])
+        self.assertTrue(self.recognizer.stats()["started"])
+
+    @patch("app.src.services.ai_models.recognize_locally")
+    async def test_broken_pool_is_restarted(self, recognize_locally):
+        recognize_locally.side_effect = BrokenProcessPool("a worker died")
+        with self.assertRaises(RecognitionUnavailable):
+            await self.recognizer.recognize("/process_image", [b"image"])
+        self.assertIsNone(self.recognizer.pool)
+        self.assertEqual(self.recognizer.restarts, 1)
+        recognize_locally.side_effect = None
+        recognize_locally.return_value = "AB1234CD"
+        plate = await self.recognizer.recognize("/process_image", [b"image"])
+        self.assertEqual(plate, "AB1234CD")
+
+    @patch.object(settings, "tensorflow_deadline", 0.05)
+    @patch("app.src.services.ai_models.recognize_locally")
+    async def test_deadline_is_unavailable(self, recognize_locally):
+        recognize_locally.side_effect = lambda *args: time.sleep(0.2)
+        with self.assertRaises(RecognitionUnavailable):
+            await self.recognizer.recognize("/process_image", [b"image"])
+        self.assertEqual(self.recognizer.errors, 1)
+        # the pool survives a slow image
+        self.assertIsNotNone(self.recognizer.pool)
+
+    @patch("app.src.services.ai_models.recognize_locally")
+    async def test_pipeline_error_is_unavailable(self, recognize_locally):
+        recognize_locally.side_effect = RuntimeError("Model loading error")
+        with self.assertRaises(RecognitionUnavailable):
+            await self.recognizer.recognize("/process_image", [b"image"])
+        self.assertEqual(self.recognizer.restarts, 0)
+
+    def test_stop_shuts_the_pool_down(self):
+        pool = MagicMock()
+        self.recognizer.pool = pool
+        self.recognizer.stop()
+        pool.shutdown.assert_called_once_with(wait=False, cancel_futures=True)
+        self.assertIsNone(self.recognizer.pool)
+        # a stopped recognizer stops again without an error
+        self.recognizer.stop()
+
+    def test_missing_pipeline_is_unavailable(self):
+        self.assertFalse(LocalRecognizer.is_available(Path("/nonexistent")))
+
+    @patch.object(settings, "tensorflow_backend", "auto")
+    @patch.object(LocalRecognizer, "is_available", return_value=False)
+    def test_auto_backend_falls_back_to_remote(self, is_available):
+        self.assertEqual(AIModelsClient().backend, "remote")
+
+    @patch.object(settings, "tensorflow_backend", "local")
+    @patch("app.src.services.ai_models.local_recognizer")
+    async def test_local_backend_skips_the_container(self, local_recognizer):
+        local_recognizer.recognize = AsyncMock(return_value="AB1234CD")
+        client = AIModelsClient()
+        client.call = AsyncMock()
+        plate = await client.recognize("/process_image", [b"image"])
+        self.assertEqual(plate, "AB1234CD")
+        client.call.assert_not_awaited()
+
+
+async def fake_session():
+    yield MagicMock()
+
+
+@patch("app.src.services.ai_models.get_session", fake_session)
+@patch("app.src.services.ai_models.repository_cars")
+@patch("app.src.services.ai_models.ai_models_client")
+class TestProvisionalPlates(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.plates = ProvisionalPlates(10)
+
+    async def asyncTearDown(self):
+        await self.plates.stop()
+
+    async def test_pending_plates_are_resolved(self, client, repository_cars):
+        client.recognize = AsyncMock(return_value="AB1234CD")
+        repository_cars.resolve_provisional_car = AsyncMock(return_value=MagicMock())
+        plate = self.plates.add(b"image")
+        await self.plates.resolve_pending()
+        repository_cars.resolve_provisional_car.assert_awaited_once()
+        self.assertEqual(
+            repository_cars.resolve_provisional_car.await_args.args[:2],
+            (plate, "AB1234CD"),
+        )
+        self.assertEqual(self.plates.resolved, 1)
+        self.assertTrue(self.plates.queue.empty())
+
+    async def test_unavailable_plates_stay_queued(self, client, repository_cars):
+        client.recognize = AsyncMock(side_effect=RecognitionUnavailable("down"))
+        self.plates.add(b"image")
+        await self.plates.resolve_pending()
+        self.assertEqual(self.plates.queue.qsize(), 1)
+        self.assertEqual(self.plates.failed, 0)
+
+    async def test_unresolvable_plate_is_not_retried(self, client, repository_cars):
+        client.recognize = AsyncMock(return_value="AB1234CD")
+        # the car has left, or the car with the plate is parked
+        repository_cars.resolve_provisional_car = AsyncMock(return_value=None)
+        self.plates.add(b"image")
+        self.plates.start()
+        await asyncio.sleep(0.01)
+        self.assertEqual(client.recognize.await_count, 1)
+        self.assertEqual(self.plates.failed, 1)
+        self.assertTrue(self.plates.queue.empty())
+
+    @patch.object(settings, "tensorflow_breaker_reset", 60.0)
+    async def test_retried_plate_is_queued_during_pause(self, client, repository_cars):
+        client.recognize = AsyncMock(side_effect=RecognitionUnavailable("down"))
+        repository_cars.resolve_provisional_car = AsyncMock(return_value=MagicMock())
+        self.plates.add(b"image")
+        self.plates.start()
+        await asyncio.sleep(0.01)
+        # the container is back when the car leaves
+        client.recognize = AsyncMock(return_value="AB1234CD")
+        await self.plates.resolve_pending()
+        self.assertEqual(self.plates.resolved, 1)
+
+
+class TestSingleFlight(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.single_flight = SingleFlight(60.0, 2)
+        self.calls = 0
+
+    async def call(self, result="AB1234CD", delay=0.05, error=None):
+        self.calls += 1
+        await asyncio.sleep(delay)
+        if error is not None:
+            raise error
+        return result
+
+    async def test_concurrent_callers_share_one_call(self):
+        results = await asyncio.gather(
+            *(self.single_flight.run("key", self.call) for _ in range(5))
+        )
+        self.assertEqual(results, ["AB1234CD"] * 5)
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(self.single_flight.coalesced, 4)
+
+    async def test_error_reaches_every_waiter(self):
+        async def failing():
+            return await self.call(error=RecognitionUnavailable("down"))
+
+        results = await asyncio.gather(
+            *(self.single_flight.run("key", failing) for _ in range(3)),
+            return_exceptions=True,
+        )
+        self.assertTrue(all(isinstance(r, RecognitionUnavailable) for r in results))
+        self.assertEqual(self.calls, 1)
+        # the errors are not memoized
+        self.assertEqual(await self.single_flight.run("key", self.call), "AB1234CD")
+        self.assertEqual(self.calls, 2)
+
+    async def test_memo_hit(self):
+        await self.single_flight.run("key", self.call)
+        await self.single_flight.run("key", self.call)
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(self.single_flight.memo_hits, 1)
+
+    async def test_memo_expires(self):
+        single_flight = SingleFlight(0.05, 2)
+        await single_flight.run("key", self.call)
+        await asyncio.sleep(0.1)
+        await single_flight.run("key", self.call)
+        self.assertEqual(self.calls, 2)
+        self.assertEqual(single_flight.memo_hits, 0)
+
+    async def test_memo_evicts_least_recently_used(self):
+        await self.single_flight.run("first", self.call)
+        await self.single_flight.run("second", self.call)
+        # the hit makes the first key the most recently used
+        await self.single_flight.run("first", self.call)
+        await self.single_flight.run("third", self.call)
+        self.assertIn("first", self.single_flight.memo)
+        self.assertNotIn("second", self.single_flight.memo)
+
+    async def test_cancelled_caller_does_not_cancel_call(self):
+        waiter = asyncio.ensure_future(self.single_flight.run("key", self.call))
+        other = asyncio.ensure_future(self.single_flight.run("key", self.call))
+        await asyncio.sleep(0.01)
+        waiter.cancel()
+        self.assertEqual(await other, "AB1234CD")
+        self.assertEqual(self.calls, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
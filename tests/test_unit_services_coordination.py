@@ -0,0 +1,106 @@
+import asyncio
+import unittest
+
+try:
+    import fakeredis
+except ImportError as error:
+    raise unittest.SkipTest(f"fakeredis is not installed: {error}")
+
+from app.src.services.coordination import JobCoordinator
+
+
+class CoordinationTestCase(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.server = fakeredis.FakeServer()
+        self.coordinators = []
+
+    def coordinator(self, mode: str, lease_ttl: float = 15.0) -> JobCoordinator:
+        coordinator = JobCoordinator(mode, lease_ttl)
+        coordinator.redis = fakeredis.FakeAsyncRedis(
+            server=self.server, decode_responses=True
+        )
+        self.coordinators.append(coordinator)
+        return coordinator
+
+    async def asyncTearDown(self):
+        for coordinator in self.coordinators:
+            await coordinator.shutdown()
+
+
+class TestLeaderMode(CoordinationTestCase):
+    async def test_one_replica_holds_the_lease(self):
+        first, second = self.coordinator("leader"), self.coordinator("leader")
+        self.assertEqual(await first.assignment(), (0, 1))
+        self.assertIsNone(await second.assignment())
+        self.assertEqual(first.acquisitions, 1)
+        self.assertEqual(second.jobs_skipped, 1)
+
+    async def test_holder_renews_the_lease(self):
+        first, second = self.coordinator("leader"), self.coordinator("leader")
+        await first.assignment()
+        await second.assignment()
+        self.assertEqual(await first.assignment(), (0, 1))
+        self.assertEqual(first.renewals, 1)
+        self.assertFalse(second.is_leader)
+
+    async def test_released_lease_is_taken_over(self):
+        first, second = self.coordinator("leader"), self.coordinator("leader")
+        await first.assignment()
+        await first.shutdown()
+        self.assertEqual(await second.assignment(), (0, 1))
+
+    async def test_release_keeps_the_lease_of_another_replica(self):
+        first, second = self.coordinator("leader"), self.coordinator("leader")
+        await first.assignment()
+        await second.shutdown()
+        self.assertEqual(await first.assignment(), (0, 1))
+        self.assertEqual(first.renewals, 1)
+
+    async def test_expired_lease_is_taken_over(self):
+        first = self.coordinator("leader", lease_ttl=0.1)
+        second = self.coordinator("leader", lease_ttl=0.1)
+        await first.assignment()
+        await asyncio.sleep(0.15)
+        self.assertEqual(await second.assignment(), (0, 1))
+        self.assertIsNone(await first.assignment())
+        self.assertEqual(first.losses, 1)
+
+
+class TestPartitionedMode(CoordinationTestCase):
+    async def test_replicas_get_distinct_slices(self):
+        replicas = [self.coordinator("partitioned") for _ in range(3)]
+        for replica in replicas:
+            await replica.assignment()
+        assignments = [await replica.assignment() for replica in replicas]
+        self.assertEqual(sorted(assignments), [(0, 3), (1, 3), (2, 3)])
+        # the slices follow the order of the replica IDs
+        by_id = sorted(replicas, key=lambda replica: replica.replica_id)
+        self.assertEqual([replica.part for replica in by_id], [0, 1, 2])
+
+    async def test_leaving_replica_hands_its_slice_over(self):
+        first = self.coordinator("partitioned")
+        second = self.coordinator("partitioned")
+        await first.assignment()
+        await second.assignment()
+        self.assertEqual((await first.assignment())[1], 2)
+        await second.shutdown()
+        self.assertEqual(await first.assignment(), (0, 1))
+
+    async def test_expired_replica_is_forgotten(self):
+        first = self.coordinator("partitioned", lease_ttl=0.1)
+        second = self.coordinator("partitioned", lease_ttl=0.1)
+        await first.assignment()
+        await second.assignment()
+        await asyncio.sleep(0.15)
+        self.assertEqual(await first.assignment(), (0, 1))
+
+
+class TestAllMode(unittest.IsolatedAsyncioTestCase):
+    async def test_every_replica_runs_the_jobs(self):
+        coordinator = JobCoordinator("all", 15.0)
+        self.assertEqual(await coordinator.assignment(), (0, 1))
+        self.assertIsNone(coordinator.redis)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,100 @@
+import asyncio
+import unittest
+from unittest.mock import AsyncMock, MagicMock
+
+try:
+    import fakeredis
+except ImportError as error:
+    raise unittest.SkipTest(f"fakeredis is not installed: {error}")
+
+from aiosmtplib import SMTPException
+
+from app.src.services.notifications import LimitWarningNotifier
+
+
+LIMIT = 1000
+
+
+def row(reservation_id, balance=1500.0):
+    return (reservation_id, balance, 1, f"user{reservation_id}@example.com", "user")
+
+
+class TestLimitWarningNotifier(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.notifier = LimitWarningNotifier(2, 1, 3600)
+        self.notifier.redis = fakeredis.FakeAsyncRedis(decode_responses=True)
+        self.notifier.queue = asyncio.Queue(self.notifier.queue_size)
+        self.notifier.template = MagicMock()
+        self.notifier.template.render.return_value = "<p>Limit warning</p>"
+        self.mailer = MagicMock()
+        self.mailer.send = AsyncMock()
+        self.mailer.close = AsyncMock()
+
+    async def asyncTearDown(self):
+        await self.notifier.shutdown()
+
+    def start(self):
+        self.notifier.mailers = [self.mailer]
+        self.notifier.tasks = [asyncio.create_task(self.notifier.work(self.mailer))]
+
+    async def test_threshold_is_warned_once(self):
+        self.assertEqual(await self.notifier.notify([row(1)], LIMIT), 1)
+        self.assertEqual(await self.notifier.notify([row(1, 1900.0)], LIMIT), 0)
+        self.assertEqual(self.notifier.duplicates, 1)
+        self.assertEqual(await self.notifier.redis.ttl("limit_warning:1:1000"), 3600)
+
+    async def test_next_threshold_is_warned(self):
+        await self.notifier.notify([row(1)], LIMIT)
+        self.assertEqual(await self.notifier.notify([row(1, 2100.0)], LIMIT), 1)
+
+    async def test_overflow_is_dropped_and_forgotten(self):
+        queued = await self.notifier.notify([row(1), row(2), row(3)], LIMIT)
+        self.assertEqual(queued, 2)
+        self.assertEqual(self.notifier.dropped, 1)
+        # the dropped warning is tried again on the next check
+        self.assertIsNone(await self.notifier.redis.get("limit_warning:3:1000"))
+        self.notifier.queue.get_nowait()
+        self.assertEqual(await self.notifier.notify([row(3)], LIMIT), 1)
+
+    async def test_worker_sends_the_warnings(self):
+        self.start()
+        await self.notifier.notify([row(1), row(2)], LIMIT)
+        await self.notifier.queue.join()
+        self.assertEqual(self.mailer.send.await_count, 2)
+        self.assertEqual(self.notifier.sent, 2)
+        message = self.mailer.send.await_args.args[0]
+        self.assertEqual(message["To"], "user2@example.com")
+
+    async def test_failed_warning_is_forgotten(self):
+        self.mailer.send.side_effect = SMTPException("down")
+        self.start()
+        await self.notifier.notify([row(1)], LIMIT)
+        await self.notifier.queue.join()
+        self.assertEqual(self.notifier.failed, 1)
+        self.mailer.close.assert_awaited()
+        self.assertIsNone(await self.notifier.redis.get("limit_warning:1:1000"))
+
+    async def test_worker_survives_other_errors(self):
+        self.notifier.template.render.side_effect = [ValueError("template"), "<p/>"]
+        self.start()
+        await self.notifier.notify([row(1), row(2)], LIMIT)
+        await self.notifier.queue.join()
+        self.assertEqual(self.notifier.failed, 1)
+        self.assertEqual(self.notifier.sent, 1)
+
+    async def test_shutdown_stops_the_workers(self):
+        self.start()
+        tasks = self.notifier.tasks
+        await self.notifier.shutdown()
+        self.assertTrue(all(task.cancelled() for task in tasks))
+        self.assertEqual(self.notifier.tasks, [])
+        self.mailer.close.assert_awaited_once()
+        self.assertIsNone(self.notifier.redis)
+
+    async def test_not_started_queues_nothing(self):
+        notifier = LimitWarningNotifier(2, 1, 3600)
+        self.assertEqual(await notifier.notify([row(1)], LIMIT), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()